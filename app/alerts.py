@@ -0,0 +1,193 @@
+import math
+import bisect
+import threading
+
+from config import logger
+from .metrics import metrics
+from .delivery import push_message
+from .store import get_alert_store_version, load_alerts, remove_alerts, restore_alerts
+
+## Price/Indicator Alerts
+#
+# Alerts registered by the users (e.g. "2330 收盤 > 1000", "3008 K9 > D9") fire once, when the value
+# crosses the threshold (or the other indicator) between two updates: the daily update, or an intraday tick.
+# They are removed once they fire, and put back if their notification cannot be pushed.
+
+# Names of the alert fields in the commands -> market data / panel fields
+ALERT_FIELD_SETTING = {
+    "收盤": "收盤",
+    "開盤": "開盤",
+    "最高": "最高",
+    "最低": "最低",
+    "成交量": "volume",
+    "K9": "k9",
+    "D9": "d9",
+    "J9": "j9",
+    "MA5": "mean5",
+    "MA10": "mean10",
+    "MA20": "mean20",
+    "MA60": "mean60",
+    "DIF": "dif",
+    "MACD": "macd",
+    "OSC": "osc",
+}
+ALERT_FIELD_NAMES = {field: name for name, field in ALERT_FIELD_SETTING.items()}
+
+
+class AlertIndex:
+    """
+    Alerts indexed for the updates of the values of a stock.
+
+    Threshold alerts are kept in one sorted threshold list per (stock, field, direction), so the alerts
+    crossed by a move from `previous` to `current` are the slice between two binary searches.
+    Alerts comparing two fields are kept per stock and checked directly.
+    """
+
+    def __init__(self, alerts):
+        # (stock id, field, direction) -> (sorted thresholds, alert ids in the same order)
+        self._thresholds = {}
+        # stock id -> [(field, other field, direction, alert id), ...]
+        self._crosses = {}
+        # stock id -> keys of `_thresholds`
+        self._threshold_keys = {}
+        self.fields = set()
+        entries = {}
+        for alert_id, alert in alerts.items():
+            stock_id, field, direction = alert["stock_id"], alert["field"], alert["direction"]
+            self.fields.add(field)
+            if alert.get("other_field"):
+                self.fields.add(alert["other_field"])
+                self._crosses.setdefault(stock_id, []).append((field, alert["other_field"], direction, alert_id))
+            else:
+                entries.setdefault((stock_id, field, direction), []).append((float(alert["threshold"]), alert_id))
+        for key, key_entries in entries.items():
+            key_entries.sort()
+            self._thresholds[key] = ([threshold for threshold, _ in key_entries], [alert_id for _, alert_id in key_entries])
+            self._threshold_keys.setdefault(key[0], []).append(key)
+        self.stock_ids = set(self._threshold_keys) | set(self._crosses)
+
+    # Ids of the alerts of a stock crossed by the move of its values (field -> value) from `previous` to `current`
+    def find_triggered(self, stock_id, previous, current) -> list:
+        triggered = []
+        for key in self._threshold_keys.get(stock_id, []):
+            _, field, direction = key
+            previous_value, current_value = previous.get(field), current.get(field)
+            if _is_missing(previous_value) or _is_missing(current_value):
+                continue
+            thresholds, alert_ids = self._thresholds[key]
+            # Above: previous < threshold <= current, below: current <= threshold < previous
+            if direction == "above" and current_value > previous_value:
+                triggered.extend(alert_ids[bisect.bisect_right(thresholds, previous_value):bisect.bisect_right(thresholds, current_value)])
+            elif direction == "below" and current_value < previous_value:
+                triggered.extend(alert_ids[bisect.bisect_left(thresholds, current_value):bisect.bisect_left(thresholds, previous_value)])
+        for field, other_field, direction, alert_id in self._crosses.get(stock_id, []):
+            values = [previous.get(field), previous.get(other_field), current.get(field), current.get(other_field)]
+            if any(_is_missing(value) for value in values):
+                continue
+            previous_difference, current_difference = values[0] - values[1], values[2] - values[3]
+            if direction == "above" and previous_difference < 0 <= current_difference:
+                triggered.append(alert_id)
+            elif direction == "below" and current_difference <= 0 < previous_difference:
+                triggered.append(alert_id)
+        return triggered
+
+
+def _is_missing(value) -> bool:
+    return value is None or math.isnan(value)
+
+
+class AlertEngine:
+    """Alert index of the alert store, rebuilt only when the alerts change (they are added from the LINE Bot)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._alerts = {}
+        self.index = AlertIndex({})
+
+    def refresh(self):
+        version = get_alert_store_version()
+        with self._lock:
+            if version != self._version:
+                self._alerts = load_alerts()
+                self.index = AlertIndex(self._alerts)
+                self._version = version
+
+    # Find the alerts triggered by updates (stock id -> (previous values, current values)), and remove them from the store
+    def check(self, updates) -> list:
+        self.refresh()
+        index, alerts = self.index, self._alerts
+        triggered = []
+        for stock_id in index.stock_ids.intersection(updates):
+            previous, current = updates[stock_id]
+            for alert_id in index.find_triggered(stock_id, previous, current):
+                triggered.append((alert_id, alerts[alert_id], current))
+        if triggered:
+            # An alert triggered at the same time by another process (e.g. an intraday tick) is notified only once
+            removed_ids = set(remove_alerts([alert_id for alert_id, _, _ in triggered]))
+            triggered = [each for each in triggered if each[0] in removed_ids]
+            metrics.inc("alerts_triggered_total", len(triggered))
+        return triggered
+
+
+alert_engine = AlertEngine()
+
+
+# (Public) Previous and current values of some stocks and fields in the merged market data: stock id -> (previous, current)
+def get_market_data_updates(market_data_df, stock_ids, fields) -> dict:
+    # Imported here, so the LINE Bot commands do not load pandas
+    from .backtest.panel import PRICE_FIELDS
+
+    updates = {}
+    for stock_id in market_data_df.index.intersection(list(stock_ids)):
+        row = market_data_df.loc[stock_id]
+        previous, current = {}, {}
+        for field in fields:
+            column = "daily_k" if field in PRICE_FIELDS else field
+            history = row.get(column)
+            # History columns: [(date, value), ...], with the prices as dicts in "daily_k"
+            if not isinstance(history, list) or len(history) < 2:
+                continue
+            (_, previous_value), (_, current_value) = history[-2], history[-1]
+            if column == "daily_k":
+                previous_value, current_value = previous_value[field], current_value[field]
+            previous[field], current[field] = _to_float(previous_value), _to_float(current_value)
+        updates[stock_id] = (previous, current)
+    return updates
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# (Public) Describe an alert, e.g. "2330 收盤 > 1000" or "3008 K9 > D9"
+def describe_alert(alert) -> str:
+    operator = ">" if alert["direction"] == "above" else "<"
+    target = ALERT_FIELD_NAMES.get(alert["other_field"]) if alert.get("other_field") else f"{alert['threshold']:g}"
+    return f"{alert['stock_id']} {ALERT_FIELD_NAMES.get(alert['field'], alert['field'])} {operator} {target}"
+
+
+def _format_value(value) -> str:
+    return "-" if _is_missing(value) else f"{value:,.2f}".rstrip("0").rstrip(".")
+
+
+# (Public) Push the triggered alerts (from `AlertEngine.check`) to their users, one message per user
+# The alerts of the users whose push failed are put back in the store, to fire again on their next crossing
+def notify_alerts(line_bot_api, triggered) -> int:
+    lines_by_user, alerts_by_user = {}, {}
+    for alert_id, alert, current in triggered:
+        value = _format_value(current.get(alert["field"]))
+        lines_by_user.setdefault(alert["user_id"], []).append(f"#{alert_id} {describe_alert(alert)} (目前 {value})")
+        alerts_by_user.setdefault(alert["user_id"], {})[alert_id] = alert
+    sent = 0
+    for user_id, lines in lines_by_user.items():
+        if push_message(line_bot_api, user_id, "🔔 到價提醒\n" + "\n".join(lines)):
+            sent += 1
+        else:
+            restore_alerts(alerts_by_user[user_id])
+            logger.warning(f"Restored {len(alerts_by_user[user_id])} alerts of a user whose push failed")
+    logger.info(f"Pushed {len(triggered)} triggered alerts to {sent}/{len(lines_by_user)} users")
+    return sent
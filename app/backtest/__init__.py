@@ -0,0 +1,3 @@
+from .panel import Panel, build_panel_from_market_data, build_panel_from_histories, split_panel_to_histories
+from .engine import run_backtest, evaluate_strategy_panel, remove_daily_conditions, get_daily_field_coverage
+from .sweep import sweep_parameters
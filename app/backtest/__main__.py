@@ -0,0 +1,58 @@
+import json
+import argparse
+
+from config import logger
+from app.store import load_history_panel
+from app.strategies import specs
+from app.strategies.specs import iter_conditions
+from .engine import get_daily_field_coverage, is_daily_condition, remove_daily_conditions, run_backtest
+from .sweep import sweep_parameters
+
+# Usage: python -m app.backtest --strategy 1 --holding-days 5 --start-date 2024-01-01
+#        python -m app.backtest --strategy 1 --grid '[["收盤價 > 20", "threshold", [10, 20, 30]]]'
+#        python -m app.backtest --strategy 1 --skip-daily-conditions
+#
+# Chip and revenue fields (外資買賣超, 營收, ...) only exist in the history store on the dates the pipeline ran,
+# so the strategies using them only have signals on those dates. `--skip-daily-conditions` backtests
+# the other conditions over the whole history instead.
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtest a strategy over the stored history panel.")
+    parser.add_argument("--strategy", type=int, default=1, help="Strategy number (e.g. 1 for STRATEGY_1)")
+    parser.add_argument("--holding-days", type=int, default=5, help="Forward return horizon in trading days")
+    parser.add_argument("--start-date", default=None, help="First signal date, in YYYY-MM-DD format")
+    parser.add_argument("--end-date", default=None, help="Last signal date, in YYYY-MM-DD format")
+    parser.add_argument("--grid", default=None, help="Parameter sweep as a JSON list of [condition name, parameter name, values]")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes for the parameter sweep")
+    parser.add_argument("--top", type=int, default=10, help="Number of parameter combinations to show")
+    parser.add_argument("--skip-daily-conditions", action="store_true", help="Leave out the chip and revenue conditions, which only have data on the dates the pipeline ran")
+    args = parser.parse_args()
+
+    strategy_spec = getattr(specs, f"STRATEGY_{args.strategy}")
+    panel = load_history_panel()
+    logger.info(f"歷史資料大小 (日期 x 股票) {panel.shape}")
+    daily_conditions = [condition["name"] for _, condition in iter_conditions(strategy_spec) if is_daily_condition(condition)]
+    if daily_conditions:
+        covered_dates, total_dates = get_daily_field_coverage(panel)
+        if args.skip_daily_conditions:
+            strategy_spec = remove_daily_conditions(strategy_spec)
+            logger.info(f"略過籌碼/營收條件: {', '.join(daily_conditions)}")
+        else:
+            logger.warning(
+                f"籌碼/營收條件 ({', '.join(daily_conditions)}) 只有 {covered_dates}/{total_dates} 天有資料 (執行過更新的日期)，"
+                f"其他日期不會有訊號，可使用 --skip-daily-conditions 略過這些條件"
+            )
+    if args.grid:
+        grid = {(name, param): values for name, param, values in json.loads(args.grid)}
+        result_df = sweep_parameters(panel, strategy_spec, grid, args.holding_days, max_workers=args.workers)
+        logger.info(f"[{strategy_spec['name']}] 參數組合共 {len(result_df)} 組，前 {args.top} 組結果\n{result_df.head(args.top).to_string()}")
+        return
+    result = run_backtest(panel, strategy_spec, args.holding_days, args.start_date, args.end_date)
+    logger.info(f"[{strategy_spec['name']}] 持有 {args.holding_days} 天回測結果")
+    for key in ["signals", "hit_rate", "average_return", "max_drawdown"]:
+        logger.info(f"{key}: {result[key]}")
+
+
+if __name__ == "__main__":
+    main()
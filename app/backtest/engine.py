@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+
+from functools import reduce
+from ..strategies import chip, fundamental
+from ..strategies.specs import STRATEGY_CATEGORIES, evaluate_condition, iter_conditions
+from .kernels import PANEL_KERNELS
+from .panel import DAILY_FIELDS
+
+# Industries excluded from every watch list (same as `views._update_watch_list`)
+EXCLUDED_INDUSTRIES = ["生技醫療業"]
+
+
+# Check functions which read daily-only fields (chip flows, revenue): the history store only has them
+# on the dates the pipeline ran, so these conditions fail on every other date of a backtest
+DAILY_CONDITION_MODULES = [chip.__name__, fundamental.__name__]
+
+
+def is_daily_condition(condition) -> bool:
+    if "any_of" in condition:
+        return any(is_daily_condition(sub_condition) for sub_condition in condition["any_of"])
+    return condition["func"].__module__ in DAILY_CONDITION_MODULES
+
+
+# (Public) The strategy without its daily-only conditions, to backtest the other conditions over the whole history
+def remove_daily_conditions(strategy_spec) -> dict:
+    return {
+        **strategy_spec,
+        **{
+            category: [condition for condition in strategy_spec.get(category, []) if not is_daily_condition(condition)]
+            for category in STRATEGY_CATEGORIES
+        },
+    }
+
+
+# (Public) Number of dates of a panel with any daily-only field (i.e. the dates the pipeline ran), and of all its dates
+def get_daily_field_coverage(panel) -> tuple:
+    has_daily_data = np.zeros(len(panel.dates), dtype=bool)
+    for field in DAILY_FIELDS:
+        if field in panel:
+            has_daily_data |= panel[field].notna().any(axis=1).to_numpy()
+    return int(has_daily_data.sum()), len(panel.dates)
+
+
+# Evaluate all conditions of a strategy on a panel, and return the (date x stock) signal mask
+def evaluate_strategy_panel(panel, strategy_spec, exclude_industries=EXCLUDED_INDUSTRIES) -> pd.DataFrame:
+    masks = [
+        evaluate_condition(panel, condition, func_map=PANEL_KERNELS).fillna(False).astype(bool)
+        for _, condition in iter_conditions(strategy_spec)
+    ]
+    all_stocks = pd.DataFrame(True, index=panel.dates, columns=panel.stock_ids)
+    signals = reduce(lambda x, y: (x & y), masks, all_stocks)
+    if exclude_industries:
+        excluded = panel.industry.isin(exclude_industries).reindex(signals.columns, fill_value=False).values
+        signals.loc[:, excluded] = False
+    return signals
+
+
+# Forward N-day return of buying at today's close and selling at the close N trading days later
+def get_forward_returns(panel, holding_days=5) -> pd.DataFrame:
+    close = panel["收盤"]
+    return close.shift(-holding_days) / close - 1
+
+
+# Summarize the trades (one per signal) of a backtest
+def summarize_signals(signals, forward_returns, holding_days=5) -> dict:
+    trade_returns = forward_returns.where(signals)
+    # Signals too recent to have an N-day forward return are not counted
+    returns = trade_returns.stack().dropna()
+    if returns.empty:
+        return {"signals": 0, "hit_rate": None, "average_return": None, "max_drawdown": None}
+    # Equity curve: the capital is split into `holding_days` tranches, and each day's tranche buys that day's signals equally weighted
+    daily_returns = trade_returns.mean(axis=1).fillna(0)
+    equity = (1 + daily_returns / holding_days).cumprod()
+    drawdown = equity / equity.cummax() - 1
+    return {
+        "signals": int(returns.shape[0]),
+        "hit_rate": round(float((returns > 0).mean()), 4),
+        "average_return": round(float(returns.mean()), 4),
+        "max_drawdown": round(float(drawdown.min()), 4),
+    }
+
+
+def run_backtest(panel, strategy_spec, holding_days=5, start_date=None, end_date=None, exclude_industries=EXCLUDED_INDUSTRIES) -> dict:
+    """
+    Backtest a strategy spec over every (date, stock) cell of a historical panel in one vectorized pass.
+
+    The whole panel is used to evaluate the conditions (so look-back windows have history),
+    and only signals between `start_date` and `end_date` are counted as trades.
+
+    Returns a dict with the trade statistics (`signals`, `hit_rate`, `average_return`,
+    `max_drawdown`) and the `trades` DataFrame (date, stock id, forward return).
+    """
+    signals = evaluate_strategy_panel(panel, strategy_spec, exclude_industries)
+    forward_returns = get_forward_returns(panel, holding_days)
+    date_mask = np.ones(len(signals.index), dtype=bool)
+    if start_date:
+        date_mask &= signals.index >= pd.Timestamp(start_date)
+    if end_date:
+        date_mask &= signals.index <= pd.Timestamp(end_date)
+    signals, forward_returns = signals[date_mask], forward_returns[date_mask]
+    result = summarize_signals(signals, forward_returns, holding_days)
+    trades = forward_returns.where(signals).stack().dropna()
+    trades.index.names = ["日期", "代號"]
+    result["trades"] = trades.rename("報酬率").reset_index()
+    result["holding_days"] = holding_days
+    return result
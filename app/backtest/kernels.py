@@ -0,0 +1,162 @@
+import pandas as pd
+
+from ..strategies import technical, chip, industry
+
+## Vectorized Panel Kernels
+#
+# Each kernel has the same parameters as its row-wise `*_check_df` counterpart, but
+# evaluates the condition for every (date, stock) cell of a panel at once and returns
+# a boolean (date x stock) DataFrame. "Today" is each row of the panel, and "yesterday"
+# is the previous row. Check functions that only compare columns (e.g.
+# `chip.foreign_buy_positive_check_df`) need no kernel, since they work on a panel as is.
+
+
+# The mask holds for the last N days (including today)
+def _all_days(mask: pd.DataFrame, days: int) -> pd.DataFrame:
+    result = mask.copy()
+    for shift in range(1, days):
+        result &= mask.shift(shift, fill_value=False)
+    return result
+
+
+# The mask holds on at least one of the last N days (including today)
+def _any_days(mask: pd.DataFrame, days: int) -> pd.DataFrame:
+    return mask.astype(float).rolling(max(days, 1), min_periods=1).max() > 0
+
+
+def _compare(values_1, values_2, direction) -> pd.DataFrame:
+    return values_1 > values_2 if direction == "more" else values_1 < values_2
+
+
+def today_price_is_max_check_panel(panel, price_type="收盤", days=3):
+    values = panel[price_type]
+    return values == values.rolling(days, min_periods=1).max()
+
+
+def volume_greater_check_panel(panel, shares_threshold=500, days=1):
+    return _all_days(panel["volume"] >= shares_threshold, days)
+
+
+def today_price_is_not_min_check_panel(panel, price_type="收盤", days=3):
+    values = panel[price_type]
+    return values.notna() & (values != values.rolling(days, min_periods=1).min())
+
+
+def today_price_is_not_max_check_panel(panel, price_type="收盤", days=3):
+    values = panel[price_type]
+    return values.notna() & (values != values.rolling(days, min_periods=1).max())
+
+
+def technical_indicator_greater_or_less_one_day_check_panel(
+    panel, indicator_1="收盤", indicator_2="mean5", direction="more", threshold=1, days=1
+):
+    mask = _compare(panel[indicator_1], threshold * panel[indicator_2], direction)
+    return _all_days(mask, days)
+
+
+def technical_indicator_difference_one_day_check_panel(
+    panel, indicator_1="k9", indicator_2="d9", difference_threshold=10, days=1
+):
+    mask = (panel[indicator_1] - panel[indicator_2]).abs() < difference_threshold
+    return _all_days(mask, days)
+
+
+def technical_indicator_greater_or_less_two_day_check_panel(
+    panel, indicator_1="k9", indicator_2="k9", direction="more", threshold=1, days=1
+):
+    mask = _compare(panel[indicator_1], threshold * panel[indicator_2].shift(1), direction)
+    return _all_days(mask, days)
+
+
+def technical_indicator_difference_two_day_check_panel(
+    panel,
+    indicator_1="最高",
+    indicator_2="收盤",
+    direction="less",
+    threshold=0.035,
+    indicator_3="收盤",
+    days=1,
+):
+    difference = panel[indicator_1] - panel[indicator_2]
+    mask = _compare(difference, threshold * panel[indicator_3].shift(1), direction)
+    return _all_days(mask, days)
+
+
+def technical_indicator_difference_greater_two_day_check_panel(
+    panel, indicator_1="k9", indicator_2="d9", days=1
+):
+    difference = panel[indicator_1] - panel[indicator_2]
+    return _all_days(difference >= difference.shift(1), days)
+
+
+def golden_cross_check_panel(panel, indicator_1="k9", indicator_2="d9", days=5):
+    values_1, values_2 = panel[indicator_1], panel[indicator_2]
+    return (values_1 > values_2) & _any_days(values_1 < values_2, days)
+
+
+def technical_indicator_constant_check_panel(
+    panel, indicator="k9", direction="more", threshold=20, days=1
+):
+    return _all_days(_compare(panel[indicator], threshold, direction), days)
+
+
+def skyrocket_check_panel(
+    panel, n_days=10, k_change=0.20, consecutive_red_no_upper_shadow_days=2, lookback_days=technical.DEFAULT_LOOKBACK_DAYS
+):
+    close, high = panel["收盤"], panel["最高"]
+    # 任意 n_days 內漲幅達 k_change (the surge must end inside the lookback window)
+    surge = (close / close.shift(n_days) - 1) >= k_change
+    long_term_flag = _any_days(surge, lookback_days - n_days)
+    # 任意 consecutive_red_no_upper_shadow_days 內每天都漲幅大於 9% 且收在最高
+    if consecutive_red_no_upper_shadow_days == 0:
+        short_term_flag = close.notna()
+    else:
+        limit_up = (close == high) & (close / close.shift(1) > 1.09)
+        consecutive_limit_up = _all_days(limit_up, consecutive_red_no_upper_shadow_days)
+        short_term_flag = _any_days(consecutive_limit_up, lookback_days - consecutive_red_no_upper_shadow_days)
+    return long_term_flag & short_term_flag
+
+
+def single_institutional_buy_check_panel(panel, single_volume_threshold=10):
+    single_volume_threshold_actual = panel["成交量"] * (single_volume_threshold / 100)
+    return (
+        (panel["外資買賣超"] >= single_volume_threshold_actual)
+        | (panel["投信買賣超"] >= single_volume_threshold_actual)
+        | (panel["自營商買賣超"] >= single_volume_threshold_actual)
+    )
+
+
+def total_institutional_buy_check_panel(panel, total_volume_threshold=10):
+    return panel["三大法人買賣超"] >= panel["成交量"] * (total_volume_threshold / 100)
+
+
+def foreign_buy_check_panel(panel, total_volume_threshold=10):
+    return panel["外資買賣超"] >= panel["成交量"] * (total_volume_threshold / 100)
+
+
+def industry_stat_check_panel(panel, stat="站上MA20比例(%)", direction="more", threshold=60):
+    # Stats of each industry (date x industry), broadcast to the stocks of the industry
+    industry_values = industry.get_industry_stats_panel(panel)[stat]
+    values = industry_values.reindex(columns=panel.industry.values).set_axis(panel.stock_ids, axis=1)
+    return _compare(values, threshold, direction)
+
+
+# Row-wise check function -> vectorized panel kernel (used as `func_map` of `specs.evaluate_condition`)
+PANEL_KERNELS = {
+    technical.today_price_is_max_check_df: today_price_is_max_check_panel,
+    technical.volume_greater_check_df: volume_greater_check_panel,
+    technical.today_price_is_not_min_check_df: today_price_is_not_min_check_panel,
+    technical.today_price_is_not_max_check_df: today_price_is_not_max_check_panel,
+    technical.technical_indicator_greater_or_less_one_day_check_df: technical_indicator_greater_or_less_one_day_check_panel,
+    technical.technical_indicator_difference_one_day_check_df: technical_indicator_difference_one_day_check_panel,
+    technical.technical_indicator_greater_or_less_two_day_check_df: technical_indicator_greater_or_less_two_day_check_panel,
+    technical.technical_indicator_difference_two_day_check_df: technical_indicator_difference_two_day_check_panel,
+    technical.technical_indicator_difference_greater_two_day_check_df: technical_indicator_difference_greater_two_day_check_panel,
+    technical.golden_cross_check_df: golden_cross_check_panel,
+    technical.technical_indicator_constant_check_df: technical_indicator_constant_check_panel,
+    technical.skyrocket_check_df: skyrocket_check_panel,
+    chip.single_institutional_buy_check_df: single_institutional_buy_check_panel,
+    chip.total_institutional_buy_check_df: total_institutional_buy_check_panel,
+    chip.foreign_buy_check_df: foreign_buy_check_panel,
+    industry.industry_stat_check_df: industry_stat_check_panel,
+}
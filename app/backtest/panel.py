@@ -0,0 +1,149 @@
+import numpy as np
+import pandas as pd
+
+# Price fields are stored inside the "daily_k" history of the market data
+PRICE_FIELDS = ["開盤", "最高", "最低", "收盤"]
+
+# Indicator fields stored as [(date, value), ...] histories in the market data
+HISTORY_FIELDS = [
+    "k9", "d9", "j9", "dif", "macd", "osc",
+    "mean5", "mean10", "mean20", "mean60",
+    "volume", "mean_5_volume", "mean_20_volume",
+]
+
+# Fields available only for the data date (one value per stock per day)
+DAILY_FIELDS = [
+    "成交量", "漲跌", "本益比", "股價淨值比", "殖利率(%)",
+    "融資餘額", "融資變化量", "融券餘額", "融券變化量", "券資比(%)",
+    "外資買賣超", "投信買賣超", "自營商買賣超", "三大法人買賣超",
+    "(月)營收月增率(%)", "(月)營收年增率(%)", "(月)累積營收年增率(%)",
+]
+
+
+class Panel:
+    """
+    Historical panel: one (date x stock) DataFrame per field, all sharing the same axes.
+
+    `panel[field]` returns the DataFrame of a field, so column-based check functions
+    (e.g. `chip.foreign_buy_positive_check_df`) can be evaluated on a panel directly.
+    """
+
+    def __init__(self, fields: dict, industry: pd.Series = None):
+        dates = pd.DatetimeIndex(sorted(set().union(*[df.index for df in fields.values()]))) if fields else pd.DatetimeIndex([])
+        stock_ids = sorted(set().union(*[df.columns for df in fields.values()])) if fields else []
+        self.fields = {
+            field: df.reindex(index=dates, columns=stock_ids).astype(float)
+            for field, df in fields.items()
+        }
+        self.dates = dates
+        self.stock_ids = pd.Index(stock_ids, name="代號")
+        self.industry = (industry if industry is not None else pd.Series(dtype=object)).reindex(self.stock_ids)
+
+    def __getitem__(self, field) -> pd.DataFrame:
+        if field not in self.fields:
+            # Missing fields evaluate as unavailable data, like the row-wise checks do
+            return pd.DataFrame(float("nan"), index=self.dates, columns=self.stock_ids)
+        return self.fields[field]
+
+    def __contains__(self, field) -> bool:
+        return field in self.fields
+
+    @property
+    def shape(self) -> tuple:
+        return len(self.dates), len(self.stock_ids)
+
+    # Restrict the panel to a date range (inclusive) and/or a subset of stocks
+    def select(self, start_date=None, end_date=None, stock_ids=None):
+        date_mask = np.ones(len(self.dates), dtype=bool)
+        if start_date:
+            date_mask &= self.dates >= pd.Timestamp(start_date)
+        if end_date:
+            date_mask &= self.dates <= pd.Timestamp(end_date)
+        dates = self.dates[date_mask]
+        stock_ids = self.stock_ids if stock_ids is None else self.stock_ids.intersection(stock_ids)
+        return Panel(
+            {field: df.loc[dates, stock_ids] for field, df in self.fields.items()},
+            self.industry.loc[stock_ids],
+        )
+
+
+def _history_to_frame(histories: pd.Series, value_func=None) -> pd.DataFrame:
+    # histories: stock_id -> [(date, value), ...]
+    columns = {}
+    for stock_id, history in histories.items():
+        if not isinstance(history, list) or len(history) == 0:
+            continue
+        dates = [each[0] for each in history]
+        values = [value_func(each[1]) if value_func else each[1] for each in history]
+        columns[stock_id] = pd.Series(values, index=pd.DatetimeIndex(dates), dtype=float)
+    return pd.DataFrame(columns)
+
+
+# Build a panel from decoded histories: stock_id -> {column: (dates, values)}, with the "daily_k" values in `PRICE_FIELDS` order
+def build_panel_from_histories(histories: dict) -> Panel:
+    # field -> [(stock_id, dates, values), ...]
+    field_columns = {}
+    for stock_id, stock_histories in histories.items():
+        for column, (dates, values) in (stock_histories or {}).items():
+            if len(dates) == 0:
+                continue
+            if column == "daily_k":
+                for i, price_field in enumerate(PRICE_FIELDS):
+                    field_columns.setdefault(price_field, []).append((stock_id, dates, values[:, i]))
+            elif column in HISTORY_FIELDS:
+                field_columns.setdefault(column, []).append((stock_id, dates, values))
+    fields = {}
+    for field, columns in field_columns.items():
+        all_dates = np.unique(np.concatenate([dates for _, dates, _ in columns]))
+        matrix = np.full((len(all_dates), len(columns)), np.nan)
+        for j, (_, dates, values) in enumerate(columns):
+            matrix[np.searchsorted(all_dates, dates), j] = values
+        fields[field] = pd.DataFrame(matrix, index=pd.DatetimeIndex(all_dates), columns=[stock_id for stock_id, _, _ in columns])
+    return Panel(fields)
+
+
+# Split a panel into decoded histories (the inverse of `build_panel_from_histories`), values are rounded to `decimals` if given
+def split_panel_to_histories(panel: Panel, decimals: int = None) -> dict:
+    dates = panel.dates.values.astype("datetime64[D]")
+    field_values = {}
+    for field in PRICE_FIELDS + HISTORY_FIELDS:
+        if field in panel:
+            values = panel[field].to_numpy(dtype=float)
+            field_values[field] = np.round(values, decimals) if decimals is not None else values
+    histories = {}
+    for j, stock_id in enumerate(panel.stock_ids):
+        stock_histories = {}
+        if all(price_field in field_values for price_field in PRICE_FIELDS):
+            prices = np.stack([field_values[price_field][:, j] for price_field in PRICE_FIELDS], axis=1)
+            valid = ~np.isnan(prices[:, PRICE_FIELDS.index("收盤")])
+            stock_histories["daily_k"] = (dates[valid], prices[valid])
+        for field in HISTORY_FIELDS:
+            if field in field_values:
+                values = field_values[field][:, j]
+                valid = ~np.isnan(values)
+                stock_histories[field] = (dates[valid], values[valid])
+        histories[stock_id] = stock_histories
+    return histories
+
+
+# Build a panel from the merged market data of one day (the histories cover the last ~80 trading days)
+def build_panel_from_market_data(market_data_df: pd.DataFrame, data_date, history_panel: Panel = None) -> Panel:
+    fields = {}
+    if history_panel is not None:
+        # The histories were already reduced to a panel while crawling, and the list columns only keep short tails
+        fields.update(history_panel.fields)
+    elif "daily_k" in market_data_df:
+        for price_field in PRICE_FIELDS:
+            fields[price_field] = _history_to_frame(
+                market_data_df["daily_k"], value_func=lambda k, price_field=price_field: k[price_field]
+            )
+    for field in HISTORY_FIELDS:
+        if history_panel is None and field in market_data_df:
+            fields[field] = _history_to_frame(market_data_df[field])
+    for field in DAILY_FIELDS:
+        if field in market_data_df:
+            values = pd.to_numeric(market_data_df[field], errors="coerce")
+            fields[field] = pd.DataFrame([values.values], index=pd.DatetimeIndex([pd.Timestamp(data_date)]), columns=values.index)
+    fields = {field: df for field, df in fields.items() if not df.empty}
+    industry = market_data_df["產業別"] if "產業別" in market_data_df else None
+    return Panel(fields, industry)
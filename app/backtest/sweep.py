@@ -0,0 +1,123 @@
+import os
+import copy
+import itertools
+import pandas as pd
+
+from functools import reduce
+from concurrent.futures import ProcessPoolExecutor
+from ..strategies.specs import STRATEGY_CATEGORIES, evaluate_condition, iter_conditions
+from .kernels import PANEL_KERNELS
+from .engine import EXCLUDED_INDUSTRIES, evaluate_strategy_panel, get_forward_returns, summarize_signals
+
+# State shared by all tasks of a worker process (set once by `_init_worker`)
+_worker_state = {}
+
+
+def _init_worker(panel, base_signals, forward_returns, swept_conditions, holding_days):
+    _worker_state.update({
+        "panel": panel,
+        "base_signals": base_signals,
+        "forward_returns": forward_returns,
+        "swept_conditions": swept_conditions,
+        "holding_days": holding_days,
+        "mask_cache": {},
+    })
+
+
+# Mask of a swept condition with the given parameter overrides (cached per worker process)
+def _get_swept_mask(condition_name, overrides):
+    cache_key = (condition_name, overrides)
+    mask_cache = _worker_state["mask_cache"]
+    if cache_key not in mask_cache:
+        condition = copy.deepcopy(_worker_state["swept_conditions"][condition_name])
+        condition.setdefault("params", {}).update(dict(overrides))
+        mask_cache[cache_key] = evaluate_condition(_worker_state["panel"], condition, func_map=PANEL_KERNELS).fillna(False).astype(bool)
+    return mask_cache[cache_key]
+
+
+def _evaluate_combinations(combinations):
+    results = []
+    for combination in combinations:
+        # combination: ((condition_name, ((param, value), ...)), ...)
+        masks = [_get_swept_mask(condition_name, overrides) for condition_name, overrides in combination]
+        signals = reduce(lambda x, y: (x & y), masks, _worker_state["base_signals"])
+        summary = summarize_signals(signals, _worker_state["forward_returns"], _worker_state["holding_days"])
+        results.append((combination, summary))
+    return results
+
+
+def _chunk(items, chunk_size):
+    for i in range(0, len(items), chunk_size):
+        yield items[i:i + chunk_size]
+
+
+def sweep_parameters(
+    panel,
+    strategy_spec,
+    grid,
+    holding_days=5,
+    rank_by="average_return",
+    min_signals=10,
+    max_workers=None,
+    exclude_industries=EXCLUDED_INDUSTRIES,
+) -> pd.DataFrame:
+    """
+    Backtest every combination of a parameter grid for a strategy spec, and rank the results.
+
+    `grid` maps `(condition name, parameter name)` to the values to try, e.g.
+    `{("收盤價 > 20", "threshold"): [10, 20, 30], ("|D9 - K9| < 22", "difference_threshold"): [15, 22]}`.
+
+    The conditions that are not swept are evaluated once and shared by all combinations,
+    and each worker process caches the masks of the swept conditions it has evaluated.
+    Combinations with fewer than `min_signals` signals are ranked last.
+    """
+    conditions = {condition["name"]: condition for _, condition in iter_conditions(strategy_spec)}
+    unknown_names = {name for name, _ in grid} - set(conditions)
+    if unknown_names:
+        raise ValueError(f"Unknown condition names in grid: {sorted(unknown_names)}")
+
+    # Evaluate the conditions which do not depend on any swept parameter only once
+    swept_names = list(dict.fromkeys(name for name, _ in grid))
+    fixed_spec = {
+        category: [condition for condition in strategy_spec.get(category, []) if condition["name"] not in swept_names]
+        for category in STRATEGY_CATEGORIES
+    }
+    base_signals = evaluate_strategy_panel(panel, fixed_spec, exclude_industries)
+    forward_returns = get_forward_returns(panel, holding_days)
+
+    # Expand the grid into combinations of per-condition overrides
+    per_condition_options = []
+    for name in swept_names:
+        params = [param for condition_name, param in grid if condition_name == name]
+        value_lists = [grid[(name, param)] for param in params]
+        per_condition_options.append([
+            (name, tuple(zip(params, values))) for values in itertools.product(*value_lists)
+        ])
+    # The first swept condition varies slowest, so each chunk shares most of its masks
+    combinations = list(itertools.product(*per_condition_options))
+
+    max_workers = max_workers or os.cpu_count() or 1
+    chunk_size = max(1, -(-len(combinations) // (max_workers * 4)))
+    swept_conditions = {name: conditions[name] for name in swept_names}
+    results = []
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        initializer=_init_worker,
+        initargs=(panel, base_signals, forward_returns, swept_conditions, holding_days),
+    ) as executor:
+        for chunk_results in executor.map(_evaluate_combinations, _chunk(combinations, chunk_size)):
+            results.extend(chunk_results)
+
+    rows = []
+    for combination, summary in results:
+        row = {
+            f"{name}.{param}": value
+            for name, overrides in combination
+            for param, value in overrides
+        }
+        row.update(summary)
+        rows.append(row)
+    result_df = pd.DataFrame(rows)
+    result_df["_enough_signals"] = result_df["signals"] >= min_signals
+    result_df = result_df.sort_values(by=["_enough_signals", rank_by], ascending=[False, False], na_position="last")
+    return result_df.drop(columns=["_enough_signals"]).reset_index(drop=True)
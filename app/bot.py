@@ -0,0 +1,278 @@
+import re
+import math
+import threading
+
+from config import logger
+from linebot.models import FollowEvent, MessageEvent, TextMessage, TextSendMessage, UnfollowEvent
+from .alerts import ALERT_FIELD_SETTING, describe_alert
+from .store import (
+    load_snapshot, load_snapshot_meta, load_stock_index, update_subscriber, remove_subscriber,
+    load_alerts, add_alert, remove_alerts,
+)
+
+## LINE Bot Commands
+#
+# Text commands answered from the latest snapshot, without any crawling:
+# - a stock id (e.g. "2330") or name (e.g. "台積電"): latest indicators, chip flows, and the strategies it passes
+# - "今日推薦": the watch lists of the latest snapshot
+# - "訂閱 策略1 策略3" / "訂閱產業 半導體業" / "取消訂閱" / "我的訂閱": the subscription of the daily recommendations
+# - "提醒 2330 收盤 > 1000" / "提醒 3008 K9 > D9" / "我的提醒" / "取消提醒 3": the price/indicator alerts
+# - "說明": the list of commands
+
+TODAY_COMMANDS = ["今日推薦", "推薦"]
+HELP_COMMANDS = ["說明", "help"]
+SUBSCRIBE_STRATEGY_COMMAND = "訂閱"
+SUBSCRIBE_INDUSTRY_COMMAND = "訂閱產業"
+UNSUBSCRIBE_COMMAND = "取消訂閱"
+SHOW_SUBSCRIPTION_COMMAND = "我的訂閱"
+ALL_KEYWORD = "全部"
+STRATEGY_LABEL_PATTERN = re.compile(r"^策略\d+$")
+ADD_ALERT_COMMAND = "提醒"
+REMOVE_ALERT_COMMAND = "取消提醒"
+SHOW_ALERTS_COMMAND = "我的提醒"
+# "<stock> <field> <operator> <threshold or field>", e.g. "2330 收盤 > 1000" or "3008 K9>D9"
+ALERT_PATTERN = re.compile(r"^(\S+)\s+([^\s<>]+)\s*([<>])\s*(\S+)$")
+MAX_ALERTS_PER_USER = 20
+
+STOCK_ID_PATTERN = re.compile(r"^\d{4,6}[A-Z]?$")
+MAX_COMMAND_LENGTH = 10
+
+# Sections of the stock lookup replies: title -> market data columns (history columns keep their latest value)
+STOCK_REPLY_SETTING = {
+    "價量": ["收盤", "漲跌", "成交量", "本益比", "殖利率(%)"],
+    "技術指標": ["k9", "d9", "mean5", "mean20", "mean60", "osc"],
+    "籌碼": ["外資買賣超", "投信買賣超", "自營商買賣超", "三大法人買賣超", "融資變化量"],
+    "營收": ["(月)營收月增率(%)", "(月)營收年增率(%)"],
+    "產業": ["產業平均漲幅(%)", "產業站上MA20比例(%)", "產業量能比"],
+}
+
+HELP_MESSAGE = (
+    "📖 指令說明\n"
+    "輸入股票代號或名稱 (例如 2330 或 台積電): 查詢最新指標與符合的策略\n"
+    "輸入「今日推薦」: 查詢最新推薦清單\n"
+    "輸入「訂閱 策略1 策略3」或「訂閱 全部」: 選擇每日推播的策略\n"
+    "輸入「訂閱產業 半導體業」或「訂閱產業 全部」: 選擇每日推播的產業\n"
+    "輸入「取消訂閱」: 停止每日推播\n"
+    "輸入「我的訂閱」: 查詢目前的訂閱\n"
+    "輸入「提醒 2330 收盤 > 1000」或「提醒 3008 K9 > D9」: 突破時通知\n"
+    "輸入「我的提醒」或「取消提醒 編號」: 查詢或取消提醒"
+)
+
+
+def _to_index_value(value):
+    # History columns: [(date, value), ...], keep the latest value
+    if isinstance(value, list):
+        value = value[-1][1] if value else None
+    if isinstance(value, dict) or value is None:
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(value) else round(value, 2)
+
+
+# (Public) Build the stock lookup index of a snapshot: stock id -> values of the reply columns and the passed strategies
+def build_stock_index(market_data_df, watch_list_dfs) -> dict:
+    strategies_by_stock = {}
+    for i, watch_list_df in enumerate(watch_list_dfs):
+        for stock_id in watch_list_df.index.astype(str):
+            strategies_by_stock.setdefault(stock_id, []).append(f"策略{i+1}")
+    columns = [column for section_columns in STOCK_REPLY_SETTING.values() for column in section_columns if column in market_data_df.columns]
+    rows = market_data_df.reindex(columns=["名稱", "產業別"] + columns).itertuples(index=False)
+    stock_index = {}
+    for stock_id, (name, industry, *values) in zip(market_data_df.index.astype(str), rows):
+        stock_index[stock_id] = {
+            "名稱": name if isinstance(name, str) else "",
+            "產業別": industry if isinstance(industry, str) else "",
+            "values": {column: _to_index_value(value) for column, value in zip(columns, values)},
+            "strategies": strategies_by_stock.get(stock_id, []),
+        }
+    return stock_index
+
+
+class SnapshotIndex:
+    """In-memory stock index of the latest snapshot, reloaded only when a new snapshot is saved."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key = None
+        self.meta = None
+        self.stocks = {}
+        self._stock_ids_by_name = {}
+
+    # Reload the index if a new snapshot is saved, and return whether a snapshot is available
+    def refresh(self) -> bool:
+        meta = load_snapshot_meta()
+        if not meta:
+            return False
+        key = (meta["target_date"], meta["created_at"])
+        with self._lock:
+            if self._key != key:
+                stocks = load_stock_index(meta["target_date"], meta.get("strategy_version"))
+                if stocks is None:
+                    # Snapshots saved before the index existed
+                    market_data_df, watch_list_dfs, _ = load_snapshot(meta["target_date"], meta.get("strategy_version"))
+                    stocks = build_stock_index(market_data_df, watch_list_dfs)
+                self.meta = meta
+                self.stocks = stocks
+                self._stock_ids_by_name = {stock["名稱"]: stock_id for stock_id, stock in stocks.items() if stock["名稱"]}
+                self._key = key
+        return True
+
+    def find(self, text):
+        stock_id = text if text in self.stocks else self._stock_ids_by_name.get(text)
+        return (stock_id, self.stocks[stock_id]) if stock_id else (None, None)
+
+
+snapshot_index = SnapshotIndex()
+
+
+def _format_value(value) -> str:
+    if value is None:
+        return "-"
+    return f"{value:,.2f}".rstrip("0").rstrip(".")
+
+
+def _render_stock_reply(stock_id, stock, target_date) -> str:
+    lines = [f"📈 {stock_id} {stock['名稱']}  {stock['產業別']}", f"資料日期: {target_date}"]
+    for title, columns in STOCK_REPLY_SETTING.items():
+        section = [f"{column}: {_format_value(stock['values'][column])}" for column in columns if column in stock["values"]]
+        if section:
+            lines.append(f"\n[{title}]")
+            lines.extend(section)
+    strategies = "、".join(stock["strategies"]) if stock["strategies"] else "無"
+    lines.append(f"\n🔎 符合策略: {strategies}")
+    return "\n".join(lines)
+
+
+# (Public) Answer a text command (None for texts which are not commands)
+def answer_command(text):
+    text = text.strip()
+    if text in HELP_COMMANDS:
+        return HELP_MESSAGE
+    # Longer texts are chat messages, not commands
+    if len(text) > MAX_COMMAND_LENGTH:
+        return None
+    is_command = text in TODAY_COMMANDS or STOCK_ID_PATTERN.match(text)
+    if not snapshot_index.refresh():
+        return "目前尚無推薦資料" if is_command else None
+    if text in TODAY_COMMANDS:
+        return snapshot_index.meta["message"]
+    stock_id, stock = snapshot_index.find(text.upper())
+    if stock_id:
+        return _render_stock_reply(stock_id, stock, snapshot_index.meta["target_date"])
+    return f"查無股票 {text}" if is_command else None
+
+
+def _render_subscription(subscription) -> str:
+    strategies = subscription.get("strategies")
+    industries = subscription.get("industries")
+    if strategies == []:
+        return "目前未訂閱每日推播"
+    strategy_text = "全部" if strategies is None else "、".join(strategies)
+    industry_text = "全部" if industries is None else "、".join(industries)
+    return f"📬 目前的訂閱\n策略: {strategy_text}\n產業: {industry_text}"
+
+
+# (Public) Answer a subscription command of a user (None for texts which are not subscription commands)
+def answer_subscription_command(text, user_id):
+    command, *values = text.split()
+    if command == SHOW_SUBSCRIPTION_COMMAND or (command == SUBSCRIBE_STRATEGY_COMMAND and not values):
+        return _render_subscription(update_subscriber(user_id))
+    if command == UNSUBSCRIBE_COMMAND:
+        update_subscriber(user_id, strategies=[])
+        return "已取消每日推播，輸入「訂閱 全部」可重新訂閱"
+    if command == SUBSCRIBE_STRATEGY_COMMAND:
+        if ALL_KEYWORD in values:
+            return _render_subscription(update_subscriber(user_id, strategies=None))
+        invalid_values = [value for value in values if not STRATEGY_LABEL_PATTERN.match(value)]
+        if invalid_values:
+            return f"無法辨識的策略 {'、'.join(invalid_values)}，例如「訂閱 策略1 策略3」"
+        return _render_subscription(update_subscriber(user_id, strategies=sorted(set(values))))
+    if command == SUBSCRIBE_INDUSTRY_COMMAND:
+        if not values:
+            return "請輸入產業，例如「訂閱產業 半導體業」"
+        industries = None if ALL_KEYWORD in values else sorted(set(values))
+        return _render_subscription(update_subscriber(user_id, industries=industries))
+    return None
+
+
+def _parse_alert(text):
+    match = ALERT_PATTERN.match(text)
+    if not match:
+        return None
+    stock_text, field_name, operator, target = match.groups()
+    field = ALERT_FIELD_SETTING.get(field_name.upper())
+    if not field:
+        return None
+    alert = {"field": field, "direction": "above" if operator == ">" else "below"}
+    if target.upper() in ALERT_FIELD_SETTING:
+        alert["other_field"] = ALERT_FIELD_SETTING[target.upper()]
+    else:
+        try:
+            alert["threshold"] = float(target.replace(",", ""))
+        except ValueError:
+            return None
+    stock_id = None
+    if snapshot_index.refresh():
+        stock_id, _ = snapshot_index.find(stock_text.upper())
+    if not stock_id and STOCK_ID_PATTERN.match(stock_text.upper()):
+        stock_id = stock_text.upper()
+    return {"stock_id": stock_id, **alert} if stock_id else None
+
+
+# (Public) Answer an alert command of a user (None for texts which are not alert commands)
+def answer_alert_command(text, user_id):
+    command, _, values = text.partition(" ")
+    if command == SHOW_ALERTS_COMMAND:
+        alerts = {alert_id: alert for alert_id, alert in load_alerts().items() if alert["user_id"] == user_id}
+        if not alerts:
+            return "目前沒有提醒"
+        return "🔔 目前的提醒\n" + "\n".join(f"#{alert_id} {describe_alert(alert)}" for alert_id, alert in alerts.items())
+    if command == REMOVE_ALERT_COMMAND:
+        alert_ids = [value.lstrip("#") for value in values.split()]
+        if not alert_ids:
+            return "請輸入提醒編號，例如「取消提醒 3」"
+        removed_ids = remove_alerts(alert_ids, user_id)
+        return f"已取消提醒 {'、'.join('#' + alert_id for alert_id in removed_ids)}" if removed_ids else "查無此提醒"
+    if command == ADD_ALERT_COMMAND:
+        alert = _parse_alert(values.strip())
+        if not alert:
+            return "無法辨識的提醒，例如「提醒 2330 收盤 > 1000」或「提醒 3008 K9 > D9」"
+        if sum(1 for each in load_alerts().values() if each["user_id"] == user_id) >= MAX_ALERTS_PER_USER:
+            return f"提醒最多 {MAX_ALERTS_PER_USER} 筆，請先取消部分提醒"
+        alert_id = add_alert(user_id, **alert)
+        return f"已新增提醒 #{alert_id} {describe_alert(alert)}"
+    return None
+
+
+# (Public) Handle a webhook event: text messages are answered, and users are registered as subscribers
+def handle_event(event, line_bot_api):
+    user_id = getattr(event.source, "user_id", None) if getattr(event, "source", None) else None
+    if isinstance(event, UnfollowEvent):
+        if user_id:
+            remove_subscriber(user_id)
+        return
+    if isinstance(event, FollowEvent):
+        if user_id:
+            update_subscriber(user_id)
+        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=HELP_MESSAGE))
+        return
+    if not isinstance(event, MessageEvent) or not isinstance(event.message, TextMessage):
+        return
+    text = event.message.text.strip()
+    reply = None
+    # Subscriptions are managed in one-to-one chats
+    if user_id and event.source.type == "user":
+        # Friends who followed before the subscriber store existed are registered on their first message
+        update_subscriber(user_id)
+        reply = answer_subscription_command(text, user_id) if text else None
+        if reply is None and text:
+            reply = answer_alert_command(text, user_id)
+    if reply is None:
+        reply = answer_command(text)
+    if reply is None:
+        return
+    logger.info(f"回覆指令 {event.message.text}")
+    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply))
@@ -1,9 +1,10 @@
 import re
-import requests
 from datetime import datetime
 from bs4 import BeautifulSoup
 
 from config import logger
+from app.metrics import metrics
+from app.crawlers.governor import governed_post
 
 
 def _clean_title(title):
@@ -45,7 +46,9 @@ def fetch_economic_calendar(date_from: str, date_to: str) -> str:
         'limit_from': '0',
     }
 
-    response = requests.post(url, headers=headers, data=payload)
+    with metrics.timer("request_seconds", source="investing", dataset="economic_calendar"):
+        response = governed_post(url, headers=headers, data=payload)
+    metrics.inc("downloaded_bytes_total", len(response.content), source="investing", dataset="economic_calendar")
 
     if response.status_code == 200:
         logger.info("Fetched economic calendar data successfully.")
@@ -53,10 +56,16 @@ def fetch_economic_calendar(date_from: str, date_to: str) -> str:
         return html_content
     else:
         logger.error(f"Failed to fetch economic calendar data. Status code: {response.status_code}")
+        metrics.inc("request_failures_total", source="investing", dataset="economic_calendar")
         return ""
 
 
 def parse_events_from_calendar(html_content: str) -> list:
+    with metrics.timer("parse_seconds", source="investing", dataset="economic_calendar"):
+        return _parse_events_from_calendar(html_content)
+
+
+def _parse_events_from_calendar(html_content: str) -> list:
     soup = BeautifulSoup(html_content, "html.parser")
     rows = soup.select("tr.js-event-item")
     events = []
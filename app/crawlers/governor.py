@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import threading
+import requests
+
+from urllib.parse import urlparse
+from config import config, logger
+from app.metrics import metrics
+
+# Learned request rates, so a new run starts from the last safe rate instead of the configured one
+RATE_STORE_PATH = os.path.join(config.DATA_DIR, "governor.json")
+
+# Minimum seconds between two saves of the learned rates
+RATE_SAVE_INTERVAL = 30
+
+# Additive increase (requests per second) after each healthy response, and multiplicative decrease after a block
+RATE_INCREASE_STEP = 0.05
+RATE_DECREASE_FACTOR = 0.5
+
+# Seconds without any request to a host after it blocked us
+BLOCK_COOLDOWN_SECONDS = 30
+
+# Texts of the pages returned instead of the data when a host throttles us
+BLOCK_PAGE_MARKERS = {
+    "histock.tw": ["請休息一下再試試"],
+}
+
+
+class RateGovernor:
+    """
+    Token bucket of one host, whose rate adapts to the responses (AIMD):
+    it grows a little after every healthy response, and is halved (with a cooldown)
+    after a block page, a 429 or a 5xx response.
+    """
+
+    def __init__(self, host, rate, min_rate, max_rate, burst=2):
+        self.host = host
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.rate = min(max(rate, min_rate), max_rate)
+        self.burst = burst
+        self._tokens = burst
+        self._updated_at = time.monotonic()
+        self._cooldown_until = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    # Wait until a request is allowed, requests for several tokens (e.g. a batch of requests made by a library) go into debt
+    def acquire(self, tokens=1):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self._cooldown_until and self._tokens >= 1:
+                    self._tokens -= tokens
+                    return
+                wait_seconds = max(self._cooldown_until - now, (1 - self._tokens) / self.rate)
+            time.sleep(wait_seconds)
+
+    def report_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + RATE_INCREASE_STEP)
+        metrics.set("request_rate", self.rate, host=self.host)
+
+    def report_block(self, reason):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * RATE_DECREASE_FACTOR)
+            self._cooldown_until = time.monotonic() + BLOCK_COOLDOWN_SECONDS
+            self._tokens = 0
+        logger.warning(f"Throttled by {self.host} ({reason}), slowing down to {self.rate:.2f} requests per second.")
+        metrics.inc("request_blocks_total", host=self.host)
+        metrics.set("request_rate", self.rate, host=self.host)
+        _save_rates(force=True)
+
+
+_governors = {}
+_governors_lock = threading.Lock()
+_last_saved_at = 0
+
+
+def _load_rates() -> dict:
+    try:
+        with open(RATE_STORE_PATH, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _save_rates(force=False):
+    global _last_saved_at
+    with _governors_lock:
+        if not force and time.monotonic() - _last_saved_at < RATE_SAVE_INTERVAL:
+            return
+        _last_saved_at = time.monotonic()
+        rates = {**_load_rates(), **{host: governor.rate for host, governor in _governors.items()}}
+    os.makedirs(os.path.dirname(RATE_STORE_PATH) or ".", exist_ok=True)
+    tmp_path = f"{RATE_STORE_PATH}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(rates, f, indent=2)
+    os.replace(tmp_path, RATE_STORE_PATH)
+
+
+# (Public) Get the governor of a host, starting from its learned rate if there is one
+def get_governor(host) -> RateGovernor:
+    with _governors_lock:
+        if host not in _governors:
+            setting = {**config.RATE_GOVERNOR_SETTING["default"], **config.RATE_GOVERNOR_SETTING.get(host, {})}
+            rate = _load_rates().get(host, setting["rate"])
+            _governors[host] = RateGovernor(host, rate, setting["min_rate"], setting["max_rate"])
+        return _governors[host]
+
+
+# (Public) Send a request through the governor of its host
+def governed_request(method, url, **kwargs) -> requests.Response:
+    governor = get_governor(urlparse(url).hostname)
+    governor.acquire()
+    try:
+        response = requests.request(method, url, **kwargs)
+    except requests.RequestException as e:
+        # Dropped connections are a common way of throttling too
+        governor.report_block(type(e).__name__)
+        raise
+    if response.status_code == 429 or response.status_code >= 500:
+        governor.report_block(f"HTTP {response.status_code}")
+    elif any(marker in response.text for marker in BLOCK_PAGE_MARKERS.get(governor.host, [])):
+        governor.report_block("block page")
+    else:
+        governor.report_success()
+        _save_rates()
+    return response
+
+
+def governed_get(url, **kwargs) -> requests.Response:
+    return governed_request("GET", url, **kwargs)
+
+
+def governed_post(url, **kwargs) -> requests.Response:
+    return governed_request("POST", url, **kwargs)
@@ -3,23 +3,38 @@ import datetime
 import pandas as pd
 
 from config import logger
+from app.metrics import metrics
 from .util import (
     get_industry_category,
     get_mom_yoy,
-    get_technical_indicators
+    get_technical_indicators,
+    DEFAULT_HISTORY_DAYS,
 )
 
 
 # (Public) Get other data: industry category, MoM/YoY, and technical indicators
-def get_other_data(data_date):
+def get_other_data(
+    data_date,
+    progress_callback=None,
+    chunk_callback=None,
+    history_days=None,
+    stored_histories=None,
+    coverage_callback=None,
+):
     start_time = time.time()
     industry_category_df = get_industry_category()
     mom_yoy_df = get_mom_yoy()
-    technical_indicators_df = get_technical_indicators(industry_category_df, data_date)
+    technical_indicators_df = get_technical_indicators(
+        industry_category_df, data_date, progress_callback, chunk_callback,
+        history_days=history_days or DEFAULT_HISTORY_DAYS,
+        stored_histories=stored_histories,
+        coverage_callback=coverage_callback,
+    )
     try:
         # Merge all data
-        df = pd.merge(industry_category_df, mom_yoy_df, how="left", on=["代號", "名稱"])
-        df = pd.merge(df, technical_indicators_df, how="left", on=["代號", "名稱"])
+        with metrics.timer("merge_seconds", source="other"):
+            df = pd.merge(industry_category_df, mom_yoy_df, how="left", on=["代號", "名稱"])
+            df = pd.merge(df, technical_indicators_df, how="left", on=["代號", "名稱"])
         # Set index
         df = df.set_index("代號")
         end_time = time.time()
@@ -1,32 +1,42 @@
 import json
 import time
-import requests
+import datetime
+import warnings
+import numpy as np
 import pandas as pd
 
 from bs4 import BeautifulSoup
 # from functools import lru_cache
 from fake_useragent import UserAgent
 from models.data_type import DataType
-from app.utils import convert_milliseconds_to_date
+from app.utils import convert_milliseconds_to_dates, convert_history_to_list
 from config import config, logger
+from app.metrics import metrics
+from app.crawlers.governor import governed_get
 
 MAX_REQUEST_RETRIES = 2
 
 ##### Industry Category Data #####
 
 def _request_industry_category():
-    for _ in range(MAX_REQUEST_RETRIES):
+    for attempt in range(MAX_REQUEST_RETRIES):
+        if attempt > 0:
+            metrics.inc("request_retries_total", source="finmind", dataset=DataType.INDUSTRY_CATEGORY.value)
         try:
             params = {
                 "dataset": "TaiwanStockInfo",
                 "token": "",
             }
-            response = requests.get("https://api.finmindtrade.com/api/v4/data", params=params)
-            df = pd.DataFrame(response.json()["data"])
+            with metrics.timer("request_seconds", source="finmind", dataset=DataType.INDUSTRY_CATEGORY.value):
+                response = governed_get("https://api.finmindtrade.com/api/v4/data", params=params)
+            metrics.inc("downloaded_bytes_total", len(response.content), source="finmind", dataset=DataType.INDUSTRY_CATEGORY.value)
+            with metrics.timer("parse_seconds", source="finmind", dataset=DataType.INDUSTRY_CATEGORY.value):
+                df = pd.DataFrame(response.json()["data"])
             return df
         except:
             logger.warning(f"Attempt {_request_industry_category.__name__} failed.")
             time.sleep(3)
+    metrics.inc("request_failures_total", source="finmind", dataset=DataType.INDUSTRY_CATEGORY.value)
     return pd.DataFrame(columns=config.COLUMN_KEEP_SETTING[DataType.INDUSTRY_CATEGORY])
 
 
@@ -65,29 +75,35 @@ def get_industry_category() -> pd.DataFrame:
 ##### MoM/YoY Data #####
 
 def _request_mom_yoy():
-    for _ in range(MAX_REQUEST_RETRIES):
+    for attempt in range(MAX_REQUEST_RETRIES):
+        if attempt > 0:
+            metrics.inc("request_retries_total", source="wespai", dataset=DataType.MOM_YOY.value)
         try:
             headers = {
                 "user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36",
             }
-            response = requests.get("https://stock.wespai.com/p/44850", headers=headers)
-            soup = BeautifulSoup(response.text, "html.parser")
-            data = soup.find_all("td")
-            mom_yoy_list = [
-                [
-                    data[x].text,
-                    data[x+1].select_one("a").text,
-                    data[x+3].text,
-                    data[x+4].text,
-                    data[x+5].text,
+            with metrics.timer("request_seconds", source="wespai", dataset=DataType.MOM_YOY.value):
+                response = governed_get("https://stock.wespai.com/p/44850", headers=headers)
+            metrics.inc("downloaded_bytes_total", len(response.content), source="wespai", dataset=DataType.MOM_YOY.value)
+            with metrics.timer("parse_seconds", source="wespai", dataset=DataType.MOM_YOY.value):
+                soup = BeautifulSoup(response.text, "html.parser")
+                data = soup.find_all("td")
+                mom_yoy_list = [
+                    [
+                        data[x].text,
+                        data[x+1].select_one("a").text,
+                        data[x+3].text,
+                        data[x+4].text,
+                        data[x+5].text,
+                    ]
+                    for x in range(0, len(data), 6)
                 ]
-                for x in range(0, len(data), 6)
-            ]
-            df = pd.DataFrame(mom_yoy_list, columns=config.COLUMN_KEEP_SETTING[DataType.MOM_YOY])
+                df = pd.DataFrame(mom_yoy_list, columns=config.COLUMN_KEEP_SETTING[DataType.MOM_YOY])
             return df
         except:
             logger.warning(f"Attempt {_request_mom_yoy.__name__} failed.")
             time.sleep(3)
+    metrics.inc("request_failures_total", source="wespai", dataset=DataType.MOM_YOY.value)
     return pd.DataFrame(columns=config.COLUMN_KEEP_SETTING[DataType.MOM_YOY])
 
 
@@ -119,125 +135,316 @@ def get_mom_yoy() -> pd.DataFrame:
 
 ##### Technical Indicators Data #####
 
-def _get_j9_list(k9_list: list, d9_list: list) -> list:
-    j9_list = list()
-    for (date, k9_value), (_, d9_value) in zip(k9_list, d9_list):
-        j9_value = round(3 * k9_value - 2 * d9_value, 2)
-        j9_list.append([date, j9_value])
-    return j9_list
-
-
-def _format_technical_indicator_list(technical_indicator_list: list, data_date) -> list:
-    filtered_indicators = []
-    for indicator_time, indicator_value in technical_indicator_list:
-        indicator_time = convert_milliseconds_to_date(indicator_time)
-        if indicator_time <= data_date:
-            filtered_indicators.append([indicator_time, indicator_value])
-        else:
-            break
-    return filtered_indicators
-
-
-def _format_daily_k_list(daily_k_list: list, data_date) -> list:
-    filtered_ks = []
-    for k_time, *k_values in daily_k_list:
-        k_time = convert_milliseconds_to_date(k_time)
-        if k_time <= data_date:
-            k_value = {
-                "開盤": k_values[0],
-                "最高": k_values[1],
-                "最低": k_values[2],
-                "收盤": k_values[3],
-            }
-            filtered_ks.append([k_time, k_value])
-        else:
-            break
-    return filtered_ks
+# Trading days of history requested when no plan is given (what the original API uses)
+DEFAULT_HISTORY_DAYS = 80
+
+# Stored trading days requested again by a delta fetch, to check that the stored histories are still valid
+DELTA_OVERLAP_DAYS = 2
+
+# Histock series of each technical column (values only, the dates are the first item of each point)
+TECHNICAL_SERIES_SETTING = {
+    "k9": "K9",
+    "d9": "D9",
+    "dif": "DIF",
+    "macd": "MACD",
+    "osc": "OSC",
+    "mean5": "Mean5",
+    "mean10": "Mean10",
+    "mean20": "Mean20",
+    "mean60": "Mean60",
+    "volume": "Volume",
+    "mean_5_volume": "Mean5Volume",
+    "mean_20_volume": "Mean20Volume",
+}
+
+# Values of each histock DailyK point, in order
+DAILY_K_FIELDS = ["開盤", "最高", "最低", "收盤"]
+
+
+def _decode_series(series_text: str, width: int) -> np.ndarray:
+    # Fast path: parse the nested JSON list as a flat list of numbers, without building Python objects per point
+    flat_text = series_text.replace("[", " ").replace("]", " ")
+    if not flat_text.strip():
+        return np.empty((0, width))
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        values = np.fromstring(flat_text, sep=",")
+    if values.size == flat_text.count(",") + 1 and values.size % width == 0:
+        return values.reshape(-1, width)
+    # Fall back to the JSON parser for anything else (e.g. null values)
+    return np.array(json.loads(series_text), dtype=float).reshape(-1, width)
+
+
+def _decode_history(series_text: str, data_date, width=2) -> tuple:
+    points = _decode_series(series_text, width)
+    dates = convert_milliseconds_to_dates(points[:, 0])
+    # The points are sorted by date, so the data date cutoff is found by binary search
+    end = np.searchsorted(dates, np.datetime64(data_date, "D"), side="right")
+    values = points[:end, 1] if width == 2 else points[:end, 1:]
+    return dates[:end], values
+
+
+# Decode the payload into {column: (dates, values)} arrays ("daily_k" values are in `DAILY_K_FIELDS` order)
+def _decode_technical_indicators(technical_indicators, data_date) -> dict:
+    if not technical_indicators:
+        return None
+    histories = {
+        column: _decode_history(technical_indicators[series_name], data_date)
+        for column, series_name in TECHNICAL_SERIES_SETTING.items()
+    }
+    (k9_dates, k9_values), (_, d9_values) = histories["k9"], histories["d9"]
+    length = min(len(k9_values), len(d9_values))
+    histories["j9"] = (k9_dates[:length], np.round(3 * k9_values[:length] - 2 * d9_values[:length], 2))
+    histories["daily_k"] = _decode_history(technical_indicators["DailyK"], data_date, width=1 + len(DAILY_K_FIELDS))
+    return histories
 
 
 # @lru_cache(maxsize=None)
-def _request_technical_indicators(stock_id: str):
-    for _ in range(MAX_REQUEST_RETRIES):
+def _request_technical_indicators(stock_id: str, history_days=DEFAULT_HISTORY_DAYS):
+    response = None
+    for attempt in range(MAX_REQUEST_RETRIES):
+        if attempt > 0:
+            metrics.inc("request_retries_total", source="histock", dataset="technical_indicators")
         try:
             headers = {
                 "User-Agent": UserAgent().random,
                 "authority": "histock.tw",
                 "referer": f"https://histock.tw/stock/{stock_id}",
             }
-            # days = 240 may causes OOM; days = 120 may miss latest data; original API uses days = 80
-            response = requests.get(
-                f"https://histock.tw/stock/chip/chartdata.aspx?no={stock_id}&days=80&m=dailyk,close,volume,mean5,mean10,mean20,mean60,mean5volume,mean20volume,k9,d9,dif,macd,osc",
-                headers=headers,
-            )
+            # days = 240 may causes OOM without streaming; days = 120 may miss latest data; original API uses days = 80
+            with metrics.timer("request_seconds", source="histock", dataset="technical_indicators"):
+                response = governed_get(
+                    f"https://histock.tw/stock/chip/chartdata.aspx?no={stock_id}&days={history_days}&m=dailyk,close,volume,mean5,mean10,mean20,mean60,mean5volume,mean20volume,k9,d9,dif,macd,osc",
+                    headers=headers,
+                )
+            metrics.inc("downloaded_bytes_total", len(response.content), source="histock", dataset="technical_indicators")
             technical_indicators = response.json()
             return technical_indicators
         except:
-            if "請休息一下再試試" in response.text:
+            # The governor has already slowed down if this was a block page
+            if response is not None and "請休息一下再試試" in response.text:
                 logger.error("The web crawler has been blocked by the website...")
+    metrics.inc("request_failures_total", source="histock", dataset="technical_indicators")
     return None
 
 
-def _clean_technical_indicators(technical_indicators, data_date):
-    if not technical_indicators:
+def _clean_technical_indicators(histories):
+    if not histories:
         return None
-    k9 = _format_technical_indicator_list(json.loads(technical_indicators["K9"]), data_date)
-    d9 = _format_technical_indicator_list(json.loads(technical_indicators["D9"]), data_date)
-    j9 = _get_j9_list(k9, d9)
-    dif = _format_technical_indicator_list(json.loads(technical_indicators["DIF"]), data_date)
-    macd = _format_technical_indicator_list(json.loads(technical_indicators["MACD"]), data_date)
-    osc = _format_technical_indicator_list(json.loads(technical_indicators["OSC"]), data_date)
-    mean5 = _format_technical_indicator_list(json.loads(technical_indicators["Mean5"]), data_date)
-    mean10 = _format_technical_indicator_list(json.loads(technical_indicators["Mean10"]), data_date)
-    mean20 = _format_technical_indicator_list(json.loads(technical_indicators["Mean20"]), data_date)
-    mean60 = _format_technical_indicator_list(json.loads(technical_indicators["Mean60"]), data_date)
-    volume = _format_technical_indicator_list(json.loads(technical_indicators["Volume"]), data_date)
-    mean_5_volume = _format_technical_indicator_list(json.loads(technical_indicators["Mean5Volume"]), data_date)
-    mean_20_volume = _format_technical_indicator_list(json.loads(technical_indicators["Mean20Volume"]), data_date)
-    daily_k = _format_daily_k_list(json.loads(technical_indicators["DailyK"]), data_date)
-    return {
-        "k9": k9,
-        "d9": d9,
-        "j9": j9,
-        "dif": dif,
-        "macd": macd,
-        "osc": osc,
-        "mean5": mean5,
-        "mean10": mean10,
-        "mean20": mean20,
-        "mean60": mean60,
-        "volume": volume,
-        "mean_5_volume": mean_5_volume,
-        "mean_20_volume": mean_20_volume,
-        "daily_k": daily_k,
+    technical_indicators = {
+        column: convert_history_to_list(dates, values)
+        for column, (dates, values) in histories.items()
+        if column != "daily_k"
     }
+    dates, values = histories["daily_k"]
+    technical_indicators["daily_k"] = convert_history_to_list(dates, values, DAILY_K_FIELDS)
+    return technical_indicators
 
 
-def _get_technical_indicators_by_stock_id(stock_id: str, data_date) -> dict:
-    technical_indicators = _request_technical_indicators(stock_id)
-    technical_indicators = _clean_technical_indicators(technical_indicators, data_date)
-    return technical_indicators
+def _request_and_decode_technical_indicators(stock_id: str, data_date, history_days) -> dict:
+    technical_indicators = _request_technical_indicators(stock_id, history_days)
+    with metrics.timer("parse_seconds", source="histock", dataset="technical_indicators"):
+        histories = _decode_technical_indicators(technical_indicators, data_date)
+    return histories
 
 
-# Get technical indicators data
-def get_technical_indicators(reference_df: pd.DataFrame, data_date) -> pd.DataFrame:
-    df = reference_df[["名稱", "代號"]].copy()
-    technical_columns = [
-        "k9", "d9", "j9", "dif", "macd", "osc",
-        "mean5", "mean10", "mean20", "mean60",
-        "volume", "mean_5_volume", "mean_20_volume", "daily_k",
-    ]
-    df[technical_columns] = pd.NA
+# Trading days to request so the stored histories reach the latest day, or None if they are too far behind for a delta fetch
+def _get_delta_days(stored_histories, history_days) -> int:
+    stored_dates, _ = stored_histories.get("daily_k", (np.empty(0, dtype="datetime64[D]"), None))
+    if len(stored_dates) == 0:
+        return None
+    # The API returns the latest days, so the gap is counted up to today (holidays only make it larger)
+    today = np.datetime64(datetime.date.today(), "D")
+    gap_days = int(np.busday_count(stored_dates[-1] + 1, today + 1))
+    if gap_days > config.MAX_DELTA_FETCH_DAYS or len(stored_dates) + gap_days < history_days:
+        return None
+    return gap_days + DELTA_OVERLAP_DAYS
+
+
+# Check the overlapping days of the stored and fetched prices (a corporate action adjusts the whole price history)
+def _is_delta_consistent(stored_histories, fetched_histories) -> bool:
+    stored_dates, stored_values = stored_histories["daily_k"]
+    fetched_dates, fetched_values = fetched_histories["daily_k"]
+    overlap_dates, stored_index, fetched_index = np.intersect1d(stored_dates, fetched_dates, return_indices=True)
+    if len(overlap_dates) == 0:
+        return False
+    return np.allclose(stored_values[stored_index], fetched_values[fetched_index], rtol=1e-4, equal_nan=True)
+
+
+# Append the fetched days to the stored histories, and keep the last `history_days` days
+def _merge_delta_histories(stored_histories, fetched_histories, history_days) -> dict:
+    merged_histories = {}
+    for column, (fetched_dates, fetched_values) in fetched_histories.items():
+        stored_dates, stored_values = stored_histories.get(column, (fetched_dates[:0], fetched_values[:0]))
+        keep = stored_dates < fetched_dates[0] if len(fetched_dates) else np.ones(len(stored_dates), dtype=bool)
+        dates = np.concatenate([stored_dates[keep], fetched_dates])
+        values = np.concatenate([stored_values[keep], fetched_values])
+        merged_histories[column] = (dates[-history_days:], values[-history_days:])
+    return merged_histories
+
+
+# Get the decoded histories of a stock ({column: (dates, values)} arrays, or None), only fetching the missing days if they are stored
+def _get_technical_indicators_by_stock_id(stock_id: str, data_date, history_days=DEFAULT_HISTORY_DAYS, stored_histories=None) -> dict:
+    delta_days = _get_delta_days(stored_histories, history_days) if stored_histories else None
+    if delta_days:
+        fetched_histories = _request_and_decode_technical_indicators(stock_id, data_date, delta_days)
+        if fetched_histories and _is_delta_consistent(stored_histories, fetched_histories):
+            metrics.inc("technical_fetch_total", mode="delta")
+            return _merge_delta_histories(stored_histories, fetched_histories, history_days)
+        logger.info(f"Stored history of {stock_id} is outdated, fetching the full history.")
+        metrics.inc("technical_fetch_total", mode="fallback")
+    else:
+        metrics.inc("technical_fetch_total", mode="full")
+    return _request_and_decode_technical_indicators(stock_id, data_date, history_days)
+
+
+TECHNICAL_COLUMNS = [
+    "k9", "d9", "j9", "dif", "macd", "osc",
+    "mean5", "mean10", "mean20", "mean60",
+    "volume", "mean_5_volume", "mean_20_volume", "daily_k",
+]
+
+
+def _set_technical_columns(df, i, stock_histories):
+    technical_indicators = _clean_technical_indicators(stock_histories)
+    for col in TECHNICAL_COLUMNS:
+        df.at[i, col] = technical_indicators.get(col)
+
+
+# Fill the history list columns of `df`, or collect the decoded arrays into `histories` (stock_id -> arrays) if given
+# Return the ids of the stocks which failed
+def _fill_technical_indicators(
+    df, data_date, total, progress_callback=None, histories=None, history_days=DEFAULT_HISTORY_DAYS, stored_histories=None
+) -> list:
+    if histories is None:
+        df[TECHNICAL_COLUMNS] = pd.NA
+    failed_stock_ids = []
     print_flag = False
     for i, row in df.iterrows():
+        stock_id = row["代號"]
         try:
-            stock_id = row["代號"]
-            technical_indicators = _get_technical_indicators_by_stock_id(stock_id, data_date)
-            for col in technical_columns:
-                df.at[i, col] = technical_indicators.get(col)
+            stock_histories = _get_technical_indicators_by_stock_id(
+                stock_id, data_date, history_days, (stored_histories or {}).get(stock_id)
+            )
+            if not stock_histories:
+                raise ValueError(f"No technical data of {stock_id}")
+            if histories is not None:
+                histories[stock_id] = stock_histories
+            else:
+                _set_technical_columns(df, i, stock_histories)
             if (i+1) % 100 == 0 or print_flag:
                 print_flag = False
-                logger.info(f"Processed technical data: {i+1}/{len(df.index)}, stock_id = {stock_id}")
+                logger.info(f"Processed technical data: {i+1}/{total}, stock_id = {stock_id}")
         except:
+            failed_stock_ids.append(stock_id)
             if (i+1) % 100 == 0:
                 print_flag = True
-    return df
+        # Report the progress (stocks processed of the total)
+        if progress_callback:
+            progress_callback(i+1, total)
+    return failed_stock_ids
+
+
+# Retry the failed stocks after the main pass: in rounds with an increasing backoff, and within a request budget
+def _retry_technical_indicators(stock_ids, data_date, history_days=DEFAULT_HISTORY_DAYS, stored_histories=None) -> dict:
+    recovered_histories = {}
+    pending_stock_ids = list(stock_ids)
+    request_budget = config.TECHNICAL_RETRY_BUDGET
+    for retry_round in range(config.TECHNICAL_RETRY_ROUNDS):
+        if not pending_stock_ids or request_budget <= 0:
+            break
+        backoff_seconds = config.TECHNICAL_RETRY_BACKOFF_SECONDS * (2 ** retry_round)
+        logger.info(f"Retrying technical data of {len(pending_stock_ids)} stocks in {backoff_seconds} seconds (round {retry_round+1}).")
+        time.sleep(backoff_seconds)
+        failed_stock_ids = []
+        for stock_id in pending_stock_ids:
+            if request_budget <= 0:
+                failed_stock_ids.append(stock_id)
+                continue
+            request_budget -= 1
+            try:
+                stock_histories = _get_technical_indicators_by_stock_id(
+                    stock_id, data_date, history_days, (stored_histories or {}).get(stock_id)
+                )
+            except:
+                stock_histories = None
+            if stock_histories:
+                recovered_histories[stock_id] = stock_histories
+            else:
+                failed_stock_ids.append(stock_id)
+            time.sleep(config.TECHNICAL_RETRY_INTERVAL_SECONDS)
+        pending_stock_ids = failed_stock_ids
+    return recovered_histories
+
+
+def _report_coverage(total, failed_stock_ids, recovered_stock_ids, coverage_callback=None) -> dict:
+    permanently_failed_stock_ids = [stock_id for stock_id in failed_stock_ids if stock_id not in recovered_stock_ids]
+    coverage = {
+        "total": total,
+        "succeeded": total - len(failed_stock_ids),
+        "recovered": len(recovered_stock_ids),
+        "failed": len(permanently_failed_stock_ids),
+        "failed_stock_ids": permanently_failed_stock_ids,
+    }
+    logger.info(
+        f"Technical data coverage: {coverage['succeeded']} succeeded, {coverage['recovered']} recovered, "
+        f"{coverage['failed']} failed of {total} stocks."
+    )
+    if permanently_failed_stock_ids:
+        logger.warning(f"Technical data unavailable: {', '.join(permanently_failed_stock_ids)}")
+    for status in ["succeeded", "recovered", "failed"]:
+        metrics.set("technical_coverage_stocks", coverage[status], status=status)
+    if coverage_callback:
+        coverage_callback(coverage)
+    return coverage
+
+
+# Get technical indicators data
+def get_technical_indicators(
+    reference_df: pd.DataFrame,
+    data_date,
+    progress_callback=None,
+    chunk_callback=None,
+    history_days=DEFAULT_HISTORY_DAYS,
+    stored_histories=None,
+    coverage_callback=None,
+) -> pd.DataFrame:
+    """
+    Crawl the last `history_days` trading days of technical indicators of every stock in `reference_df`.
+
+    With `chunk_callback`, the stocks are crawled in chunks of `config.TECHNICAL_CHUNK_SIZE`, and
+    `chunk_callback(chunk_df, histories)` is called as soon as a chunk is complete, with the decoded
+    `{stock_id: {column: (dates, values)}}` arrays of the chunk instead of the history list columns.
+    Only the DataFrame it returns is kept, so the full histories of a single chunk are held in memory at a time.
+
+    `stored_histories` (`{stock_id: {column: (dates, values)}}`, e.g. from the history store) lets
+    stocks which are only a few days behind fetch the missing days instead of the whole history.
+
+    Stocks which fail are retried after the main pass (as one more chunk when streaming), and
+    `coverage_callback` receives the coverage summary (succeeded, recovered, failed).
+    """
+    df = reference_df[["名稱", "代號"]].reset_index(drop=True)
+    total = len(df.index)
+    if not chunk_callback or config.TECHNICAL_CHUNK_SIZE <= 0:
+        df = df.copy()
+        failed_stock_ids = _fill_technical_indicators(df, data_date, total, progress_callback, None, history_days, stored_histories)
+        recovered_histories = _retry_technical_indicators(failed_stock_ids, data_date, history_days, stored_histories)
+        for i in df.index[df["代號"].isin(recovered_histories.keys())]:
+            _set_technical_columns(df, i, recovered_histories[df.at[i, "代號"]])
+        _report_coverage(total, failed_stock_ids, recovered_histories.keys(), coverage_callback)
+        return df
+    chunk_dfs = []
+    failed_stock_ids = []
+    for start in range(0, total, config.TECHNICAL_CHUNK_SIZE):
+        chunk_df = df.iloc[start:start + config.TECHNICAL_CHUNK_SIZE].copy()
+        histories = {}
+        chunk_failed_stock_ids = _fill_technical_indicators(chunk_df, data_date, total, progress_callback, histories, history_days, stored_histories)
+        failed_stock_ids.extend(chunk_failed_stock_ids)
+        chunk_df = chunk_df[~chunk_df["代號"].isin(chunk_failed_stock_ids)]
+        chunk_dfs.append(chunk_callback(chunk_df, histories))
+    # The failed stocks (recovered or not) are reduced as one more chunk
+    retry_df = df[df["代號"].isin(failed_stock_ids)].copy()
+    recovered_histories = _retry_technical_indicators(failed_stock_ids, data_date, history_days, stored_histories)
+    chunk_dfs.append(chunk_callback(retry_df, recovered_histories))
+    _report_coverage(total, failed_stock_ids, recovered_histories.keys(), coverage_callback)
+    return pd.concat(chunk_dfs)
@@ -5,6 +5,7 @@ import pandas as pd
 
 from .util import get_data
 from config import config, logger
+from app.metrics import metrics
 from models.data_type import DataType
 
 warnings.simplefilter(action="ignore", category=FutureWarning)
@@ -19,9 +20,10 @@ def get_tpex_data(data_date):
     institutional_df = get_data(DataType.INSTITUTIONAL, data_date)
     try:
         # Merge all data
-        df = pd.merge(price_df, fundamental_df, how="left", on=["代號", "名稱", "股票類型"])
-        df = pd.merge(df, margin_trading_df, how="left", on=["代號", "名稱", "股票類型"])
-        df = pd.merge(df, institutional_df, how="left", on=["代號", "名稱", "股票類型"])
+        with metrics.timer("merge_seconds", source="tpex"):
+            df = pd.merge(price_df, fundamental_df, how="left", on=["代號", "名稱", "股票類型"])
+            df = pd.merge(df, margin_trading_df, how="left", on=["代號", "名稱", "股票類型"])
+            df = pd.merge(df, institutional_df, how="left", on=["代號", "名稱", "股票類型"])
         # Fill zero for those without institutional data
         df[config.COLUMN_KEEP_SETTING[DataType.INSTITUTIONAL]] = df[config.COLUMN_KEEP_SETTING[DataType.INSTITUTIONAL]].fillna(value=0)
         # Set index
@@ -1,10 +1,11 @@
 import time
-import requests
 import pandas as pd
 
 from io import StringIO
 from models.data_type import DataType
 from config import config, logger
+from app.metrics import metrics
+from app.crawlers.governor import governed_get
 
 MAX_REQUEST_RETRIES = 3
 
@@ -45,20 +46,26 @@ REQUEST_SETTING = {
 
 
 def _request_data(data_type, data_date):
-    for _ in range(MAX_REQUEST_RETRIES):
+    for attempt in range(MAX_REQUEST_RETRIES):
+        if attempt > 0:
+            metrics.inc("request_retries_total", source="tpex", dataset=data_type.value)
         try:
             setting = REQUEST_SETTING[data_type]
             year, month, day = data_date.year - 1911, data_date.month, data_date.day
             date_str = f"{year}/{month:02}/{day:02}"
             url = setting["url"].format(date_str=date_str)
-            response = requests.get(url, headers=setting["headers"])
-            response.encoding = setting["encoding"]
-            header_num = setting["header_num"]
-            df = pd.read_csv(StringIO(response.text), header=header_num)
+            with metrics.timer("request_seconds", source="tpex", dataset=data_type.value):
+                response = governed_get(url, headers=setting["headers"])
+            metrics.inc("downloaded_bytes_total", len(response.content), source="tpex", dataset=data_type.value)
+            with metrics.timer("parse_seconds", source="tpex", dataset=data_type.value):
+                response.encoding = setting["encoding"]
+                header_num = setting["header_num"]
+                df = pd.read_csv(StringIO(response.text), header=header_num)
             return df
         except:
             logger.warning(f"Attempt {_request_data.__name__} for {data_type.value} failed.")
             time.sleep(3)
+    metrics.inc("request_failures_total", source="tpex", dataset=data_type.value)
     return pd.DataFrame(columns=config.COLUMN_KEEP_SETTING[data_type])
 
 
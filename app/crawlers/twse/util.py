@@ -1,9 +1,10 @@
 import time
-import requests
 import pandas as pd
 
 from io import StringIO
 from config import config, logger
+from app.metrics import metrics
+from app.crawlers.governor import governed_get
 from models.data_type import DataType
 
 # TODO: When to fillna?
@@ -31,21 +32,27 @@ REQUEST_SETTING = {
 
 
 def _request_data(data_type, data_date):
-    for _ in range(MAX_REQUEST_RETRIES):
+    for attempt in range(MAX_REQUEST_RETRIES):
+        if attempt > 0:
+            metrics.inc("request_retries_total", source="twse", dataset=data_type.value)
         try:
             setting = REQUEST_SETTING[data_type]
             year, month, day = data_date.year, data_date.month, data_date.day
             date_str = f"{year}{month:02}{day:02}"
             url = setting["url"].format(date_str=date_str)
-            response = requests.get(url)
-            header_num = setting["header_num"]
-            if data_type == DataType.PRICE:
-                header_num = ["證券代號" in line for line in response.text.split("\n")].index(True) - 1
-            df = pd.read_csv(StringIO(response.text.replace("=", "")), header=header_num)
+            with metrics.timer("request_seconds", source="twse", dataset=data_type.value):
+                response = governed_get(url)
+            metrics.inc("downloaded_bytes_total", len(response.content), source="twse", dataset=data_type.value)
+            with metrics.timer("parse_seconds", source="twse", dataset=data_type.value):
+                header_num = setting["header_num"]
+                if data_type == DataType.PRICE:
+                    header_num = ["證券代號" in line for line in response.text.split("\n")].index(True) - 1
+                df = pd.read_csv(StringIO(response.text.replace("=", "")), header=header_num)
             return df
         except:
             logger.warning(f"Attempt {_request_data.__name__} for {data_type.value} failed.")
             time.sleep(3)
+    metrics.inc("request_failures_total", source="twse", dataset=data_type.value)
     return pd.DataFrame(columns=config.COLUMN_KEEP_SETTING[data_type])
 
 
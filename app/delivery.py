@@ -0,0 +1,133 @@
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
+from config import logger
+from linebot.models import TextSendMessage
+from .metrics import metrics
+from .messages import render_watch_list_message, split_message, batch_messages
+
+# LINE limit of user ids per multicast request
+MAX_MULTICAST_RECIPIENTS = 500
+
+# User ids per page of the follower list
+FOLLOWER_IDS_PAGE_SIZE = 1000
+
+# Attempts per request (retried with the same retry key, so LINE never delivers a request twice)
+MAX_SEND_ATTEMPTS = 2
+
+
+def _normalize_subscription_values(values):
+    return None if values is None else tuple(sorted(set(values)))
+
+
+# (Public) Group the subscribers by subscription: (strategies, industries) -> user ids (None means all)
+def group_subscribers(subscribers) -> dict:
+    groups = {}
+    for user_id, subscription in subscribers.items():
+        key = (
+            _normalize_subscription_values(subscription.get("strategies")),
+            _normalize_subscription_values(subscription.get("industries")),
+        )
+        groups.setdefault(key, []).append(user_id)
+    return groups
+
+
+# (Public) Render the recommendation message of a subscription, from the snapshot metadata and stock index
+def render_subscription_message(meta, stock_index, strategies=None, industries=None) -> str:
+    watch_lists = []
+    for watch_list in meta["watch_lists"]:
+        label = f"策略{watch_list['strategy']}"
+        if strategies is not None and label not in strategies:
+            continue
+        stocks = []
+        for stock_id in watch_list["stock_ids"]:
+            stock = stock_index.get(stock_id, {})
+            if industries is not None and stock.get("產業別") not in industries:
+                continue
+            stocks.append((stock_id, stock.get("名稱", ""), stock.get("產業別", "")))
+        watch_lists.append((label, stocks))
+    labels = [label for label, _ in watch_lists]
+    degraded_strategies = [label for label in (meta.get("degradation") or {}).get("strategies", []) if label in labels]
+    return render_watch_list_message(meta["target_date"], watch_lists, meta["economic_events"], degraded_strategies)
+
+
+def _send(line_bot_api, message_batches, user_ids=None, push_user_id=None) -> bool:
+    api = "push" if push_user_id else ("broadcast" if user_ids is None else "multicast")
+    # The batches of a message are sent in order
+    for messages in message_batches:
+        retry_key = str(uuid.uuid4())
+        for attempt in range(MAX_SEND_ATTEMPTS):
+            try:
+                if push_user_id:
+                    line_bot_api.push_message(push_user_id, messages, retry_key=retry_key)
+                elif user_ids is None:
+                    line_bot_api.broadcast(messages, retry_key=retry_key)
+                else:
+                    line_bot_api.multicast(user_ids, messages, retry_key=retry_key)
+                metrics.inc("line_requests_total", api=api, status="ok")
+                break
+            except Exception as e:
+                # 409: the request with this retry key was already accepted
+                if getattr(e, "status_code", None) == 409:
+                    metrics.inc("line_requests_total", api=api, status="ok")
+                    break
+                if attempt == MAX_SEND_ATTEMPTS - 1:
+                    logger.error(f"LINE {api} failed for {1 if push_user_id else len(user_ids or [])} users: {e}")
+                    metrics.inc("line_requests_total", api=api, status="failed")
+                    return False
+    return True
+
+
+def _to_message_batches(text) -> list:
+    return batch_messages([TextSendMessage(text=message) for message in split_message(text)])
+
+
+# (Public) Broadcast a message to every friend, split within the LINE limits
+def broadcast_message(line_bot_api, text) -> bool:
+    return _send(line_bot_api, _to_message_batches(text))
+
+
+# (Public) Push a message to one user, split within the LINE limits
+def push_message(line_bot_api, user_id, text) -> bool:
+    return _send(line_bot_api, _to_message_batches(text), push_user_id=user_id)
+
+
+# (Public) User ids of every friend of the bot, or None if they cannot be listed
+# (the follower list is only available to verified and premium accounts)
+def get_follower_ids(line_bot_api) -> list:
+    user_ids, start = [], None
+    try:
+        while True:
+            response = line_bot_api.get_followers_ids(limit=FOLLOWER_IDS_PAGE_SIZE, start=start)
+            user_ids.extend(response.user_ids)
+            start = response.next
+            if not start:
+                return user_ids
+    except Exception as e:
+        logger.warning(f"LINE follower ids are not available: {e}")
+        return None
+
+
+# (Public) Deliver the recommendation message of each subscription set to its subscribers
+def deliver_to_subscribers(line_bot_api, meta, stock_index, subscribers, workers=4) -> dict:
+    """
+    The message is rendered once per distinct subscription, and sent with one multicast
+    per 500 subscribers, so the delivery cost grows with the number of distinct lists, not of users.
+    """
+    tasks = []
+    for (strategies, industries), user_ids in group_subscribers(subscribers).items():
+        # Subscribers who unsubscribed every strategy
+        if strategies == ():
+            continue
+        message_batches = _to_message_batches(render_subscription_message(meta, stock_index, strategies, industries))
+        for i in range(0, len(user_ids), MAX_MULTICAST_RECIPIENTS):
+            tasks.append((message_batches, user_ids[i:i + MAX_MULTICAST_RECIPIENTS]))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="delivery") as executor:
+        results = list(executor.map(lambda task: _send(line_bot_api, *task), tasks))
+    failed_recipients = sum(len(user_ids) for (_, user_ids), sent in zip(tasks, results) if not sent)
+    return {
+        "subscriptions": len({id(message_batches) for message_batches, _ in tasks}),
+        "requests": sum(len(message_batches) for message_batches, _ in tasks),
+        "recipients": sum(len(user_ids) for _, user_ids in tasks),
+        "failed_recipients": failed_recipients,
+    }
@@ -0,0 +1,296 @@
+import numpy as np
+
+from config import config
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+## Recursive Indicators
+#
+# KD, EMA/MACD and PSAR of every stock at once, from (date x stock) arrays of the prices.
+# Each value depends on the previous one, so these indicators loop over the dates:
+# - "numba": the loops are compiled when Numba is installed (and `INDICATOR_JIT` is not disabled)
+# - "numpy": otherwise, the dates are looped in Python with vectorized NumPy operations over the stocks
+# Both backends return the same values. Missing values (NaN, e.g. before a stock is listed or on a
+# suspended day) keep the state of the recursion, and give NaN outputs except for the EMA, which keeps
+# its previous value (like the histories do).
+
+
+# (Public) Backend used when none is given: "numba" or "numpy"
+def get_backend() -> str:
+    return "numba" if numba is not None and config.INDICATOR_JIT else "numpy"
+
+
+# "numba" falls back to NumPy when Numba is not installed
+def _use_numba(backend) -> bool:
+    return numba is not None and (backend or get_backend()) == "numba"
+
+
+def _as_2d(values) -> np.ndarray:
+    values = np.asarray(values, dtype=float)
+    return values.reshape(-1, 1) if values.ndim == 1 else values
+
+
+def _restore_shape(values, like):
+    return values.ravel() if np.ndim(like) == 1 else values
+
+
+##### Compiled Loops #####
+# Plain Python loops, only used once compiled by Numba
+
+
+def _ema_loop(values, alpha):
+    rows, columns = values.shape
+    result = np.empty((rows, columns))
+    ema = np.full(columns, np.nan)
+    # Dates outer and stocks inner, so the rows are read in memory order
+    for t in range(rows):
+        for j in range(columns):
+            value = values[t, j]
+            if np.isnan(ema[j]):
+                ema[j] = value
+            elif not np.isnan(value):
+                ema[j] += alpha * (value - ema[j])
+            result[t, j] = ema[j]
+    return result
+
+
+def _macd_loop(close, fast_alpha, slow_alpha, signal_alpha):
+    rows, columns = close.shape
+    dif, macd = np.full((rows, columns), np.nan), np.full((rows, columns), np.nan)
+    fast_ema, slow_ema, signal_ema = np.full(columns, np.nan), np.full(columns, np.nan), np.full(columns, np.nan)
+    # The 3 EMAs in one pass, without the (date x stock) temporaries of the EMAs
+    for t in range(rows):
+        for j in range(columns):
+            value = close[t, j]
+            if np.isnan(value):
+                continue
+            if np.isnan(fast_ema[j]):
+                fast_ema[j], slow_ema[j] = value, value
+            else:
+                fast_ema[j] += fast_alpha * (value - fast_ema[j])
+                slow_ema[j] += slow_alpha * (value - slow_ema[j])
+            dif[t, j] = fast_ema[j] - slow_ema[j]
+            if np.isnan(signal_ema[j]):
+                signal_ema[j] = dif[t, j]
+            else:
+                signal_ema[j] += signal_alpha * (dif[t, j] - signal_ema[j])
+            macd[t, j] = signal_ema[j]
+    return dif, macd
+
+
+def _kd_loop(high, low, close, days):
+    rows, columns = close.shape
+    k, d = np.full((rows, columns), np.nan), np.full((rows, columns), np.nan)
+    previous_k, previous_d = np.full(columns, 50.0), np.full(columns, 50.0)
+    highest, lowest = np.empty(columns), np.empty(columns)
+    for t in range(rows):
+        highest[:], lowest[:] = -np.inf, np.inf
+        for s in range(max(0, t - days + 1), t + 1):
+            for j in range(columns):
+                # NaN comparisons are False, so missing prices are skipped
+                if high[s, j] > highest[j]:
+                    highest[j] = high[s, j]
+                if low[s, j] < lowest[j]:
+                    lowest[j] = low[s, j]
+        for j in range(columns):
+            if np.isnan(close[t, j]):
+                continue
+            price_range = highest[j] - lowest[j]
+            rsv = (close[t, j] - lowest[j]) / price_range * 100 if price_range > 0 else 50.0
+            previous_k[j] = previous_k[j] * 2 / 3 + rsv / 3
+            previous_d[j] = previous_d[j] * 2 / 3 + previous_k[j] / 3
+            k[t, j], d[t, j] = previous_k[j], previous_d[j]
+    return k, d
+
+
+def _psar_loop(high, low, close, step, max_step):
+    rows, columns = close.shape
+    psar = np.full((rows, columns), np.nan)
+    count = np.zeros(columns, dtype=np.int64)
+    up_trend = np.ones(columns, dtype=np.bool_)
+    acceleration_factor = np.full(columns, step)
+    up_trend_high, down_trend_low, previous_psar = np.zeros(columns), np.zeros(columns), np.zeros(columns)
+    high_1, high_2, low_1, low_2 = np.zeros(columns), np.zeros(columns), np.zeros(columns), np.zeros(columns)
+    for t in range(rows):
+        for j in range(columns):
+            high_t, low_t = high[t, j], low[t, j]
+            if np.isnan(close[t, j]):
+                continue
+            if count[j] == 0:
+                up_trend_high[j], down_trend_low[j] = high_t, low_t
+            if count[j] < 2:
+                value = close[t, j]
+            elif up_trend[j]:
+                value = previous_psar[j] + acceleration_factor[j] * (up_trend_high[j] - previous_psar[j])
+                if low_t < value:
+                    up_trend[j] = False
+                    value = up_trend_high[j]
+                    down_trend_low[j] = low_t
+                    acceleration_factor[j] = step
+                else:
+                    if high_t > up_trend_high[j]:
+                        up_trend_high[j] = high_t
+                        acceleration_factor[j] = min(acceleration_factor[j] + step, max_step)
+                    if low_2[j] < value:
+                        value = low_2[j]
+                    elif low_1[j] < value:
+                        value = low_1[j]
+            else:
+                value = previous_psar[j] - acceleration_factor[j] * (previous_psar[j] - down_trend_low[j])
+                if high_t > value:
+                    up_trend[j] = True
+                    value = down_trend_low[j]
+                    up_trend_high[j] = high_t
+                    acceleration_factor[j] = step
+                else:
+                    if low_t < down_trend_low[j]:
+                        down_trend_low[j] = low_t
+                        acceleration_factor[j] = min(acceleration_factor[j] + step, max_step)
+                    if high_2[j] > value:
+                        value = high_2[j]
+                    elif high_1[j] > value:
+                        value = high_1[j]
+            psar[t, j] = previous_psar[j] = value
+            high_2[j], high_1[j], low_2[j], low_1[j] = high_1[j], high_t, low_1[j], low_t
+            count[j] += 1
+    return psar
+
+
+if numba is not None:
+    _ema_loop_jit = numba.njit(cache=True)(_ema_loop)
+    _macd_loop_jit = numba.njit(cache=True)(_macd_loop)
+    _kd_loop_jit = numba.njit(cache=True)(_kd_loop)
+    _psar_loop_jit = numba.njit(cache=True)(_psar_loop)
+
+
+##### NumPy Backend #####
+
+
+def _ema_numpy(values, alpha):
+    result = np.empty(values.shape)
+    ema = np.full(values.shape[1], np.nan)
+    for t, row in enumerate(values):
+        ema = np.where(np.isnan(ema), row, np.where(np.isnan(row), ema, ema + alpha * (row - ema)))
+        result[t] = ema
+    return result
+
+
+# Highest / lowest value of the last N rows (including the current one), ignoring the missing values
+def _rolling_extreme(values, days, func):
+    result = values.copy()
+    for shift in range(1, min(days, len(values))):
+        result[shift:] = func(result[shift:], values[:-shift])
+    return result
+
+
+def _kd_numpy(high, low, close, days):
+    # The RSV does not depend on the previous values, so only the smoothing loops over the dates
+    highest, lowest = _rolling_extreme(high, days, np.fmax), _rolling_extreme(low, days, np.fmin)
+    price_range = highest - lowest
+    with np.errstate(invalid="ignore"):
+        has_range = price_range > 0
+    rsv = np.where(has_range, (close - lowest) / np.where(has_range, price_range, 1) * 100, 50)
+    valid = ~np.isnan(close)
+    k, d = np.full(close.shape, np.nan), np.full(close.shape, np.nan)
+    previous_k, previous_d = np.full(close.shape[1], 50.0), np.full(close.shape[1], 50.0)
+    for t in range(len(close)):
+        previous_k = np.where(valid[t], previous_k * 2 / 3 + rsv[t] / 3, previous_k)
+        previous_d = np.where(valid[t], previous_d * 2 / 3 + previous_k / 3, previous_d)
+        k[t], d[t] = previous_k, previous_d
+    k[~valid], d[~valid] = np.nan, np.nan
+    return k, d
+
+
+def _psar_numpy(high, low, close, step, max_step):
+    columns = close.shape[1]
+    psar = np.full(close.shape, np.nan)
+    count = np.zeros(columns, dtype=int)
+    up_trend = np.ones(columns, dtype=bool)
+    acceleration_factor = np.full(columns, step)
+    up_trend_high, down_trend_low, previous_psar = np.zeros(columns), np.zeros(columns), np.zeros(columns)
+    high_1, high_2, low_1, low_2 = np.zeros(columns), np.zeros(columns), np.zeros(columns), np.zeros(columns)
+    for t in range(len(close)):
+        valid = ~np.isnan(close[t])
+        high_t, low_t = high[t], low[t]
+        first = valid & (count == 0)
+        up_trend_high = np.where(first, high_t, up_trend_high)
+        down_trend_low = np.where(first, low_t, down_trend_low)
+        # The stocks with at least 2 bars before this one follow the recursion, the others take the close
+        active = valid & (count >= 2)
+        up_value = previous_psar + acceleration_factor * (up_trend_high - previous_psar)
+        down_value = previous_psar - acceleration_factor * (previous_psar - down_trend_low)
+        value = np.where(up_trend, up_value, down_value)
+        with np.errstate(invalid="ignore"):
+            reverse_down = active & up_trend & (low_t < value)
+            reverse_up = active & ~up_trend & (high_t > value)
+            new_high = active & up_trend & ~reverse_down & (high_t > up_trend_high)
+            new_low = active & ~up_trend & ~reverse_up & (low_t < down_trend_low)
+            # Keep the PSAR below the last 2 lows in an up trend, above the last 2 highs in a down trend
+            up_value = np.where(low_2 < value, low_2, np.where(low_1 < value, low_1, value))
+            down_value = np.where(high_2 > value, high_2, np.where(high_1 > value, high_1, value))
+        value = np.where(reverse_down, up_trend_high, np.where(reverse_up, down_trend_low, np.where(up_trend, up_value, down_value)))
+        value = np.where(active, value, close[t])
+        reversal = reverse_down | reverse_up
+        acceleration_factor = np.where(
+            reversal, step, np.where(new_high | new_low, np.minimum(acceleration_factor + step, max_step), acceleration_factor)
+        )
+        up_trend_high = np.where(new_high | reverse_up, high_t, up_trend_high)
+        down_trend_low = np.where(new_low | reverse_down, low_t, down_trend_low)
+        up_trend = up_trend ^ reversal
+        psar[t] = np.where(valid, value, np.nan)
+        previous_psar = np.where(valid, value, previous_psar)
+        high_2, high_1 = np.where(valid, high_1, high_2), np.where(valid, high_t, high_1)
+        low_2, low_1 = np.where(valid, low_1, low_2), np.where(valid, low_t, low_1)
+        count += valid
+    return psar
+
+
+##### Indicators #####
+
+
+# (Public) EMA of each stock over the dates (alpha = 2 / (span + 1)), starting from the first value
+def get_ema(values, span, backend=None) -> np.ndarray:
+    array = _as_2d(values)
+    alpha = 2 / (span + 1)
+    if _use_numba(backend):
+        result = _ema_loop_jit(np.ascontiguousarray(array), alpha)
+    else:
+        result = _ema_numpy(array, alpha)
+    return _restore_shape(result, values)
+
+
+# (Public) KD (K9, D9, J9 for days=9): RSV of the last N days, smoothed by 1/3 from K = D = 50
+def get_kd(high, low, close, days=9, backend=None) -> tuple:
+    high, low, close_array = _as_2d(high), _as_2d(low), _as_2d(close)
+    if _use_numba(backend):
+        k, d = _kd_loop_jit(np.ascontiguousarray(high), np.ascontiguousarray(low), np.ascontiguousarray(close_array), days)
+    else:
+        k, d = _kd_numpy(high, low, close_array, days)
+    return tuple(_restore_shape(values, close) for values in (k, d, 3 * k - 2 * d))
+
+
+# (Public) MACD: DIF = EMA(fast) - EMA(slow) of the close, MACD = EMA(signal) of DIF, OSC = DIF - MACD
+def get_macd(close, fast_span=12, slow_span=26, signal_span=9, backend=None) -> tuple:
+    close_array = _as_2d(close)
+    if _use_numba(backend):
+        dif, macd = _macd_loop_jit(np.ascontiguousarray(close_array), 2 / (fast_span + 1), 2 / (slow_span + 1), 2 / (signal_span + 1))
+    else:
+        missing = np.isnan(close_array)
+        dif = _ema_numpy(close_array, 2 / (fast_span + 1)) - _ema_numpy(close_array, 2 / (slow_span + 1))
+        dif[missing] = np.nan
+        macd = _ema_numpy(dif, 2 / (signal_span + 1))
+        macd[missing] = np.nan
+    return tuple(_restore_shape(values, close) for values in (dif, macd, dif - macd))
+
+
+# (Public) Parabolic SAR, with the same recursion as `ta.trend.PSARIndicator` (the first 2 bars are the close)
+def get_psar(high, low, close, step=0.02, max_step=0.2, backend=None) -> np.ndarray:
+    high, low, close_array = _as_2d(high), _as_2d(low), _as_2d(close)
+    if _use_numba(backend):
+        psar = _psar_loop_jit(np.ascontiguousarray(high), np.ascontiguousarray(low), np.ascontiguousarray(close_array), step, max_step)
+    else:
+        psar = _psar_numpy(high, low, close_array, step, max_step)
+    return _restore_shape(psar, close)
@@ -0,0 +1,358 @@
+import os
+import json
+import time
+import argparse
+import datetime
+import numpy as np
+import pandas as pd
+
+from functools import partial, reduce
+from config import config, logger
+from .alerts import alert_engine, notify_alerts
+from .metrics import metrics
+from .indicators import get_ema
+from .store import load_snapshot, load_history_panel
+from .backtest.engine import EXCLUDED_INDUSTRIES
+from .backtest.kernels import PANEL_KERNELS
+from .backtest.panel import PRICE_FIELDS, Panel
+from .strategies import specs
+from .strategies.lookback import get_strategy_lookback
+from .strategies.specs import evaluate_condition, get_verdict_column, iter_conditions
+from .strategies.streaming import get_history_conditions
+
+# Usage: python -m app.intraday --feed twstock --interval 60
+#        python -m app.intraday --feed quotes.json --strategy 1 --strategy 3
+
+## Intraday Evaluator
+#
+# Between two daily updates, the watch lists are re-evaluated on a provisional bar for today
+# built from the quotes. Only the stocks whose quote changed are touched on each tick: their
+# today bar and the indicators derived from it are updated, then only the history conditions
+# (which read the bars) are re-evaluated for them. Chip and fundamental conditions only have
+# end-of-day data, so they keep their verdicts of the latest snapshot.
+
+# Quote fields of the today bar (the volume is in lots, like the stored "volume" history)
+QUOTE_FIELDS = PRICE_FIELDS + ["volume"]
+
+# Moving averages recomputed from the today bar: field -> (source field, days)
+MOVING_AVERAGE_SETTING = {
+    "mean5": ("收盤", 5),
+    "mean10": ("收盤", 10),
+    "mean20": ("收盤", 20),
+    "mean60": ("收盤", 60),
+    "mean_5_volume": ("volume", 5),
+    "mean_20_volume": ("volume", 20),
+}
+
+# KD (9 days) and MACD (EMA 12 and 26 of the close, signal line EMA 9 of DIF) parameters
+KD_DAYS = 9
+MACD_FAST_SPAN, MACD_SLOW_SPAN, MACD_SIGNAL_SPAN = 12, 26, 9
+
+# Stocks per twstock realtime request, and the host of the realtime quotes
+TWSTOCK_BATCH_SIZE = 50
+TWSTOCK_REALTIME_HOST = "mis.twse.com.tw"
+
+# The feed is no longer polled after the market close
+MARKET_CLOSE_TIME = datetime.time(13, 35)
+
+
+def _to_float(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return np.nan
+    return value if np.isfinite(value) else np.nan
+
+
+def _normalize_quote(quote):
+    values = tuple(_to_float(quote.get(field)) for field in QUOTE_FIELDS)
+    # A stock without any trade yet has no today bar
+    return None if np.isnan(values[PRICE_FIELDS.index("收盤")]) else values
+
+
+class FileQuoteFeed:
+    """
+    Quote feed read from a JSON file of `{stock_id: {"開盤", "最高", "最低", "收盤", "volume"}}`,
+    rewritten by another process (or by hand). `poll` returns the quotes once per change of the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._modified_at = None
+
+    def poll(self) -> dict:
+        try:
+            modified_at = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return {}
+        if modified_at == self._modified_at:
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                quotes = json.load(f)
+        except json.JSONDecodeError:
+            # Read while being written, the next poll reads it again
+            return {}
+        self._modified_at = modified_at
+        return quotes
+
+
+class TwstockQuoteFeed:
+    """Quote feed of the TWSE realtime quotes (`twstock.realtime`), requested by batches of stocks."""
+
+    def __init__(self, stock_ids, batch_size=TWSTOCK_BATCH_SIZE):
+        self.stock_ids = list(stock_ids)
+        self.batch_size = batch_size
+
+    def poll(self) -> dict:
+        import twstock
+        from .crawlers.governor import get_governor
+
+        governor = get_governor(TWSTOCK_REALTIME_HOST)
+        quotes = {}
+        for i in range(0, len(self.stock_ids), self.batch_size):
+            # twstock sends its own requests (a session request and the quotes request)
+            governor.acquire(tokens=2)
+            try:
+                result = twstock.realtime.get(self.stock_ids[i:i + self.batch_size])
+            except Exception as e:
+                logger.warning(f"Failed to get realtime quotes: {e}")
+                governor.report_block(type(e).__name__)
+                continue
+            if not result.get("success"):
+                continue
+            for stock_id, data in result.items():
+                if not isinstance(data, dict) or not data.get("success"):
+                    continue
+                realtime = data["realtime"]
+                quotes[stock_id] = {
+                    "開盤": realtime.get("open"),
+                    "最高": realtime.get("high"),
+                    "最低": realtime.get("low"),
+                    "收盤": realtime.get("latest_trade_price"),
+                    "volume": realtime.get("accumulate_trade_volume"),
+                }
+            governor.report_success()
+        return quotes
+
+
+def _is_history_condition(condition, history_conditions) -> bool:
+    if "any_of" in condition:
+        return all(_is_history_condition(sub_condition, history_conditions) for sub_condition in condition["any_of"])
+    return get_verdict_column(condition) in history_conditions
+
+
+def _get_condition_key(condition) -> str:
+    if "any_of" in condition:
+        key = f"any_of({', '.join(_get_condition_key(sub_condition) for sub_condition in condition['any_of'])})"
+    else:
+        key = get_verdict_column(condition)
+    return f"not {key}" if condition.get("negate") else key
+
+
+class IntradayEvaluator:
+    """
+    Incremental evaluation of the strategies on the quotes of the day.
+
+    The stored histories of the last trading days are kept as (date x stock) arrays, with an extra
+    row for the today bar. `apply_quotes` writes the bars of the stocks whose quote changed, updates
+    their moving averages, KD and MACD from the previous day, and re-evaluates the history conditions
+    on a panel of those stocks only, so a tick costs O(changed stocks) instead of the whole market.
+    """
+
+    def __init__(self, strategy_specs, market_data_df, history_panel, data_date, exclude_industries=EXCLUDED_INDUSTRIES):
+        self.strategy_specs = strategy_specs
+        self.data_date = data_date
+        history_conditions = get_history_conditions(strategy_specs)
+        today = datetime.date.today()
+        # The bars before today (the latest update may have run after today's close)
+        history_panel = history_panel.select(end_date=min(data_date, today - datetime.timedelta(days=1)))
+        self.stock_ids = history_panel.stock_ids
+        self._positions = {stock_id: j for j, stock_id in enumerate(self.stock_ids)}
+        # Rows kept: the longest lookback of the conditions and indicators, plus the today bar
+        history_days = max([get_strategy_lookback(strategy_spec) for strategy_spec in strategy_specs] + [60, KD_DAYS]) + 1
+        dates = history_panel.dates[-history_days:]
+        self.dates = dates.append(pd.DatetimeIndex([pd.Timestamp(today)]))
+        self._values = {}
+        for field in QUOTE_FIELDS + list(MOVING_AVERAGE_SETTING) + ["k9", "d9", "j9", "dif", "macd", "osc"]:
+            values = history_panel[field].to_numpy(dtype=float)
+            self._values[field] = np.vstack([values[-len(dates):], np.full((1, len(self.stock_ids)), np.nan)])
+        # EMAs of the close until the data date, to move DIF by today's close
+        close = history_panel["收盤"].to_numpy(dtype=float)
+        self._fast_ema = get_ema(close, MACD_FAST_SPAN)[-1]
+        self._slow_ema = get_ema(close, MACD_SLOW_SPAN)[-1]
+        # Conditions on the bars are re-evaluated on each tick, the others only once on the latest snapshot
+        self._conditions = {}
+        self._strategy_keys = {}
+        self._static_masks = {}
+        excluded = history_panel.industry.isin(exclude_industries or []).to_numpy()
+        for strategy_spec in strategy_specs:
+            keys, static_masks = [], []
+            for _, condition in iter_conditions(strategy_spec):
+                if _is_history_condition(condition, history_conditions):
+                    key = _get_condition_key(condition)
+                    self._conditions[key] = condition
+                    keys.append(key)
+                else:
+                    mask = evaluate_condition(market_data_df, condition)
+                    static_masks.append(pd.Series(mask, index=market_data_df.index).reindex(self.stock_ids).fillna(False).astype(bool).to_numpy())
+            self._strategy_keys[strategy_spec["name"]] = keys
+            self._static_masks[strategy_spec["name"]] = reduce(lambda x, y: (x & y), static_masks, ~excluded)
+        self._verdicts = {key: np.zeros(len(self.stock_ids), dtype=bool) for key in self._conditions}
+        self._passed = {strategy_spec["name"]: np.zeros(len(self.stock_ids), dtype=bool) for strategy_spec in strategy_specs}
+        # The watch lists of the data date (before the top K cut), so the ticks only report the changes since then
+        if len(dates):
+            self._evaluate(np.arange(len(self.stock_ids)), end=-1)
+        self._quotes = {}
+        # stock id -> (previous values, current values) of the stocks updated by the last tick
+        self.last_updates = {}
+
+    # Current watch list (stock ids) of each strategy
+    def get_watch_lists(self) -> dict:
+        return {name: list(self.stock_ids[passed]) for name, passed in self._passed.items()}
+
+    # Apply a tick of quotes (stock id -> quote), and return the watch list changes: [{"strategy", "added", "removed"}]
+    def apply_quotes(self, quotes) -> list:
+        start_time = time.perf_counter()
+        updated = {}
+        for stock_id, quote in quotes.items():
+            j = self._positions.get(stock_id)
+            values = _normalize_quote(quote) if j is not None else None
+            if values is None or self._quotes.get(stock_id) == values:
+                continue
+            self._quotes[stock_id] = values
+            updated[j] = values
+        self.last_updates = {}
+        if not updated:
+            return []
+        columns = np.array(sorted(updated))
+        previous_values = self._get_latest_values(columns)
+        for j, values in updated.items():
+            for field, value in zip(QUOTE_FIELDS, values):
+                self._values[field][-1, j] = value
+        self._update_indicators(columns)
+        current_values = self._get_latest_values(columns)
+        # Values before and after the tick (the previous day before the first tick), e.g. for the alerts
+        self.last_updates = {
+            stock_id: (
+                {field: values[i] for field, values in previous_values.items()},
+                {field: values[i] for field, values in current_values.items()},
+            )
+            for i, stock_id in enumerate(self.stock_ids[columns])
+        }
+        changes = self._evaluate(columns)
+        for change in changes:
+            metrics.inc("intraday_watch_list_changes_total", len(change["added"]), strategy=change["strategy"], change="added")
+            metrics.inc("intraday_watch_list_changes_total", len(change["removed"]), strategy=change["strategy"], change="removed")
+        metrics.observe("intraday_tick_seconds", time.perf_counter() - start_time)
+        metrics.set("intraday_tick_stocks", len(columns))
+        return changes
+
+    # Re-evaluate the history conditions of some stocks on the bars until the row `end` (the today bar by default),
+    # and return the watch list changes
+    def _evaluate(self, columns, end=None) -> list:
+        panel = Panel({
+            field: pd.DataFrame(values[:end, columns], index=self.dates[:end], columns=self.stock_ids[columns])
+            for field, values in self._values.items()
+        })
+        for key, condition in self._conditions.items():
+            self._verdicts[key][columns] = evaluate_condition(panel, condition, func_map=PANEL_KERNELS).iloc[-1].fillna(False).astype(bool).to_numpy()
+        changes = []
+        for name, keys in self._strategy_keys.items():
+            passed = reduce(lambda x, y: (x & y), [self._verdicts[key][columns] for key in keys], self._static_masks[name][columns])
+            previous = self._passed[name][columns]
+            added, removed = columns[passed & ~previous], columns[~passed & previous]
+            self._passed[name][columns] = passed
+            if len(added) or len(removed):
+                changes.append({"strategy": name, "added": list(self.stock_ids[added]), "removed": list(self.stock_ids[removed])})
+        return changes
+
+    # Latest values of some stocks (today's if they have a today bar, otherwise the previous day's): field -> list
+    def _get_latest_values(self, columns) -> dict:
+        return {
+            field: np.where(np.isnan(values[-1, columns]), values[-2, columns], values[-1, columns]).tolist()
+            for field, values in self._values.items()
+        }
+
+    # Update the indicators of the today bar of some stocks, from their previous day
+    def _update_indicators(self, columns):
+        values = self._values
+        for field, (source_field, days) in MOVING_AVERAGE_SETTING.items():
+            values[field][-1, columns] = np.nanmean(values[source_field][-days:, columns], axis=0)
+        # KD: RSV of the last 9 days, smoothed with the previous K and D
+        close = values["收盤"][-1, columns]
+        highest = np.nanmax(values["最高"][-KD_DAYS:, columns], axis=0)
+        lowest = np.nanmin(values["最低"][-KD_DAYS:, columns], axis=0)
+        price_range = highest - lowest
+        rsv = np.where(price_range > 0, (close - lowest) / np.where(price_range > 0, price_range, 1) * 100, 50)
+        previous_k = np.nan_to_num(values["k9"][-2, columns], nan=50)
+        previous_d = np.nan_to_num(values["d9"][-2, columns], nan=50)
+        k = previous_k * 2 / 3 + rsv / 3
+        d = previous_d * 2 / 3 + k / 3
+        values["k9"][-1, columns], values["d9"][-1, columns], values["j9"][-1, columns] = k, d, 3 * k - 2 * d
+        # MACD: the stored DIF moves by the change of the (locally computed) EMA difference
+        fast_ema, slow_ema = self._fast_ema[columns], self._slow_ema[columns]
+        next_fast_ema = fast_ema + 2 / (MACD_FAST_SPAN + 1) * (close - fast_ema)
+        next_slow_ema = slow_ema + 2 / (MACD_SLOW_SPAN + 1) * (close - slow_ema)
+        dif_change = (next_fast_ema - next_slow_ema) - (fast_ema - slow_ema)
+        previous_dif = values["dif"][-2, columns]
+        dif = np.where(np.isnan(previous_dif), next_fast_ema - next_slow_ema, previous_dif + dif_change)
+        previous_macd = values["macd"][-2, columns]
+        macd = np.where(np.isnan(previous_macd), dif, previous_macd + 2 / (MACD_SIGNAL_SPAN + 1) * (dif - previous_macd))
+        values["dif"][-1, columns], values["macd"][-1, columns], values["osc"][-1, columns] = dif, macd, dif - macd
+
+
+# (Public) Build the intraday evaluator of the strategies from the latest snapshot and the history store
+def load_intraday_evaluator(strategy_specs) -> IntradayEvaluator:
+    snapshot = load_snapshot()
+    if snapshot is None:
+        raise ValueError("No snapshot to evaluate the intraday quotes from")
+    market_data_df, _, meta = snapshot
+    data_date = datetime.date.fromisoformat(str(meta["target_date"]))
+    return IntradayEvaluator(strategy_specs, market_data_df, load_history_panel(end_date=data_date), data_date)
+
+
+# (Public) Poll a quote feed every `interval` seconds until the market close, and pass the watch list changes to `on_change`
+def run_intraday(evaluator, feed, interval=60, on_change=None, until=MARKET_CLOSE_TIME, on_alerts=None):
+    while True:
+        start_time = time.monotonic()
+        for change in evaluator.apply_quotes(feed.poll()):
+            if on_change:
+                on_change(change)
+        # The alerts crossed by the tick
+        if on_alerts and evaluator.last_updates:
+            triggered = alert_engine.check(evaluator.last_updates)
+            if triggered:
+                on_alerts(triggered)
+        if until and datetime.datetime.now().time() >= until:
+            return evaluator.get_watch_lists()
+        time.sleep(max(0, interval - (time.monotonic() - start_time)))
+
+
+def _log_change(change):
+    if change["added"]:
+        logger.info(f"[{change['strategy']}] 新增 {len(change['added'])} 檔: {' '.join(change['added'])}")
+    if change["removed"]:
+        logger.info(f"[{change['strategy']}] 移除 {len(change['removed'])} 檔: {' '.join(change['removed'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-evaluate the watch lists on the intraday quotes.")
+    parser.add_argument("--feed", default="twstock", help="'twstock' for the TWSE realtime quotes, or the path of a JSON quote file")
+    parser.add_argument("--strategy", type=int, action="append", default=None, help="Strategy number (e.g. 1 for STRATEGY_1), can be repeated")
+    parser.add_argument("--interval", type=float, default=60, help="Seconds between two polls of the feed")
+    parser.add_argument("--alerts", action="store_true", help="Check the price/indicator alerts on every tick and push the triggered ones")
+    args = parser.parse_args()
+
+    strategy_specs = [getattr(specs, f"STRATEGY_{number}") for number in (args.strategy or [1, 3])]
+    evaluator = load_intraday_evaluator(strategy_specs)
+    logger.info(f"盤中監控 {len(evaluator.stock_ids)} 檔股票 (資料日期 {evaluator.data_date})")
+    feed = TwstockQuoteFeed(evaluator.stock_ids) if args.feed == "twstock" else FileQuoteFeed(args.feed)
+    on_alerts = partial(notify_alerts, config.LINE_BOT_API) if args.alerts else None
+    watch_lists = run_intraday(evaluator, feed, args.interval, on_change=_log_change, on_alerts=on_alerts)
+    for name, stock_ids in watch_lists.items():
+        logger.info(f"[{name}] 收盤前股票有 {len(stock_ids)} 檔")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import time
+import uuid
+import datetime
+import threading
+
+from contextlib import contextmanager
+from collections import OrderedDict
+from config import logger
+from .metrics import metrics
+from models.job_status import JobStatus
+
+
+class UpdateJob:
+    """State of one update run, shared by every `/update` request coalesced into it."""
+
+    def __init__(self, target_date, need_broadcast=False, force=False):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.target_date = target_date
+        self.need_broadcast = need_broadcast
+        # Recompute even if the archive has a result for the date
+        self.force = force
+        self.status = JobStatus.QUEUED
+        self.stage = None
+        self.processed = 0
+        self.total = 0
+        self.stage_timings = {}
+        self.coverage = None
+        self.degradation = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_active(self) -> bool:
+        return self.status in (JobStatus.QUEUED, JobStatus.RUNNING)
+
+    def start(self):
+        with self._lock:
+            self.status = JobStatus.RUNNING
+            self.started_at = time.time()
+
+    def finish(self, error=None):
+        with self._lock:
+            self.status = JobStatus.FAILED if error else JobStatus.SUCCEEDED
+            self.error = error
+            self.stage = None
+            self.finished_at = time.time()
+
+    @contextmanager
+    def track_stage(self, name):
+        # Record the current stage and how long it took
+        self.set_stage(name)
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            seconds = time.time() - start_time
+            self.record_stage_time(name, seconds)
+            metrics.observe("stage_seconds", seconds, stage=name)
+
+    def set_stage(self, name):
+        with self._lock:
+            self.stage = name
+
+    def record_stage_time(self, name, seconds):
+        with self._lock:
+            self.stage_timings[name] = round(seconds, 3)
+
+    def set_progress(self, processed, total):
+        with self._lock:
+            self.processed = processed
+            self.total = total
+
+    # Coverage of the technical data crawl (succeeded / recovered / failed stocks)
+    def set_coverage(self, coverage):
+        with self._lock:
+            self.coverage = coverage
+
+    # Degraded pipeline stages and the affected strategies
+    def set_degradation(self, degradation):
+        with self._lock:
+            self.degradation = degradation
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "job_id": self.job_id,
+                "target_date": str(self.target_date),
+                "need_broadcast": self.need_broadcast,
+                "force": self.force,
+                "status": self.status.value,
+                "stage": self.stage,
+                "progress": {"processed": self.processed, "total": self.total},
+                "stage_timings": dict(self.stage_timings),
+                "coverage": self.coverage,
+                "degradation": self.degradation,
+                "error": self.error,
+                "created_at": _format_timestamp(self.created_at),
+                "started_at": _format_timestamp(self.started_at),
+                "finished_at": _format_timestamp(self.finished_at),
+            }
+
+
+class UpdateJobManager:
+    """
+    Single-flight manager for update runs.
+
+    Requests for a date that already has an active job are coalesced into it,
+    at most `max_running_jobs` jobs run at the same time, and new dates are
+    rejected once `max_pending_jobs` jobs are queued or running.
+    """
+
+    def __init__(self, run_func, max_running_jobs=1, max_pending_jobs=3, max_kept_jobs=50):
+        self._run_func = run_func
+        self._max_pending_jobs = max_pending_jobs
+        self._max_kept_jobs = max_kept_jobs
+        self._running_slots = threading.BoundedSemaphore(max_running_jobs)
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._active_jobs_by_date = {}
+
+    def submit(self, app, target_date=None, need_broadcast=False, force=False) -> tuple:
+        """
+        Return `(job, created)`. `job` is `None` when the pending limit is reached,
+        and `created` is `False` when the request joined an active job.
+        """
+        target_date = target_date if target_date else datetime.date.today()
+        with self._lock:
+            job = self._active_jobs_by_date.get(target_date)
+            if job:
+                # A broadcast request upgrades the running job instead of starting a new one
+                job.need_broadcast = job.need_broadcast or need_broadcast
+                job.force = job.force or force
+                return job, False
+            if len(self._active_jobs_by_date) >= self._max_pending_jobs:
+                return None, False
+            job = UpdateJob(target_date, need_broadcast, force)
+            self._jobs[job.job_id] = job
+            self._active_jobs_by_date[target_date] = job
+            self._evict_finished_jobs()
+        threading.Thread(target=self._run, args=(app, job), daemon=True).start()
+        return job, True
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, app, job):
+        with self._running_slots:
+            job.start()
+            error = None
+            try:
+                self._run_func(app, job)
+            except Exception as e:
+                logger.exception(f"更新任務 {job.job_id} 執行失敗")
+                error = str(e)
+            finally:
+                job.finish(error)
+                with self._lock:
+                    self._active_jobs_by_date.pop(job.target_date, None)
+
+    def _evict_finished_jobs(self):
+        # Keep the status of recent jobs only
+        finished_job_ids = [job_id for job_id, job in self._jobs.items() if not job.is_active]
+        for job_id in finished_job_ids[:max(0, len(self._jobs) - self._max_kept_jobs)]:
+            del self._jobs[job_id]
+
+
+def _format_timestamp(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.datetime.fromtimestamp(timestamp).isoformat(timespec="seconds")
@@ -0,0 +1,41 @@
+import requests
+
+from requests.adapters import HTTPAdapter
+from linebot import LineBotApi
+from linebot.http_client import RequestsHttpClient, RequestsHttpResponse
+
+# Connections kept open to the LINE API (one per concurrent delivery request)
+LINE_API_POOL_SIZE = 8
+
+
+class PooledHttpClient(RequestsHttpClient):
+    """`RequestsHttpClient` sending every request through one pooled session, instead of a new connection per request."""
+
+    def __init__(self, timeout=RequestsHttpClient.DEFAULT_TIMEOUT):
+        super().__init__(timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=LINE_API_POOL_SIZE)
+        self.session.mount("https://", adapter)
+
+    def get(self, url, headers=None, params=None, stream=False, timeout=None):
+        response = self.session.get(url, headers=headers, params=params, stream=stream, timeout=timeout or self.timeout)
+        return RequestsHttpResponse(response)
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        response = self.session.post(url, headers=headers, data=data, timeout=timeout or self.timeout)
+        return RequestsHttpResponse(response)
+
+    def delete(self, url, headers=None, data=None, timeout=None):
+        response = self.session.delete(url, headers=headers, data=data, timeout=timeout or self.timeout)
+        return RequestsHttpResponse(response)
+
+    def put(self, url, headers=None, data=None, timeout=None):
+        response = self.session.put(url, headers=headers, data=data, timeout=timeout or self.timeout)
+        return RequestsHttpResponse(response)
+
+
+class PooledLineBotApi(LineBotApi):
+    """`LineBotApi` using `PooledHttpClient`, so that concurrent deliveries reuse their connections."""
+
+    def __init__(self, channel_access_token, **kwargs):
+        super().__init__(channel_access_token, http_client=PooledHttpClient, **kwargs)
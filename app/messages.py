@@ -0,0 +1,66 @@
+from config import config
+
+# LINE limits: characters per text message, and messages per push/multicast/broadcast request
+MAX_MESSAGE_LENGTH = 5000
+MAX_MESSAGES_PER_REQUEST = 5
+
+SECTION_SEPARATOR = "\n###########\n\n"
+
+
+# (Public) Render the recommendation message
+def render_watch_list_message(target_date, watch_lists, economic_events, degraded_strategies=None) -> str:
+    """
+    `watch_lists` is a list of `(label, stocks)`, with `stocks` a list of `(stock_id, name, industry)`,
+    and `degraded_strategies` the labels of the strategies computed without some of their data.
+    """
+    # Final recommendation text message
+    final_recommendation_text = ""
+    # Append the recommendation stocks
+    for label, stocks in watch_lists:
+        if len(stocks) == 0:
+            final_recommendation_text += f"🔎 [{label}]  無推薦股票\n"
+        else:
+            final_recommendation_text += f"🔎 [{label}]  股票有 {len(stocks)} 檔\n" + SECTION_SEPARATOR
+            for stock_id, name, industry in stocks:
+                final_recommendation_text += f"{stock_id} {name}  {industry}\n"
+        final_recommendation_text += SECTION_SEPARATOR
+    # Append the economic events
+    if len(economic_events) != 0:
+        final_recommendation_text += "📆 預計經濟事件\n" + SECTION_SEPARATOR
+        for event in economic_events:
+            final_recommendation_text += f"{event['date']} - {event['country']} - {event['title']}\n"
+        final_recommendation_text += SECTION_SEPARATOR
+    # Warn about the strategies computed without some of their data
+    if degraded_strategies:
+        final_recommendation_text += f"⚠️ 部分資料未能取得，{'、'.join(degraded_strategies)} 結果可能不完整\n\n"
+    # Append the source information
+    final_recommendation_text += f"資料來源: 台股 {str(target_date)}"
+    # Append the version information
+    final_recommendation_text += f"\nJohnKuo © {config.YEAR} ({config.VERSION})"
+    return final_recommendation_text
+
+
+# (Public) Split a text into messages within the LINE length limit, at line boundaries when possible
+def split_message(text, max_length=MAX_MESSAGE_LENGTH) -> list:
+    messages = []
+    current = ""
+    for line in text.splitlines(keepends=True):
+        # Lines longer than a whole message are cut
+        while len(line) > max_length:
+            if current:
+                messages.append(current)
+                current = ""
+            messages.append(line[:max_length])
+            line = line[max_length:]
+        if len(current) + len(line) > max_length:
+            messages.append(current)
+            current = ""
+        current += line
+    if current.strip():
+        messages.append(current)
+    return [message.strip("\n") for message in messages if message.strip()]
+
+
+# (Public) Group messages by request
+def batch_messages(messages, batch_size=MAX_MESSAGES_PER_REQUEST) -> list:
+    return [messages[i:i + batch_size] for i in range(0, len(messages), batch_size)]
@@ -0,0 +1,138 @@
+import time
+import resource
+import threading
+
+from contextlib import contextmanager
+
+METRIC_PREFIX = "stock_overflow_"
+
+# Metric name -> (type, help)
+METRIC_SETTING = {
+    "request_seconds": ("summary", "Latency of data source requests, per source and dataset."),
+    "request_retries_total": ("counter", "Retried data source requests, per source and dataset."),
+    "request_failures_total": ("counter", "Data source requests that failed after all retries, per source and dataset."),
+    "request_rate": ("gauge", "Current request rate (requests per second) allowed by the rate governor, per host."),
+    "request_blocks_total": ("counter", "Block pages, 429/5xx responses and dropped connections seen by the rate governor, per host."),
+    "downloaded_bytes_total": ("counter", "Bytes downloaded from data sources, per source and dataset."),
+    "technical_fetch_total": ("counter", "Technical indicator histories fetched, per mode (full, delta, or fallback to full after a failed delta)."),
+    "technical_coverage_stocks": ("gauge", "Stocks of the latest technical data crawl, per status (succeeded, recovered after retries, failed)."),
+    "parse_seconds": ("summary", "Time spent parsing data source responses, per source and dataset."),
+    "merge_seconds": ("summary", "Time spent merging the data tables, per source."),
+    "strategy_mask_seconds": ("summary", "Time spent evaluating the conditions of a strategy."),
+    "strategy_condition_seconds": ("gauge", "Evaluation time of each strategy condition in the latest profiled run."),
+    "strategy_condition_passed_rows": ("gauge", "Rows passing each strategy condition on its own in the latest profiled run."),
+    "strategy_condition_removed_rows": ("gauge", "Rows removed by each strategy condition after the previous conditions in the latest profiled run."),
+    "strategy_condition_unique_removed_rows": ("gauge", "Rows removed by each strategy condition only in the latest profiled run."),
+    "stage_seconds": ("summary", "Duration of the update pipeline stages (including broadcast)."),
+    "pipeline_stage_degraded_total": ("counter", "Update pipeline stages which failed or missed their deadline, and were replaced by their fallback."),
+    "webhook_events_total": ("counter", "LINE webhook events, per status (handled, failed, duplicate redelivery, or dropped because the queue was full)."),
+    "webhook_queue_depth": ("gauge", "LINE webhook events waiting to be handled."),
+    "webhook_queue_seconds": ("summary", "Time LINE webhook events waited in the queue."),
+    "webhook_handle_seconds": ("summary", "Time spent handling LINE webhook events, per event type."),
+    "line_requests_total": ("counter", "LINE broadcast/multicast/push requests sent for the recommendations and alerts, per api and status."),
+    "alerts_triggered_total": ("counter", "Price/indicator alerts triggered (and removed) by the daily updates and intraday ticks."),
+    "intraday_tick_seconds": ("summary", "Time spent re-evaluating the strategies on an intraday quote tick."),
+    "intraday_tick_stocks": ("gauge", "Stocks whose quote changed in the latest intraday tick."),
+    "intraday_watch_list_changes_total": ("counter", "Stocks added to or removed from the intraday watch lists, per strategy."),
+    "rss_bytes": ("gauge", "Resident set size of the process."),
+    "peak_rss_bytes": ("gauge", "Peak resident set size of the process."),
+}
+
+
+class MetricsRegistry:
+    """
+    In-process metrics kept as plain dicts and rendered in the Prometheus text format.
+
+    Samples collected in another process (e.g. the pipeline worker) are merged in
+    with `merge_remote`, and are rendered with an extra `process` label.
+    """
+
+    def __init__(self, process_name="web"):
+        self.process_name = process_name
+        self._lock = threading.Lock()
+        # (name, sorted label items) -> value
+        self._values = {}
+        # source process -> list of (name, labels, value) samples
+        self._remote_samples = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = value
+
+    def observe(self, name, value, **labels):
+        # Summaries are kept as a count and a sum, which is enough for averages and rates
+        self.inc(f"{name}_count", 1, **labels)
+        self.inc(f"{name}_sum", value, **labels)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start_time, **labels)
+
+    # Update the memory usage gauges of the current process
+    def update_process_metrics(self):
+        import psutil
+
+        self.set("rss_bytes", psutil.Process().memory_info().rss, process=self.process_name)
+        # ru_maxrss is in kilobytes on Linux
+        self.set("peak_rss_bytes", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, process=self.process_name)
+
+    def collect(self) -> list:
+        with self._lock:
+            return [(name, dict(labels), value) for (name, labels), value in self._values.items()]
+
+    def merge_remote(self, source, samples):
+        with self._lock:
+            self._remote_samples[source] = samples
+
+    def render(self) -> str:
+        samples = [(name, labels, value) for name, labels, value in self.collect()]
+        with self._lock:
+            for source, remote_samples in self._remote_samples.items():
+                samples.extend(
+                    (name, {**labels, "process": labels.get("process", source)}, value)
+                    for name, labels, value in remote_samples
+                )
+        lines = []
+        for metric_name, (metric_type, metric_help) in METRIC_SETTING.items():
+            metric_samples = sorted(
+                [sample for sample in samples if _get_base_name(sample[0]) == metric_name],
+                key=lambda sample: (sample[0], sorted(sample[1].items())),
+            )
+            if not metric_samples:
+                continue
+            lines.append(f"# HELP {METRIC_PREFIX}{metric_name} {metric_help}")
+            lines.append(f"# TYPE {METRIC_PREFIX}{metric_name} {metric_type}")
+            for name, labels, value in metric_samples:
+                lines.append(f"{METRIC_PREFIX}{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _get_base_name(name) -> str:
+    for suffix in ("_count", "_sum"):
+        if name.endswith(suffix) and name[:-len(suffix)] in METRIC_SETTING:
+            return name[:-len(suffix)]
+    return name
+
+
+def _escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ""
+    label_text = ",".join(f'{key}="{_escape_label_value(value)}"' for key, value in sorted(labels.items()))
+    return "{" + label_text + "}"
+
+
+metrics = MetricsRegistry()
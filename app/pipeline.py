@@ -0,0 +1,139 @@
+import time
+import threading
+import contextvars
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from config import logger
+from .metrics import metrics
+
+
+class PipelineStopped(Exception):
+    """Raised by a stage to end the pipeline early without an error (e.g. the market is closed)."""
+
+
+class StageFailed(Exception):
+    """Raised by `Pipeline.run` when a required stage fails or misses its deadline."""
+
+
+class Stage:
+    """
+    One step of the update pipeline.
+
+    `func` is called with the results of the `deps` stages as keyword arguments (named after the stages).
+    When it raises or runs longer than `timeout` seconds, the stage is degraded: the pipeline continues
+    with `fallback()` as its result. Stages without `fallback` are required, and fail the whole run instead.
+    """
+
+    def __init__(self, name, func, deps=(), timeout=None, fallback=None):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.timeout = timeout
+        self.fallback = fallback
+
+
+class Pipeline:
+    """
+    DAG of stages: every stage starts as soon as all of its dependencies are done,
+    so independent stages (e.g. the TWSE and TPEX crawls) run in parallel threads.
+
+    A stage which misses its deadline keeps running in the background, but its result is ignored.
+    """
+
+    def __init__(self, stages, max_workers=4):
+        self.stages = {stage.name: stage for stage in stages}
+        self.max_workers = max_workers
+        # Degraded stage -> reason
+        self._degraded = {}
+        self._lock = threading.Lock()
+        self._validate()
+
+    def _validate(self):
+        visited = set()
+        visiting = set()
+
+        def visit(name):
+            if name in visiting:
+                raise ValueError(f"Pipeline stages have a cycle through '{name}'")
+            if name in visited:
+                return
+            visiting.add(name)
+            for dep in self.stages[name].deps:
+                if dep not in self.stages:
+                    raise ValueError(f"Stage '{name}' depends on unknown stage '{dep}'")
+                visit(dep)
+            visiting.discard(name)
+            visited.add(name)
+
+        for name in self.stages:
+            visit(name)
+
+    # Degraded stages (stage -> reason), among the given stages and their upstream stages if `names` is given
+    def get_degraded(self, names=None) -> dict:
+        with self._lock:
+            degraded = dict(self._degraded)
+        if names is None:
+            return degraded
+        upstream = set()
+        pending = list(names)
+        while pending:
+            name = pending.pop()
+            if name not in upstream:
+                upstream.add(name)
+                pending.extend(self.stages[name].deps)
+        return {name: reason for name, reason in degraded.items() if name in upstream}
+
+    # Run every stage and return their results (stage -> result)
+    def run(self, job) -> dict:
+        results = {}
+        pending = dict(self.stages)
+        # Future -> (stage, deadline)
+        running = {}
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="pipeline")
+        try:
+            while pending or running:
+                for name, stage in list(pending.items()):
+                    if all(dep in results for dep in stage.deps):
+                        del pending[name]
+                        inputs = {dep: results[dep] for dep in stage.deps}
+                        deadline = time.monotonic() + stage.timeout if stage.timeout else None
+                        # Stages see the context of the caller (e.g. the Flask app context)
+                        context = contextvars.copy_context()
+                        running[executor.submit(context.run, self._run_stage, job, stage, inputs)] = (stage, deadline)
+                if not running:
+                    raise ValueError(f"Pipeline stages cannot be scheduled: {sorted(pending)}")
+                deadlines = [deadline for _, deadline in running.values() if deadline]
+                timeout = max(0, min(deadlines) - time.monotonic()) if deadlines else None
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, _ = running.pop(future)
+                    try:
+                        results[stage.name] = future.result()
+                    except (PipelineStopped, StageFailed):
+                        raise
+                    except Exception as e:
+                        logger.exception(f"Stage '{stage.name}' failed")
+                        results[stage.name] = self._degrade(stage, f"{type(e).__name__}: {e}")
+                now = time.monotonic()
+                for future, (stage, deadline) in list(running.items()):
+                    if deadline and now >= deadline:
+                        del running[future]
+                        future.cancel()
+                        results[stage.name] = self._degrade(stage, f"timeout after {stage.timeout} seconds")
+        finally:
+            # Stages which missed their deadline are not waited for
+            executor.shutdown(wait=False, cancel_futures=True)
+        return results
+
+    def _run_stage(self, job, stage, inputs):
+        with job.track_stage(stage.name):
+            return stage.func(**inputs)
+
+    def _degrade(self, stage, reason):
+        if stage.fallback is None:
+            raise StageFailed(f"Stage '{stage.name}' failed ({reason})")
+        logger.warning(f"Stage '{stage.name}' degraded ({reason}), continuing without its result")
+        metrics.inc("pipeline_stage_degraded_total", stage=stage.name)
+        with self._lock:
+            self._degraded[stage.name] = reason
+        return stage.fallback()
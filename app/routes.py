@@ -1,15 +1,59 @@
 import gc
 import psutil
 import datetime
-import threading
 
 from config import logger
-from .views import update_and_broadcast
-from flask import current_app, request, Response
-from linebot.exceptions import InvalidSignatureError
+from .jobs import UpdateJobManager
+from .metrics import metrics
+from .webhook import WebhookDispatcher
+from .worker import PipelineWorker
+from flask import current_app, jsonify, request, Response
+
+# NOTE: `views` (pandas, ta, twstock, ...) and the LINE Bot SDK are imported lazily,
+# so that a cold start can answer `/`, `/wakeup` and `/callback` before loading them.
+
+
+# Handle a webhook event in a webhook worker
+def handle_event(event, line_bot_api):
+    from .bot import handle_event as _handle_event
+    _handle_event(event, line_bot_api)
+
+
+# Run the update pipeline in a thread of the web process
+def run_update_job(app, job):
+    from .views import run_update_job as _run_update_job
+    _run_update_job(app, job)
 
 
 def init_routes(app):
+
+    # Run the pipeline in a dedicated worker process unless configured otherwise
+    if app.config["PIPELINE_WORKER_MODE"] == "process":
+        run_func = PipelineWorker().run
+    else:
+        run_func = run_update_job
+    webhook_dispatcher = WebhookDispatcher(
+        lambda: app.config["WEBHOOK_HANDLER"].parser,
+        lambda event: handle_event(event, app.config["LINE_BOT_API"]),
+        workers=app.config["WEBHOOK_WORKERS"],
+        max_queue_size=app.config["WEBHOOK_QUEUE_SIZE"],
+    )
+    job_manager = UpdateJobManager(
+        run_func,
+        max_running_jobs=app.config["MAX_RUNNING_UPDATE_JOBS"],
+        max_pending_jobs=app.config["MAX_PENDING_UPDATE_JOBS"],
+    )
+
+
+    def check_api_access_token():
+        # Check if API-Access-Token header is provided
+        if "API-Access-Token" not in request.headers:
+            return Response("Missing API-Access-Token", status=401)
+        # Check if the provided token is correct
+        elif request.headers["API-Access-Token"] != current_app.config["API_ACCESS_TOKEN"]:
+            return Response("Invalid API-Access-Token", status=401)
+        return None
+
     
     @app.route("/", methods=["GET"])
     def home():
@@ -30,19 +74,26 @@ def init_routes(app):
         Headers:
         - `X-Line-Signature`: Signature for request verification.
 
+        The events are handled asynchronously by the webhook workers, and redelivered events are handled only once.
+
         Responses:
-        - 200 OK: If the request is successfully processed.
+        - 200 OK: If the events are verified and queued.
         - 400 Bad Request: If `X-Line-Signature` is missing or invalid.
+        - 503 Service Unavailable: If the webhook queue is full (LINE redelivers the events which were not queued).
         """
+        from linebot.exceptions import InvalidSignatureError
+
         # Extracting signature and body from request
         signature = request.headers.get("X-Line-Signature")
         body = request.get_data(as_text=True)
-        app.logger.info(f"Request body: {body}")
+        app.logger.debug(f"Request body: {body}")
         try:
-            handler = current_app.config["WEBHOOK_HANDLER"]
-            handler.handle(body, signature)
+            all_enqueued = webhook_dispatcher.submit(body, signature)
         except InvalidSignatureError:
             return Response("Invalid signature", status=400)
+        if not all_enqueued:
+            logger.warning("訊息佇列已滿")
+            return Response("Webhook queue is full", status=503)
         return Response(status=200)
 
 
@@ -58,44 +109,168 @@ def init_routes(app):
         process = psutil.Process()
         memory_usage = process.memory_info().rss / 1024**2
         logger.info(f"目前記憶體使用量 {memory_usage:.2f} MB")
+        metrics.update_process_metrics()
         return Response(status=200)
 
 
+    @app.route("/metrics", methods=["GET"])
+    def get_metrics():
+        """
+        Expose the in-process metrics of the update pipeline (including the worker process) in Prometheus text format.
+
+        Responses:
+        - 200 OK: The metrics in Prometheus text exposition format.
+        """
+        metrics.update_process_metrics()
+        return Response(metrics.render(), status=200, mimetype="text/plain; version=0.0.4")
+
+
     @app.route("/update", methods=["GET"])
     def update():
         """
         Update data and optionally broadcast stock recommendations.
 
+        Requests for a date that is already being updated join the running job instead of starting another one.
+
         Headers:
         - `API-Access-Token` (required): A token to authorize access to this API.
         - `Target-Date` (optional): The date for retrieving data and generating stock recommendations, in "YYYY-MM-DD" format.
         - `Need-Broadcast` (optional): A flag to determine whether the stock recommendation should be broadcasted via Line Bot.
             - Accepts values "true" or "false" (case-insensitive). Defaults to "false" if not provided.
+        - `Force-Update` (optional): A flag to recompute the recommendations even if the archive has a complete result for the date and the current strategies.
+            - Accepts values "true" or "false" (case-insensitive). Defaults to "false" if not provided.
 
         Responses:
-        - 200 OK: If the request is successfully processed.
+        - 200 OK: If the request is successfully processed. The body contains `job_id` and whether the request was `deduplicated`.
         - 400 Bad Request: If `Target-Date` has an invalid format.
         - 401 Unauthorized: If `API-Access-Token` is missing or invalid.
+        - 429 Too Many Requests: If too many update jobs are already queued or running.
         """
-        # Check if API-Access-Token header is provided
-        if "API-Access-Token" not in request.headers:
-            return Response("Missing API-Access-Token", status=401)
-        # Check if the provided token is correct
-        elif request.headers["API-Access-Token"] != current_app.config["API_ACCESS_TOKEN"]:
-            return Response("Invalid API-Access-Token", status=401)
+        error_response = check_api_access_token()
+        if error_response:
+            return error_response
+        target_date = request.headers.get("Target-Date", None)  # with format "YYYY-MM-DD"
+
+        if target_date:
+            try:
+                target_date = datetime.datetime.strptime(target_date, "%Y-%m-%d").date()
+            except ValueError:
+                return Response("Invalid Target-Date format", status=400)
+
+        need_broadcast = request.headers.get("Need-Broadcast", "false").lower() == "true"
+        force = request.headers.get("Force-Update", "false").lower() == "true"
+        # Assign update and broadcast
+        app = current_app._get_current_object()
+        job, created = job_manager.submit(app, target_date, need_broadcast, force)
+        if not job:
+            logger.warning("更新任務數量已達上限")
+            return Response("Too many update jobs", status=429)
+        if created:
+            logger.info(f"開始進行推薦 (job_id={job.job_id})")
         else:
-            target_date = request.headers.get("Target-Date", None)  # with format "YYYY-MM-DD"
-            
-            if target_date:
-                try:
-                    target_date = datetime.datetime.strptime(target_date, "%Y-%m-%d").date()
-                except ValueError:
-                    return Response("Invalid Target-Date format", status=400)
-                
-            need_broadcast = request.headers.get("Need-Broadcast", "false").lower() == "true"
-            logger.info("開始進行推薦")
-            # Assign update and broadcast
-            app = current_app._get_current_object()
-            update_and_broadcast_thread = threading.Thread(target=update_and_broadcast, args=(app, target_date, need_broadcast))
-            update_and_broadcast_thread.start()
-            return Response(status=200)
+            logger.info(f"合併至進行中的推薦任務 (job_id={job.job_id})")
+        return jsonify({"job_id": job.job_id, "deduplicated": not created}), 200
+
+
+    @app.route("/screen", methods=["GET", "POST"])
+    def screen():
+        """
+        Screen the latest snapshot with a filter expression, without crawling any data.
+
+        Headers:
+        - `API-Access-Token` (required): A token to authorize access to this API.
+
+        Parameters:
+        - `expression` (required): The filter expression, as a query parameter or in a JSON body, e.g. `收盤 > 20 and k9 > k9[-1] and 外資買賣超 >= 0`.
+            - `name[-n]` is the value of a history field n trading days before the data date.
+            - Names which are not identifiers are quoted with backticks, e.g. `` `(月)營收年增率(%)` > 10 ``.
+
+        Responses:
+        - 200 OK: The data date of the snapshot and the matched stocks, with the values of the referenced columns.
+        - 400 Bad Request: If `expression` is missing or invalid.
+        - 401 Unauthorized: If `API-Access-Token` is missing or invalid.
+        - 404 Not Found: If there is no snapshot yet.
+        """
+        from .screener import ScreenExpressionError, get_screen_data, run_screen
+
+        error_response = check_api_access_token()
+        if error_response:
+            return error_response
+        body = request.get_json(silent=True) or {}
+        expression = request.args.get("expression") or body.get("expression")
+        if not expression:
+            return Response("Missing expression", status=400)
+        data = get_screen_data()
+        if data is None:
+            return Response("No snapshot available", status=404)
+        try:
+            stocks = run_screen(expression, data)
+        except ScreenExpressionError as e:
+            return Response(str(e), status=400)
+        return jsonify({"target_date": str(data.target_date), "expression": expression, "count": len(stocks), "stocks": stocks}), 200
+
+
+    @app.route("/similar", methods=["GET"])
+    def similar():
+        """
+        Find the stock windows whose close and volume patterns are the most similar to the window of a stock.
+
+        Headers:
+        - `API-Access-Token` (required): A token to authorize access to this API.
+
+        Parameters:
+        - `stock_id` (required): The stock of the query window.
+        - `end_date` (optional): The last day of the query window, in YYYY-MM-DD format. Defaults to the latest date.
+        - `top` (optional): The number of similar windows to return. Defaults to 10.
+        - `latest` (optional): If `true`, only compare the windows ending on the latest date.
+
+        Responses:
+        - 200 OK: The similar windows from the nearest, with their z-normalized distances.
+        - 400 Bad Request: If a parameter is missing or invalid.
+        - 401 Unauthorized: If `API-Access-Token` is missing or invalid.
+        - 404 Not Found: If there is not enough history yet.
+        """
+        from .similarity import find_similar, get_similarity_index
+
+        error_response = check_api_access_token()
+        if error_response:
+            return error_response
+        stock_id = request.args.get("stock_id")
+        if not stock_id:
+            return Response("Missing stock_id", status=400)
+        try:
+            end_date = datetime.date.fromisoformat(request.args["end_date"]) if request.args.get("end_date") else None
+            top_n = int(request.args.get("top", 10))
+        except ValueError:
+            return Response("Invalid end_date or top", status=400)
+        latest_only = request.args.get("latest", "false").lower() == "true"
+        index = get_similarity_index()
+        if index is None:
+            return Response("Not enough history available", status=404)
+        try:
+            matches = find_similar(index, stock_id, end_date, top_n, latest_only)
+        except ValueError as e:
+            return Response(str(e), status=400)
+        return jsonify({"stock_id": stock_id, "end_date": str(end_date) if end_date else None, "window": index.window, "matches": matches}), 200
+
+
+    @app.route("/update/<job_id>", methods=["GET"])
+    def update_status(job_id):
+        """
+        Get the status of an update job.
+
+        Headers:
+        - `API-Access-Token` (required): A token to authorize access to this API.
+
+        Responses:
+        - 200 OK: The job status, including the current stage, progress and per-stage timings (in seconds).
+        - 401 Unauthorized: If `API-Access-Token` is missing or invalid.
+        - 404 Not Found: If the job does not exist or has been evicted.
+        """
+        error_response = check_api_access_token()
+        if error_response:
+            return error_response
+        job = job_manager.get(job_id)
+        if not job:
+            return Response("Job not found", status=404)
+        return jsonify(job.to_dict()), 200
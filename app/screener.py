@@ -0,0 +1,284 @@
+import re
+import ast
+import datetime
+import operator
+import threading
+import numpy as np
+import pandas as pd
+
+from functools import lru_cache, reduce
+from .store import load_snapshot, load_snapshot_meta, load_history_panel
+
+## Ad-hoc Screener
+#
+# Filter expressions evaluated against the latest snapshot, e.g. "收盤 > 20 and k9 > k9[-1] and 外資買賣超 >= 0":
+# - a name is the value of a market data column (or a stored history field) on the data date
+# - `name[-n]` is the value of a history field n trading days before the data date
+# - names which are not identifiers are quoted with backticks, e.g. "`(月)營收年增率(%)` > 10"
+# - `and`, `or`, `not`, comparisons (chained too), `+ - * /`, numbers, and strings compared with `==` / `!=`
+
+# Trading days of history loaded for the `name[-n]` lookups
+SCREEN_HISTORY_DAYS = 60
+
+# Compiled plans kept per expression string
+SCREEN_PLAN_CACHE_SIZE = 256
+
+# Longer expressions are rejected before parsing
+MAX_SCREEN_EXPRESSION_LENGTH = 1000
+
+_BACKTICK_PATTERN = re.compile(r"`([^`]+)`")
+
+_COMPARE_OPERATORS = {
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+}
+
+_BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+}
+
+
+class ScreenExpressionError(ValueError):
+    """Invalid screen expression, or a name which the snapshot does not have."""
+
+
+class ScreenData:
+    """
+    Arrays of the latest snapshot, aligned on its stocks: one array per market data column (data date values),
+    and one (day x stock) matrix per stored history field, the data date being the last row.
+    """
+
+    def __init__(self, target_date, market_data_df, history_panel):
+        self.target_date = target_date
+        self.stock_ids = market_data_df.index.astype(str).to_numpy()
+        self._columns = {}
+        for column, series in market_data_df.items():
+            first_value = series.dropna().iloc[0] if series.notna().any() else None
+            # History list columns are read from the history store instead
+            if isinstance(first_value, list):
+                continue
+            if pd.api.types.is_numeric_dtype(series):
+                self._columns[column] = series.to_numpy(dtype=float, na_value=np.nan)
+            else:
+                self._columns[column] = series.to_numpy(dtype=object)
+        self._histories = {}
+        # Offset of the data date in the history matrices: 0 if its row is stored, 1 if the history ends the day before
+        self._history_offset = 0
+        if len(history_panel.dates):
+            self._history_offset = 0 if history_panel.dates[-1].date() == target_date else 1
+            for field, field_df in history_panel.fields.items():
+                self._histories[field] = field_df.reindex(columns=self.stock_ids).to_numpy(dtype=float)
+
+    @property
+    def size(self) -> int:
+        return len(self.stock_ids)
+
+    def has(self, name, days_ago=0) -> bool:
+        if days_ago == 0 and name in self._columns:
+            return True
+        return name in self._histories
+
+    # Values of a name `days_ago` trading days before the data date
+    def get(self, name, days_ago=0) -> np.ndarray:
+        if days_ago == 0 and name in self._columns:
+            return self._columns[name]
+        history = self._histories[name]
+        row = days_ago - self._history_offset
+        if row < 0 or row >= history.shape[0]:
+            return np.full(self.size, np.nan)
+        return history[-1 - row]
+
+
+class ScreenPlan:
+    """Compiled screen expression: `evaluate(data)` returns the boolean mask of the matched stocks."""
+
+    def __init__(self, expression, evaluate_func, references):
+        self.expression = expression
+        self.references = references
+        self._evaluate_func = evaluate_func
+
+    def evaluate(self, data) -> np.ndarray:
+        for name, days_ago in self.references:
+            if not data.has(name, days_ago):
+                raise ScreenExpressionError(f"Unknown column: {name}" if days_ago == 0 else f"No history for: {name}")
+        with np.errstate(divide="ignore", invalid="ignore"):
+            try:
+                result = self._evaluate_func(data)
+            except (TypeError, ArithmeticError, ValueError) as e:
+                raise ScreenExpressionError(f"Invalid operands: {e}")
+        return np.broadcast_to(_to_mask(result), (data.size,))
+
+
+def _to_mask(values) -> np.ndarray:
+    values = np.asarray(values)
+    if values.dtype == bool:
+        return values
+    if values.dtype.kind == "f":
+        # NaN is not a match
+        return np.nan_to_num(values) != 0
+    return values.astype(bool)
+
+
+def _is_string_constant(node) -> bool:
+    return isinstance(node, ast.Constant) and isinstance(node.value, str)
+
+
+class _PlanCompiler:
+    """Compile the AST of an expression into nested functions of `ScreenData`."""
+
+    def __init__(self, quoted_names):
+        self.quoted_names = quoted_names
+        # (name, days_ago) read by the expression
+        self.references = set()
+
+    def compile(self, node):
+        if isinstance(node, ast.BoolOp):
+            operands = [self.compile(value) for value in node.values]
+            combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+            return lambda data: reduce(combine, (_to_mask(operand(data)) for operand in operands))
+        if isinstance(node, ast.UnaryOp):
+            operand = self.compile(node.operand)
+            if isinstance(node.op, ast.Not):
+                return lambda data: ~_to_mask(operand(data))
+            if isinstance(node.op, ast.USub):
+                return lambda data: -operand(data)
+            if isinstance(node.op, ast.UAdd):
+                return operand
+        if isinstance(node, ast.Compare):
+            compare_funcs = [self._get_operator(_COMPARE_OPERATORS, op) for op in node.ops]
+            operands = []
+            for i, operand_node in enumerate([node.left] + node.comparators):
+                # Strings are only compared for (in)equality, e.g. `產業別 == '半導體業'`
+                adjacent_ops = node.ops[max(i - 1, 0):i + 1]
+                if _is_string_constant(operand_node) and all(isinstance(op, (ast.Eq, ast.NotEq)) for op in adjacent_ops):
+                    value = operand_node.value
+                    operands.append(lambda data, value=value: value)
+                else:
+                    operands.append(self.compile(operand_node))
+
+            def compare(data):
+                values = [operand(data) for operand in operands]
+                return reduce(np.logical_and, (
+                    compare_func(values[i], values[i + 1])
+                    for i, compare_func in enumerate(compare_funcs)
+                ))
+            return compare
+        if isinstance(node, ast.BinOp):
+            left, right = self.compile(node.left), self.compile(node.right)
+            binary_func = self._get_operator(_BINARY_OPERATORS, node.op)
+            return lambda data: binary_func(left(data), right(data))
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            # NumPy scalars, so the arithmetic between constants follows the array semantics (e.g. 1/0 is inf)
+            value = np.float64(node.value)
+            return lambda data: value
+        if _is_string_constant(node):
+            raise ScreenExpressionError("Strings can only be compared with == or !=")
+        if isinstance(node, ast.Name):
+            return self._compile_reference(node.id, 0)
+        if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name):
+            try:
+                offset = ast.literal_eval(node.slice)
+            except (ValueError, TypeError, SyntaxError):
+                offset = None
+            if not isinstance(offset, int) or isinstance(offset, bool) or offset > 0:
+                raise ScreenExpressionError(f"History index of {self._get_name(node.value.id)} must be 0 or a negative integer")
+            if -offset > SCREEN_HISTORY_DAYS:
+                raise ScreenExpressionError(f"Only the last {SCREEN_HISTORY_DAYS} days of history are available")
+            return self._compile_reference(node.value.id, -offset)
+        raise ScreenExpressionError(f"Unsupported syntax: {type(node).__name__}")
+
+    def _get_name(self, identifier) -> str:
+        return self.quoted_names.get(identifier, identifier)
+
+    def _compile_reference(self, identifier, days_ago):
+        name = self._get_name(identifier)
+        self.references.add((name, days_ago))
+        return lambda data: data.get(name, days_ago)
+
+    @staticmethod
+    def _get_operator(operators, op):
+        if type(op) not in operators:
+            raise ScreenExpressionError(f"Unsupported operator: {type(op).__name__}")
+        return operators[type(op)]
+
+
+# (Public) Parse and compile an expression, cached per expression string
+@lru_cache(maxsize=SCREEN_PLAN_CACHE_SIZE)
+def compile_screen(expression) -> ScreenPlan:
+    if not expression or not expression.strip():
+        raise ScreenExpressionError("Empty expression")
+    if len(expression) > MAX_SCREEN_EXPRESSION_LENGTH:
+        raise ScreenExpressionError(f"Expression longer than {MAX_SCREEN_EXPRESSION_LENGTH} characters")
+    # Quoted names become placeholder identifiers
+    quoted_names = {}
+
+    def quote_name(match):
+        placeholder = f"__quoted_{len(quoted_names)}"
+        quoted_names[placeholder] = match.group(1)
+        return placeholder
+
+    source = _BACKTICK_PATTERN.sub(quote_name, expression.strip())
+    try:
+        tree = ast.parse(source, mode="eval")
+    except SyntaxError as e:
+        raise ScreenExpressionError(f"Invalid expression: {e.msg}")
+    except RecursionError:
+        raise ScreenExpressionError("Expression is nested too deeply")
+    compiler = _PlanCompiler(quoted_names)
+    evaluate_func = compiler.compile(tree.body)
+    return ScreenPlan(expression, evaluate_func, frozenset(compiler.references))
+
+
+_screen_data = None
+_screen_data_key = None
+_screen_data_lock = threading.Lock()
+
+
+# (Public) Arrays of the latest snapshot, reloaded only when a new snapshot is saved (None if there is no snapshot)
+def get_screen_data():
+    global _screen_data, _screen_data_key
+    meta = load_snapshot_meta()
+    if not meta:
+        return None
+    key = (meta["target_date"], meta["created_at"])
+    with _screen_data_lock:
+        if _screen_data_key != key:
+            market_data_df, _, meta = load_snapshot(meta["target_date"], meta.get("strategy_version"))
+            target_date = datetime.date.fromisoformat(meta["target_date"])
+            # Calendar days covering the trading days, with some room for holidays
+            start_date = target_date - datetime.timedelta(days=SCREEN_HISTORY_DAYS * 7 // 5 + 14)
+            history_panel = load_history_panel(start_date=start_date, end_date=target_date)
+            _screen_data = ScreenData(target_date, market_data_df, history_panel)
+            _screen_data_key = key
+        return _screen_data
+
+
+# (Public) Run a screen on the latest snapshot: the matched rows, with the data date values of the referenced names
+def run_screen(expression, data):
+    plan = compile_screen(expression)
+    mask = plan.evaluate(data)
+    columns = [column for column in ["名稱", "產業別"] if data.has(column)]
+    columns += sorted(name for name, days_ago in plan.references if days_ago == 0 and name not in columns)
+    stocks = []
+    for i in np.flatnonzero(mask):
+        stock = {"代號": str(data.stock_ids[i])}
+        for column in columns:
+            stock[column] = _to_json_value(data.get(column)[i])
+        stocks.append(stock)
+    return stocks
+
+
+def _to_json_value(value):
+    if isinstance(value, (np.floating, float)):
+        # History values are stored as float32
+        return None if np.isnan(value) else round(float(value), 4)
+    if isinstance(value, np.generic):
+        return value.item()
+    return None if pd.isna(value) else value
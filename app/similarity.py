@@ -0,0 +1,200 @@
+import argparse
+import datetime
+import threading
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from config import logger
+from .store import load_snapshot_meta, load_history_panel
+from .strategies.ranking import select_top_k
+
+# Usage: python -m app.similarity --stock 2330 --window 20 --top 10
+#        python -m app.similarity --stock 3008 --end-date 2024-03-01 --latest
+
+## Pattern Similarity Search
+#
+# Windows of N trading days are compared after z-normalization (each window minus its mean, divided by its
+# standard deviation), so the shape of the moves counts, not the price level or volume scale.
+# The z-normalized Euclidean distance of a query q and a window t of length m is
+#   d² = 2m (1 - Σ zq_i t_i / (m σ_t))
+# so the index only keeps the rolling deviation of every (window, stock), and a query costs
+# one matrix-vector product over a strided (window x stock x day) view of the (date x stock) matrix,
+# without materializing the windows.
+
+DEFAULT_WINDOW = 20
+
+# Fields compared and their weights (the volume is compared in log scale)
+SIMILARITY_FIELD_SETTING = {
+    "收盤": 1.0,
+    "volume": 0.5,
+}
+LOG_SCALE_FIELDS = ["volume"]
+
+# Windows with a smaller relative deviation are flat and have no shape to compare
+MIN_RELATIVE_STD = 1e-6
+
+
+class SimilarityIndex:
+    """
+    Sliding-window similarity index of a history panel.
+
+    For each field, the (date x stock) values are kept with their rolling standard deviation
+    over `window` days (row t is the window ending on date `window - 1 + t`), and a validity mask
+    (windows without missing days and with a non-flat shape).
+    """
+
+    def __init__(self, panel, window=DEFAULT_WINDOW, field_setting=SIMILARITY_FIELD_SETTING):
+        if len(panel.dates) < window:
+            raise ValueError(f"The history has {len(panel.dates)} days, less than the window of {window} days")
+        self.window = window
+        self.dates = panel.dates
+        self.stock_ids = panel.stock_ids.astype(str)
+        self._positions = {stock_id: j for j, stock_id in enumerate(self.stock_ids)}
+        self._fields = {}
+        for field, weight in field_setting.items():
+            values = panel[field].to_numpy(dtype=float)
+            if field in LOG_SCALE_FIELDS:
+                values = np.log1p(np.clip(values, 0, None))
+            valid = ~np.isnan(values)
+            filled = np.where(valid, values, 0)
+            # Rolling sums from cumulative sums, in float64 to keep the differences exact enough
+            zero_row = np.zeros((1, values.shape[1]))
+            sums = np.vstack([zero_row, np.cumsum(filled, axis=0)])
+            square_sums = np.vstack([zero_row, np.cumsum(filled ** 2, axis=0)])
+            counts = np.vstack([zero_row, np.cumsum(valid, axis=0)])
+            mean = (sums[window:] - sums[:-window]) / window
+            variance = (square_sums[window:] - square_sums[:-window]) / window - mean ** 2
+            std = np.sqrt(np.clip(variance, 0, None))
+            window_valid = ((counts[window:] - counts[:-window]) == window) & (std > MIN_RELATIVE_STD * np.abs(mean))
+            self._fields[field] = {
+                "weight": weight,
+                # Row-major, so the windows of a row of dates are contiguous for the products
+                "values": np.ascontiguousarray(filled, dtype=np.float32),
+                # m σ of the valid windows, NaN for the others
+                "scale": np.where(window_valid, window * std, np.nan).astype(np.float32),
+            }
+
+    # Position of the window of a stock ending on `end_date` (the last date on or before it)
+    def _get_window_position(self, stock_id, end_date=None) -> tuple:
+        j = self._positions.get(str(stock_id))
+        if j is None:
+            raise ValueError(f"Unknown stock {stock_id}")
+        end = len(self.dates) - 1 if end_date is None else int(self.dates.searchsorted(pd.Timestamp(end_date), side="right")) - 1
+        if end < self.window - 1:
+            raise ValueError(f"Not enough history before {end_date}")
+        return j, end - (self.window - 1)
+
+    # Z-normalized query windows (field -> array) of a stock window
+    def get_query(self, stock_id, end_date=None) -> dict:
+        j, t = self._get_window_position(stock_id, end_date)
+        query = {}
+        for field, data in self._fields.items():
+            values = data["values"][t:t + self.window, j].astype(float)
+            if np.isnan(data["scale"][t, j]):
+                raise ValueError(f"The {field} window of {stock_id} has missing days or no move")
+            query[field] = (values - values.mean()) / values.std()
+        return query
+
+    # Squared distances of the windows starting on rows `start` to `stop` - 1 (row x stock) to a query, NaN for the invalid windows
+    def _get_distances(self, query, start, stop) -> np.ndarray:
+        m = self.window
+        distances = None
+        for field, data in self._fields.items():
+            # Σ zq_i t_i of the windows, from a strided view (no copy) of the windows
+            windows = sliding_window_view(data["values"][start:stop + m - 1], m, axis=0)
+            field_distances = windows @ query[field].astype(np.float32)
+            # weight * 2m (1 - correlation), in place since the (window x stock) arrays are large
+            with np.errstate(divide="ignore", invalid="ignore"):
+                field_distances /= data["scale"][start:stop]
+            np.clip(field_distances, -1, 1, out=field_distances)
+            field_distances *= -data["weight"] * 2 * m
+            field_distances += data["weight"] * 2 * m
+            if distances is None:
+                distances = field_distances
+            else:
+                distances += field_distances
+        return distances
+
+    def search(self, query, top_n=10, latest_only=False, exclude=None, one_per_stock=True) -> list:
+        """
+        Nearest windows of a z-normalized query (field -> array, see `get_query`), as a list of
+        `{"stock_id", "end_date", "distance"}` from the nearest.
+
+        `latest_only` compares only the windows ending on the last date (stocks which look like the query now),
+        `exclude` is a `(stock_id, end_date)` window whose overlapping windows (trivial matches) are skipped,
+        and `one_per_stock` keeps only the nearest window of each stock.
+        """
+        window_count = len(self.dates) - self.window + 1
+        start = window_count - 1 if latest_only else 0
+        rows = np.arange(start, window_count)
+        distances = self._get_distances(query, start, window_count)
+        if exclude is not None:
+            j, t = self._get_window_position(*exclude)
+            overlapping = np.abs(rows - t) < self.window
+            distances[overlapping, j] = np.nan
+        scores = -np.where(np.isnan(distances), np.inf, distances)
+        if one_per_stock:
+            best_rows = np.argmax(scores, axis=0)
+            stock_scores = scores[best_rows, np.arange(scores.shape[1])]
+            matches = [(best_rows[j], j) for j in select_top_k(stock_scores, top_n) if np.isfinite(stock_scores[j])]
+        else:
+            flat_scores = scores.ravel()
+            matches = [divmod(position, scores.shape[1]) for position in select_top_k(flat_scores, top_n) if np.isfinite(flat_scores[position])]
+        return [
+            {
+                "stock_id": str(self.stock_ids[j]),
+                "end_date": str(self.dates[rows[row] + self.window - 1].date()),
+                "distance": round(float(np.sqrt(max(distances[row, j], 0))), 4),
+            }
+            for row, j in matches
+        ]
+
+
+_similarity_index = None
+_similarity_index_key = None
+_similarity_index_lock = threading.Lock()
+
+
+# (Public) Similarity index of the stored history, rebuilt only when a new snapshot is saved (None if there is no history)
+def get_similarity_index(window=DEFAULT_WINDOW):
+    global _similarity_index, _similarity_index_key
+    meta = load_snapshot_meta()
+    key = (meta["target_date"], meta["created_at"], window) if meta else (None, None, window)
+    with _similarity_index_lock:
+        if _similarity_index_key != key:
+            panel = load_history_panel(list(SIMILARITY_FIELD_SETTING))
+            if len(panel.dates) < window:
+                return None
+            # Only one index is kept, the history can span years
+            _similarity_index = None
+            _similarity_index = SimilarityIndex(panel, window)
+            _similarity_index_key = key
+        return _similarity_index
+
+
+# (Public) Stocks whose windows look like the window of a stock ending on `end_date` (the latest one if not given)
+def find_similar(index, stock_id, end_date=None, top_n=10, latest_only=False) -> list:
+    query = index.get_query(stock_id, end_date)
+    return index.search(query, top_n, latest_only=latest_only, exclude=(stock_id, end_date))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the stock windows most similar to the window of a stock.")
+    parser.add_argument("--stock", required=True, help="Stock id of the query window")
+    parser.add_argument("--end-date", default=None, help="Last day of the query window, in YYYY-MM-DD format (latest by default)")
+    parser.add_argument("--window", type=int, default=DEFAULT_WINDOW, help="Window length in trading days")
+    parser.add_argument("--top", type=int, default=10, help="Number of similar windows to show")
+    parser.add_argument("--latest", action="store_true", help="Only compare the windows ending on the latest date")
+    args = parser.parse_args()
+
+    panel = load_history_panel(list(SIMILARITY_FIELD_SETTING))
+    logger.info(f"歷史資料大小 (日期 x 股票) {panel.shape}")
+    index = SimilarityIndex(panel, args.window)
+    end_date = datetime.date.fromisoformat(args.end_date) if args.end_date else None
+    for match in find_similar(index, args.stock, end_date, args.top, args.latest):
+        logger.info(f"{match['stock_id']} {match['end_date']} 距離 {match['distance']}")
+
+
+if __name__ == "__main__":
+    main()
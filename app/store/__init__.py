@@ -0,0 +1,4 @@
+from .snapshot import save_snapshot, mark_latest_snapshot, load_snapshot, load_snapshot_meta, load_stock_index
+from .history import update_history, load_history_panel
+from .subscribers import load_subscribers, update_subscriber, add_subscribers, remove_subscriber
+from .alerts import get_alert_store_version, load_alerts, add_alert, remove_alerts, restore_alerts
@@ -0,0 +1,99 @@
+import os
+import json
+import fcntl
+import datetime
+import threading
+
+from contextlib import contextmanager
+from config import config
+
+# Layout: <DATA_DIR>/alerts.json: {"next_id": ..., "alerts": {alert id -> alert}}
+# An alert is {"user_id", "stock_id", "field", "direction" ("above" or "below"), and "threshold" or "other_field"}
+ALERT_PATH = os.path.join(config.DATA_DIR, "alerts.json")
+# The web process, the pipeline worker and `python -m app.intraday --alerts` all change the store
+ALERT_LOCK_PATH = f"{ALERT_PATH}.lock"
+
+_lock = threading.Lock()
+
+
+# Hold the store between the threads and the processes for a read-modify-write
+@contextmanager
+def _locked():
+    with _lock:
+        os.makedirs(os.path.dirname(ALERT_LOCK_PATH) or ".", exist_ok=True)
+        with open(ALERT_LOCK_PATH, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _read_alert_store() -> dict:
+    try:
+        with open(ALERT_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"next_id": 1, "alerts": {}}
+
+
+def _write_alert_store(store):
+    os.makedirs(os.path.dirname(ALERT_PATH) or ".", exist_ok=True)
+    tmp_path = f"{ALERT_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(store, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, ALERT_PATH)
+
+
+# Modification time of the alert store (None if there is no alert yet), to reload the alerts only when they change
+def get_alert_store_version():
+    try:
+        return os.stat(ALERT_PATH).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+# Load every alert: alert id -> alert
+def load_alerts() -> dict:
+    with _lock:
+        return _read_alert_store()["alerts"]
+
+
+# Add an alert, and return its id
+def add_alert(user_id, **alert) -> str:
+    with _locked():
+        store = _read_alert_store()
+        alert_id = str(store["next_id"])
+        store["next_id"] += 1
+        store["alerts"][alert_id] = {
+            "user_id": user_id,
+            **alert,
+            "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        }
+        _write_alert_store(store)
+        return alert_id
+
+
+# Remove alerts (the ones of other users are kept if `user_id` is given), and return the ids removed
+def remove_alerts(alert_ids, user_id=None) -> list:
+    with _locked():
+        store = _read_alert_store()
+        removed_ids = [
+            alert_id for alert_id in alert_ids
+            if alert_id in store["alerts"] and (user_id is None or store["alerts"][alert_id]["user_id"] == user_id)
+        ]
+        for alert_id in removed_ids:
+            del store["alerts"][alert_id]
+        if removed_ids:
+            _write_alert_store(store)
+        return removed_ids
+
+
+# Put back removed alerts (alert id -> alert) under their ids, e.g. when their notification could not be sent
+def restore_alerts(alerts):
+    with _locked():
+        store = _read_alert_store()
+        restored = {alert_id: alert for alert_id, alert in alerts.items() if alert_id not in store["alerts"]}
+        if restored:
+            store["alerts"].update(restored)
+            _write_alert_store(store)
@@ -0,0 +1,71 @@
+import os
+import pickle
+
+from urllib.parse import quote, unquote
+from config import config
+
+# Layout: <DATA_DIR>/history/<quoted field name>.pkl (date x stock DataFrame) and industry.pkl (stock -> industry)
+HISTORY_DIR = os.path.join(config.DATA_DIR, "history")
+INDUSTRY_PATH = os.path.join(HISTORY_DIR, "industry.pkl")
+
+
+def _get_field_path(field) -> str:
+    return os.path.join(HISTORY_DIR, f"{quote(field, safe='')}.pkl")
+
+
+def _load_pickle(path):
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _dump_pickle(path, obj):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(obj, f)
+    os.replace(tmp_path, path)
+
+
+# Merge a panel into the history store, newer values overwrite the stored ones
+def update_history(panel):
+    os.makedirs(HISTORY_DIR, exist_ok=True)
+    for field, df in panel.fields.items():
+        stored_df = _load_pickle(_get_field_path(field))
+        if stored_df is not None:
+            df = df.combine_first(stored_df)
+        _dump_pickle(_get_field_path(field), df.dropna(how="all").astype("float32"))
+    if not panel.industry.dropna().empty:
+        stored_industry = _load_pickle(INDUSTRY_PATH)
+        industry = panel.industry.dropna()
+        if stored_industry is not None:
+            industry = industry.combine_first(stored_industry)
+        _dump_pickle(INDUSTRY_PATH, industry)
+
+
+# Load the stored history as a panel (all fields if `fields` is not given)
+def load_history_panel(fields=None, start_date=None, end_date=None):
+    from ..backtest.panel import Panel
+
+    if fields is None:
+        fields = _list_stored_fields()
+    field_dfs = {}
+    for field in fields:
+        df = _load_pickle(_get_field_path(field))
+        if df is not None:
+            field_dfs[field] = df
+    panel = Panel(field_dfs, _load_pickle(INDUSTRY_PATH))
+    if start_date or end_date:
+        panel = panel.select(start_date, end_date)
+    return panel
+
+
+def _list_stored_fields() -> list:
+    if not os.path.isdir(HISTORY_DIR):
+        return []
+    return [
+        unquote(filename[:-len(".pkl")])
+        for filename in sorted(os.listdir(HISTORY_DIR))
+        if filename.endswith(".pkl") and filename != os.path.basename(INDUSTRY_PATH)
+    ]
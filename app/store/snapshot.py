@@ -0,0 +1,120 @@
+import os
+import json
+import pickle
+import datetime
+
+from config import config
+
+# Layout: <DATA_DIR>/snapshots/<YYYY-MM-DD>/<strategy version>/{market_data.pkl, watch_lists.pkl, meta.json, stock_index.json}
+# <DATA_DIR>/snapshots/<YYYY-MM-DD>/latest.json points to the latest version of a date, and <DATA_DIR>/snapshots/latest.json to the latest snapshot
+# (snapshots saved before the versions existed are directly in <DATA_DIR>/snapshots/<YYYY-MM-DD>/)
+SNAPSHOT_DIR = os.path.join(config.DATA_DIR, "snapshots")
+LATEST_POINTER_PATH = os.path.join(SNAPSHOT_DIR, "latest.json")
+
+
+def _get_snapshot_dir(target_date, strategy_version=None) -> str:
+    if strategy_version:
+        return os.path.join(SNAPSHOT_DIR, str(target_date), strategy_version)
+    return os.path.join(SNAPSHOT_DIR, str(target_date))
+
+
+def _get_date_pointer_path(target_date) -> str:
+    return os.path.join(SNAPSHOT_DIR, str(target_date), "latest.json")
+
+
+# Write to a temporary file first, so readers never see a partially written file
+def _atomic_write(path, data: bytes):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _write_json(path, obj):
+    _atomic_write(path, json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8"))
+
+
+def _read_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+# Resolve the snapshot directory: the latest snapshot if no date is given, and the latest version of the date if no version is given
+def _resolve_snapshot_dir(target_date=None, strategy_version=None):
+    if not target_date:
+        latest = _read_json(LATEST_POINTER_PATH)
+        if not latest:
+            return None
+        target_date, strategy_version = latest["target_date"], latest.get("strategy_version")
+    elif not strategy_version:
+        pointer = _read_json(_get_date_pointer_path(target_date))
+        strategy_version = pointer["strategy_version"] if pointer else None
+    return _get_snapshot_dir(target_date, strategy_version)
+
+
+# Mark a stored snapshot as the latest one of its date, and as the latest snapshot unless a later date is stored
+def mark_latest_snapshot(target_date, strategy_version=None):
+    if strategy_version:
+        _write_json(_get_date_pointer_path(target_date), {"strategy_version": strategy_version})
+    latest = _read_json(LATEST_POINTER_PATH)
+    if latest and latest["target_date"] > str(target_date):
+        return
+    _write_json(LATEST_POINTER_PATH, {"target_date": str(target_date), "strategy_version": strategy_version})
+
+
+# Persist the result of an update run and mark it as the latest snapshot
+def save_snapshot(target_date, market_data_df, watch_list_dfs, economic_events, message, degradation=None, stock_index=None, strategy_version=None) -> dict:
+    snapshot_dir = _get_snapshot_dir(target_date, strategy_version)
+    os.makedirs(snapshot_dir, exist_ok=True)
+    _atomic_write(os.path.join(snapshot_dir, "market_data.pkl"), pickle.dumps(market_data_df))
+    _atomic_write(os.path.join(snapshot_dir, "watch_lists.pkl"), pickle.dumps(watch_list_dfs))
+    meta = {
+        "target_date": str(target_date),
+        "strategy_version": strategy_version,
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "watch_lists": [
+            {"strategy": i+1, "stock_ids": [str(stock_id) for stock_id in watch_list_df.index]}
+            for i, watch_list_df in enumerate(watch_list_dfs)
+        ],
+        "economic_events": economic_events,
+        "message": message,
+        # Degraded pipeline stages and the affected strategies, if any
+        "degradation": degradation,
+    }
+    _write_json(os.path.join(snapshot_dir, "meta.json"), meta)
+    if stock_index is not None:
+        _write_json(os.path.join(snapshot_dir, "stock_index.json"), stock_index)
+    mark_latest_snapshot(target_date, strategy_version)
+    return meta
+
+
+# Load the metadata (watch list ids, economic events, broadcast message) without unpickling any DataFrame
+def load_snapshot_meta(target_date=None, strategy_version=None):
+    snapshot_dir = _resolve_snapshot_dir(target_date, strategy_version)
+    if not snapshot_dir:
+        return None
+    return _read_json(os.path.join(snapshot_dir, "meta.json"))
+
+
+# Load the stock lookup index (stock id -> reply values) of a snapshot, without unpickling any DataFrame
+def load_stock_index(target_date=None, strategy_version=None):
+    snapshot_dir = _resolve_snapshot_dir(target_date, strategy_version)
+    if not snapshot_dir:
+        return None
+    return _read_json(os.path.join(snapshot_dir, "stock_index.json"))
+
+
+# Load the full snapshot: (market_data_df, watch_list_dfs, meta)
+def load_snapshot(target_date=None, strategy_version=None):
+    meta = load_snapshot_meta(target_date, strategy_version)
+    if not meta:
+        return None
+    snapshot_dir = _get_snapshot_dir(meta["target_date"], meta.get("strategy_version"))
+    with open(os.path.join(snapshot_dir, "market_data.pkl"), "rb") as f:
+        market_data_df = pickle.load(f)
+    with open(os.path.join(snapshot_dir, "watch_lists.pkl"), "rb") as f:
+        watch_list_dfs = pickle.load(f)
+    return market_data_df, watch_list_dfs, meta
@@ -0,0 +1,68 @@
+import os
+import json
+import datetime
+import threading
+
+from config import config
+
+# Layout: <DATA_DIR>/subscribers.json: user id -> {"strategies": [...], "industries": [...], "updated_at": ...}
+# `strategies` / `industries` are None for all of them (the default), and `strategies` is [] once unsubscribed
+SUBSCRIBER_PATH = os.path.join(config.DATA_DIR, "subscribers.json")
+
+_lock = threading.Lock()
+
+
+def _read_subscribers() -> dict:
+    try:
+        with open(SUBSCRIBER_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _write_subscribers(subscribers):
+    os.makedirs(os.path.dirname(SUBSCRIBER_PATH) or ".", exist_ok=True)
+    tmp_path = f"{SUBSCRIBER_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(subscribers, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, SUBSCRIBER_PATH)
+
+
+# Load every subscriber: user id -> subscription
+def load_subscribers() -> dict:
+    with _lock:
+        return _read_subscribers()
+
+
+# Create or update the subscription of a user (only the given preferences change), and return it
+def update_subscriber(user_id, **preferences) -> dict:
+    with _lock:
+        subscribers = _read_subscribers()
+        subscription = subscribers.get(user_id, {"strategies": None, "industries": None})
+        if user_id in subscribers and not preferences:
+            return subscription
+        subscription.update(preferences)
+        subscription["updated_at"] = datetime.datetime.now().isoformat(timespec="seconds")
+        subscribers[user_id] = subscription
+        _write_subscribers(subscribers)
+        return subscription
+
+
+# Register the users who are not subscribers yet with the default subscription, and return how many were added
+def add_subscribers(user_ids) -> int:
+    with _lock:
+        subscribers = _read_subscribers()
+        updated_at = datetime.datetime.now().isoformat(timespec="seconds")
+        new_user_ids = [user_id for user_id in dict.fromkeys(user_ids) if user_id not in subscribers]
+        for user_id in new_user_ids:
+            subscribers[user_id] = {"strategies": None, "industries": None, "updated_at": updated_at}
+        if new_user_ids:
+            _write_subscribers(subscribers)
+        return len(new_user_ids)
+
+
+def remove_subscriber(user_id):
+    with _lock:
+        subscribers = _read_subscribers()
+        if subscribers.pop(user_id, None) is not None:
+            _write_subscribers(subscribers)
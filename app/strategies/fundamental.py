@@ -29,3 +29,12 @@ def yoy_check_df(df, yoy_threshold=10):
 # 6. Acc-YoY Revenue Growth Rate is greater than or equal to <acc_yoy_threshold>
 def acc_yoy_check_df(df, acc_yoy_threshold=10):
     return df["(月)累積營收年增率(%)"] >= acc_yoy_threshold
+
+
+# 7. At least one of MoM / YoY / Acc-YoY Revenue Growth Rate is greater than <threshold>
+def revenue_growth_check_df(df, threshold=0):
+    return (
+        (df["(月)營收月增率(%)"] > threshold)
+        | (df["(月)營收年增率(%)"] > threshold)
+        | (df["(月)累積營收年增率(%)"] > threshold)
+    )
@@ -0,0 +1,111 @@
+import weakref
+import numpy as np
+import pandas as pd
+
+from ..utils import get_history_values
+
+## 產業面策略
+#
+# Daily aggregates of each industry (產業別), computed for all industries in one grouped pass:
+# - 平均漲幅(%): average daily return of its stocks
+# - 站上MA20比例(%): breadth, the share of its stocks closing above their MA20
+# - 外資買賣超: net foreign flow
+# - 量能比: total volume / total 20-day mean volume
+# They are joined to the stocks as "產業<stat>" columns, so strategies can filter on the industry of a stock,
+# and are kept per date in the market data of its snapshot.
+
+INDUSTRY_STATS = ["平均漲幅(%)", "站上MA20比例(%)", "外資買賣超", "量能比"]
+INDUSTRY_COLUMN_PREFIX = "產業"
+
+# Industry stats of the panels: panel -> {stat: (date x industry) DataFrame}
+_panel_stats_cache = weakref.WeakKeyDictionary()
+
+
+def _get_column_values(df, column) -> np.ndarray:
+    if column not in df:
+        return np.full(len(df), np.nan)
+    return pd.to_numeric(df[column], errors="coerce").to_numpy(dtype=float)
+
+
+# Per-stock inputs of the industry stats, from the merged market data (one row per stock)
+def _get_stock_factors(df) -> pd.DataFrame:
+    daily_k = df["daily_k"] if "daily_k" in df else pd.Series([None] * len(df), index=df.index)
+    close = get_history_values(daily_k, value_name="收盤")
+    previous_close = get_history_values(daily_k, days_ago=1, value_name="收盤")
+    mean20 = get_history_values(df["mean20"]) if "mean20" in df else np.full(len(df), np.nan)
+    volume = get_history_values(df["volume"]) if "volume" in df else np.full(len(df), np.nan)
+    mean_20_volume = get_history_values(df["mean_20_volume"]) if "mean_20_volume" in df else np.full(len(df), np.nan)
+    return pd.DataFrame({
+        "return": (close / previous_close - 1) * 100,
+        # NaN when either value is missing, so the stock is left out of the breadth
+        "above_ma20": np.where(np.isnan(close) | np.isnan(mean20), np.nan, (close > mean20) * 100.0),
+        "foreign": _get_column_values(df, "外資買賣超"),
+        # Volume and its mean only count together
+        "volume": np.where(np.isnan(mean_20_volume), np.nan, volume),
+        "mean_20_volume": np.where(np.isnan(volume), np.nan, mean_20_volume),
+    }, index=df.index)
+
+
+# (Public) Stats of every industry (industry x stat) of the merged market data
+def get_industry_stats(df) -> pd.DataFrame:
+    factors = _get_stock_factors(df)
+    grouped = factors.groupby(df["產業別"]).agg({
+        "return": "mean",
+        "above_ma20": "mean",
+        "foreign": lambda values: values.sum(min_count=1),
+        "volume": "sum",
+        "mean_20_volume": "sum",
+    })
+    with np.errstate(divide="ignore", invalid="ignore"):
+        volume_ratio = grouped["volume"] / grouped["mean_20_volume"].replace(0, np.nan)
+    stats = pd.DataFrame({
+        "平均漲幅(%)": grouped["return"],
+        "站上MA20比例(%)": grouped["above_ma20"],
+        "外資買賣超": grouped["foreign"],
+        "量能比": volume_ratio,
+    }).round(4)
+    stats.index.name = "產業別"
+    return stats
+
+
+# (Public) Join the industry stats to the stocks of the market data, as "產業<stat>" columns
+def add_industry_stats(df, stats=None) -> pd.DataFrame:
+    stats = get_industry_stats(df) if stats is None else stats
+    stock_stats = stats.reindex(df["產業別"].values).set_axis(df.index)
+    return df.assign(**{f"{INDUSTRY_COLUMN_PREFIX}{stat}": stock_stats[stat] for stat in INDUSTRY_STATS})
+
+
+# (Public) Stats of every industry on every date of a panel: stat -> (date x industry) DataFrame, in one grouped pass over the stocks
+def get_industry_stats_panel(panel) -> dict:
+    if panel in _panel_stats_cache:
+        return _panel_stats_cache[panel]
+    close, mean20 = panel["收盤"], panel["mean20"]
+    volume, mean_20_volume = panel["volume"], panel["mean_20_volume"]
+    factors = {
+        "return": (close / close.shift(1) - 1) * 100,
+        "above_ma20": ((close > mean20) * 100.0).where(close.notna() & mean20.notna()),
+        "foreign": panel["外資買賣超"],
+        "volume": volume.where(mean_20_volume.notna()),
+        "mean_20_volume": mean_20_volume.where(volume.notna()),
+    }
+    # (stock x (factor, date)), grouped by the industry of the stocks once
+    stacked = pd.concat({name: factor.T for name, factor in factors.items()}, axis=1)
+    grouped = stacked.groupby(panel.industry.reindex(stacked.index).values)
+    sums, counts = grouped.sum(min_count=1), grouped.count()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        stats = {
+            "平均漲幅(%)": sums["return"] / counts["return"],
+            "站上MA20比例(%)": sums["above_ma20"] / counts["above_ma20"],
+            "外資買賣超": sums["foreign"],
+            "量能比": sums["volume"] / sums["mean_20_volume"].replace(0, np.nan),
+        }
+    stats = {stat: values.T for stat, values in stats.items()}
+    _panel_stats_cache[panel] = stats
+    return stats
+
+
+# 1. (Public) 股票所屬產業的統計值 (例如 站上MA20比例(%)) 大於或小於 threshold
+def industry_stat_check_df(df, stat="站上MA20比例(%)", direction="more", threshold=60):
+    column = f"{INDUSTRY_COLUMN_PREFIX}{stat}"
+    values = df[column] if column in df else add_industry_stats(df)[column]
+    return values > threshold if direction == "more" else values < threshold
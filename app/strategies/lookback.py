@@ -0,0 +1,63 @@
+import inspect
+import datetime
+import numpy as np
+
+from . import technical
+from .specs import iter_conditions
+
+## Lookback Planner
+#
+# How many trading days of history the strategies read, derived from their condition specs.
+# The histock API returns the indicators (moving averages, KD, MACD) already computed,
+# so only the `days` parameters of the checks decide how much history is needed.
+
+# Check function -> trading days of history it reads, from its (complete) parameters
+LOOKBACK_SETTING = {
+    technical.today_price_is_max_check_df: lambda params: params["days"],
+    technical.volume_greater_check_df: lambda params: params["days"],
+    technical.today_price_is_not_min_check_df: lambda params: params["days"],
+    technical.today_price_is_not_max_check_df: lambda params: params["days"],
+    technical.technical_indicator_greater_or_less_one_day_check_df: lambda params: params["days"],
+    technical.technical_indicator_difference_one_day_check_df: lambda params: params["days"],
+    technical.technical_indicator_constant_check_df: lambda params: params["days"],
+    # Today is compared with yesterday, so one more day is needed
+    technical.technical_indicator_greater_or_less_two_day_check_df: lambda params: params["days"] + 1,
+    technical.technical_indicator_difference_two_day_check_df: lambda params: params["days"] + 1,
+    technical.technical_indicator_difference_greater_two_day_check_df: lambda params: params["days"] + 1,
+    technical.golden_cross_check_df: lambda params: params["days"] + 1,
+    # Surges are searched in the whole window
+    technical.skyrocket_check_df: lambda params: params["lookback_days"],
+}
+
+
+def _get_full_params(func, params) -> dict:
+    defaults = {
+        name: parameter.default
+        for name, parameter in inspect.signature(func).parameters.items()
+        if parameter.default is not inspect.Parameter.empty
+    }
+    return {**defaults, **params}
+
+
+# Trading days of history a condition reads (0 for checks on the data date columns only, e.g. chip and fundamental)
+def get_condition_lookback(condition) -> int:
+    if "any_of" in condition:
+        return max((get_condition_lookback(sub_condition) for sub_condition in condition["any_of"]), default=0)
+    func = condition["func"]
+    if func not in LOOKBACK_SETTING:
+        return 0
+    return LOOKBACK_SETTING[func](_get_full_params(func, condition.get("params", {})))
+
+
+def get_strategy_lookback(strategy_spec) -> int:
+    return max((get_condition_lookback(condition) for _, condition in iter_conditions(strategy_spec)), default=0)
+
+
+# Trading days of history to request for the strategies, when the data date is `data_date`
+def plan_history_days(strategy_specs, data_date=None, max_days=None) -> int:
+    history_days = max((get_strategy_lookback(strategy_spec) for strategy_spec in strategy_specs), default=0)
+    # The API returns the latest days, so the trading days after a past data date are requested too
+    if data_date:
+        history_days += int(np.busday_count(data_date + datetime.timedelta(days=1), datetime.date.today() + datetime.timedelta(days=1)))
+    history_days = max(history_days, 1)
+    return min(history_days, max_days) if max_days else history_days
@@ -0,0 +1,88 @@
+import os
+import json
+import time
+import pandas as pd
+
+from config import config, logger
+from app.metrics import metrics
+from .specs import STRATEGY_CATEGORIES, evaluate_condition, iter_conditions
+
+# Layout: <DATA_DIR>/profiles/<strategy name>.json (the latest profile of each strategy)
+PROFILE_DIR = os.path.join(config.DATA_DIR, "profiles")
+
+
+# Evaluate the conditions of a strategy one by one, and record their cost and selectivity
+def profile_strategy_masks(df, strategy_spec) -> tuple:
+    """
+    Return `((fundamental_mask, technical_mask, chip_mask), profile)`.
+
+    The masks are the same as `build_strategy_masks`. `profile` has one row per condition,
+    in evaluation order, with:
+    - `seconds`: time spent evaluating the condition
+    - `passed`: rows passing the condition on its own
+    - `removed`: rows removed by the condition after all previous conditions (marginal)
+    - `unique_removed`: rows failing this condition only (the watch list would grow by this much without it)
+    """
+    masks = {category: [] for category in STRATEGY_CATEGORIES}
+    profile = []
+    failed_masks = []
+    remaining = pd.Series(True, index=df.index)
+    for category, condition in iter_conditions(strategy_spec):
+        start_time = time.perf_counter()
+        mask = evaluate_condition(df, condition)
+        seconds = time.perf_counter() - start_time
+        masks[category].append(mask)
+        passed_mask = mask.fillna(False).astype(bool)
+        profile.append({
+            "category": category,
+            "condition": condition["name"],
+            "seconds": round(seconds, 4),
+            "passed": int(passed_mask.sum()),
+            "removed": int((remaining & ~passed_mask).sum()),
+        })
+        remaining &= passed_mask
+        failed_masks.append(~passed_mask)
+    # Rows removed by a single condition only
+    failed_counts = sum(failed_mask.astype(int) for failed_mask in failed_masks)
+    for row, failed_mask in zip(profile, failed_masks):
+        row["unique_removed"] = int((failed_mask & (failed_counts == 1)).sum())
+    return tuple(masks[category] for category in STRATEGY_CATEGORIES), profile
+
+
+# Suggested evaluation order: cheap conditions that reject many rows on their own first
+def suggest_condition_order(profile, row_count) -> list:
+    def rank(row):
+        # Standalone rejection rate, so it does not depend on the current position of the condition
+        rejection_rate = 1 - row["passed"] / row_count if row_count else 0
+        return row["seconds"] / max(rejection_rate, 1e-6)
+    return [row["condition"] for row in sorted(profile, key=rank)]
+
+
+# Write the profile to the logs, the metrics and the profile store
+def report_strategy_profile(strategy_name, row_count, profile):
+    logger.info(f"[{strategy_name}] 條件效能分析 (共 {row_count} 檔)")
+    logger.info(f"{'耗時(秒)':>10} {'通過':>6} {'依序剔除':>8} {'唯一剔除':>8}  條件")
+    for row in profile:
+        logger.info(f"{row['seconds']:>10.4f} {row['passed']:>6} {row['removed']:>8} {row['unique_removed']:>8}  [{row['category']}] {row['condition']}")
+        labels = {"strategy": strategy_name, "condition": row["condition"]}
+        metrics.set("strategy_condition_seconds", row["seconds"], **labels)
+        metrics.set("strategy_condition_passed_rows", row["passed"], **labels)
+        metrics.set("strategy_condition_removed_rows", row["removed"], **labels)
+        metrics.set("strategy_condition_unique_removed_rows", row["unique_removed"], **labels)
+    suggested_order = suggest_condition_order(profile, row_count)
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    # Write a temporary file first, so `load_strategy_profile` never reads a partial profile
+    path = os.path.join(PROFILE_DIR, f"{strategy_name}.json")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"row_count": row_count, "profile": profile, "suggested_order": suggested_order}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+# Load the latest stored profile of a strategy
+def load_strategy_profile(strategy_name):
+    try:
+        with open(os.path.join(PROFILE_DIR, f"{strategy_name}.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+
+from ..utils import get_history_values
+
+## Cross-sectional Ranking
+#
+# Each stock gets a composite score from the percentile ranks (among all the stocks of the day) of a few factors,
+# so a watch list can be cut to the best K stocks instead of listing every stock which passes the filters.
+
+
+def _get_latest_values(df, column) -> np.ndarray:
+    if column not in df:
+        return np.full(len(df), np.nan)
+    # History columns: [(date, value), ...], scalar columns are used as they are
+    if df[column].map(lambda value: isinstance(value, list)).any():
+        return get_history_values(df[column])
+    return pd.to_numeric(df[column], errors="coerce").to_numpy(dtype=float)
+
+
+def _divide(values_1, values_2) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result = values_1 / values_2
+    return np.where(np.isfinite(result), result, np.nan)
+
+
+# 成交量 / 20日均量
+def volume_surge_ratio(df) -> np.ndarray:
+    return _divide(_get_latest_values(df, "volume"), _get_latest_values(df, "mean_20_volume"))
+
+
+# 收盤價 / MA20 - 1
+def ma20_distance(df) -> np.ndarray:
+    return _divide(_get_latest_values(df, "收盤"), _get_latest_values(df, "mean20")) - 1
+
+
+# 外資買賣超 / 成交量
+def foreign_buy_ratio(df) -> np.ndarray:
+    return _divide(_get_latest_values(df, "外資買賣超"), _get_latest_values(df, "成交量"))
+
+
+# (月)營收年增率(%)
+def revenue_yoy(df) -> np.ndarray:
+    return _get_latest_values(df, "(月)營收年增率(%)")
+
+
+# Score factors: name -> raw value function, weight, and whether a higher value ranks higher
+# (stocks far above MA20 already ran up, so the closer ones rank higher)
+SCORE_SETTING = {
+    "量能": {"func": volume_surge_ratio, "weight": 1, "higher_is_better": True},
+    "乖離": {"func": ma20_distance, "weight": 1, "higher_is_better": False},
+    "外資": {"func": foreign_buy_ratio, "weight": 1, "higher_is_better": True},
+    "營收": {"func": revenue_yoy, "weight": 1, "higher_is_better": True},
+}
+
+
+def _percentile_ranks(values, higher_is_better) -> np.ndarray:
+    # Average ranks of ties, scaled to (0, 1], missing values stay NaN
+    ranks = pd.Series(values).rank(method="average", pct=True, ascending=higher_is_better)
+    return ranks.to_numpy(dtype=float)
+
+
+# (Public) Composite score (weighted mean of the factor percentile ranks) of every stock of the market data
+def score_stocks(df, score_setting=SCORE_SETTING) -> pd.Series:
+    weights = np.array([setting["weight"] for setting in score_setting.values()], dtype=float)
+    ranks = np.column_stack([
+        _percentile_ranks(setting["func"](df), setting["higher_is_better"])
+        for setting in score_setting.values()
+    ]) if score_setting else np.empty((len(df), 0))
+    # Missing factors (e.g. no revenue data) are left out of the mean instead of counting as the worst rank
+    available = ~np.isnan(ranks)
+    total_weights = (available * weights).sum(axis=1)
+    with np.errstate(invalid="ignore"):
+        scores = np.where(available, ranks, 0) @ weights / total_weights
+    return pd.Series(scores, index=df.index, name="分數")
+
+
+# (Public) Positions of the top K scores in descending order, with a partial selection instead of sorting every score
+def select_top_k(scores, k) -> np.ndarray:
+    scores = np.nan_to_num(np.asarray(scores, dtype=float), nan=-np.inf)
+    if k <= 0:
+        return np.array([], dtype=int)
+    if k >= len(scores):
+        return np.argsort(-scores, kind="stable")
+    top_positions = np.argpartition(-scores, k - 1)[:k]
+    return top_positions[np.argsort(-scores[top_positions], kind="stable")]
@@ -0,0 +1,208 @@
+import json
+import inspect
+import hashlib
+import pandas as pd
+
+from functools import reduce
+from . import technical, chip, fundamental
+
+## Strategy Specs
+#
+# Each strategy is a dict of condition lists ("fundamental", "technical", "chip").
+# A condition is either:
+#   - {"name": ..., "func": <*_check_df function>, "params": {...}, "negate": bool (optional)}
+#   - {"name": ..., "any_of": [<condition>, ...], "negate": bool (optional)}
+# The same spec is evaluated on the daily market data (one row per stock) and,
+# through the vectorized kernels in `app.backtest`, on a historical panel.
+
+STRATEGY_CATEGORIES = ["fundamental", "technical", "chip"]
+
+
+STRATEGY_1 = {
+    "name": "策略1",
+    "fundamental": [
+        {"name": "營收成長至少其中一項 > 0%", "func": fundamental.revenue_growth_check_df, "params": {"threshold": 0}},
+    ],
+    "technical": [
+        {"name": "收盤價 > 20", "func": technical.technical_indicator_constant_check_df, "params": {"indicator": "收盤", "direction": "more", "threshold": 20, "days": 1}},
+        {"name": "MA1 > MA5", "func": technical.technical_indicator_greater_or_less_one_day_check_df, "params": {"indicator_1": "收盤", "indicator_2": "mean5", "direction": "more", "threshold": 1, "days": 1}},
+        {"name": "MA5 > MA20", "func": technical.technical_indicator_greater_or_less_one_day_check_df, "params": {"indicator_1": "mean5", "indicator_2": "mean20", "direction": "more", "threshold": 1, "days": 1}},
+        {"name": "MA20 > MA60", "func": technical.technical_indicator_greater_or_less_one_day_check_df, "params": {"indicator_1": "mean20", "indicator_2": "mean60", "direction": "more", "threshold": 1, "days": 1}},
+        # 今天收紅 K & 實體 K 棒漲幅大於 1%
+        {"name": "收盤價 > 1.01 * 開盤價", "func": technical.technical_indicator_greater_or_less_one_day_check_df, "params": {"indicator_1": "收盤", "indicator_2": "開盤", "direction": "more", "threshold": 1.01, "days": 1}},
+        # {"name": "K 棒底底高", "any_of": [
+        #     {"name": "今天開盤 > 昨天開盤", "func": technical.technical_indicator_greater_or_less_two_day_check_df, "params": {"indicator_1": "開盤", "indicator_2": "開盤", "direction": "more", "threshold": 1, "days": 1}},
+        #     {"name": "今天開盤 > 昨天收盤", "func": technical.technical_indicator_greater_or_less_two_day_check_df, "params": {"indicator_1": "開盤", "indicator_2": "收盤", "direction": "more", "threshold": 1, "days": 1}},
+        # ]},
+        # {"name": "今天開盤價 > 昨天收盤價", "func": technical.technical_indicator_greater_or_less_two_day_check_df, "params": {"indicator_1": "開盤", "indicator_2": "收盤", "direction": "more", "threshold": 1, "days": 1}},
+        {"name": "今天收盤 > 昨天最高", "func": technical.technical_indicator_greater_or_less_two_day_check_df, "params": {"indicator_1": "收盤", "indicator_2": "最高", "direction": "more", "threshold": 1, "days": 1}},
+        {"name": "今天 K9 > 昨天 K9", "func": technical.technical_indicator_greater_or_less_two_day_check_df, "params": {"indicator_1": "k9", "indicator_2": "k9", "direction": "more", "threshold": 1, "days": 1}},
+        {"name": "今天 D9 < 90", "func": technical.technical_indicator_constant_check_df, "params": {"indicator": "d9", "direction": "less", "threshold": 90, "days": 1}},
+        # {"name": "今天 OSC > 昨天 OSC", "func": technical.technical_indicator_greater_or_less_two_day_check_df, "params": {"indicator_1": "osc", "indicator_2": "osc", "direction": "more", "threshold": 1, "days": 1}},
+        {"name": "|D9 - K9| < 22", "func": technical.technical_indicator_difference_one_day_check_df, "params": {"indicator_1": "k9", "indicator_2": "d9", "difference_threshold": 22, "days": 1}},
+        # {"name": "K9 > 49", "func": technical.technical_indicator_constant_check_df, "params": {"indicator": "k9", "direction": "more", "threshold": 49, "days": 1}},
+        # {"name": "K9 < 87", "func": technical.technical_indicator_constant_check_df, "params": {"indicator": "k9", "direction": "less", "threshold": 87, "days": 1}},
+        {"name": "J9 < 100", "func": technical.technical_indicator_constant_check_df, "params": {"indicator": "j9", "direction": "less", "threshold": 100, "days": 1}},
+        # {"name": "(今天 k9-d9) >= (昨天 k9-d9)", "func": technical.technical_indicator_difference_greater_two_day_check_df, "params": {"indicator_1": "k9", "indicator_2": "d9", "days": 1}},
+        # {"name": "MA5 趨勢向上", "func": technical.technical_indicator_greater_or_less_two_day_check_df, "params": {"indicator_1": "mean5", "indicator_2": "mean5", "direction": "more", "threshold": 1, "days": 1}},
+        # 漲幅 2% 以上
+        {"name": "今天收盤 > 1.02 * 昨天收盤", "func": technical.technical_indicator_greater_or_less_two_day_check_df, "params": {"indicator_1": "收盤", "indicator_2": "收盤", "direction": "more", "threshold": 1.02, "days": 1}},
+        {"name": "不能連續兩天漲幅都超過 5%", "func": technical.technical_indicator_greater_or_less_two_day_check_df, "params": {"indicator_1": "收盤", "indicator_2": "收盤", "direction": "more", "threshold": 1.05, "days": 2}, "negate": True},
+        # {"name": "均線乖離不能過大", "any_of": [
+        #     {"name": "今天收盤 < 1.1 * Mean5", "func": technical.technical_indicator_greater_or_less_one_day_check_df, "params": {"indicator_1": "收盤", "indicator_2": "mean5", "direction": "less", "threshold": 1.1, "days": 1}},
+        #     {"name": "今天收盤 < 1.1 * Mean10", "func": technical.technical_indicator_greater_or_less_one_day_check_df, "params": {"indicator_1": "收盤", "indicator_2": "mean10", "direction": "less", "threshold": 1.1, "days": 1}},
+        #     {"name": "今天收盤 < 1.1 * Mean20", "func": technical.technical_indicator_greater_or_less_one_day_check_df, "params": {"indicator_1": "收盤", "indicator_2": "mean20", "direction": "less", "threshold": 1.1, "days": 1}},
+        # ]},
+        # # 只抓得到四個月的資料
+        # {"name": "今天最高價不是四個月內最高", "func": technical.today_price_is_not_max_check_df, "params": {"price_type": "最高", "days": 80}},
+        {"name": "上影線長度不能超過昨天收盤價的 3%", "func": technical.technical_indicator_difference_two_day_check_df, "params": {"indicator_1": "最高", "indicator_2": "收盤", "direction": "less", "threshold": 0.03, "indicator_3": "收盤", "days": 1}},
+        {"name": "滿足飆股條件", "func": technical.skyrocket_check_df, "params": {"n_days": 10, "k_change": 0.20, "consecutive_red_no_upper_shadow_days": 2}},
+        # # 出現強勁漲幅的機會較高
+        # {"name": "OSC > 0", "func": technical.technical_indicator_constant_check_df, "params": {"indicator": "osc", "direction": "more", "threshold": 0, "days": 1}},
+        # {"name": "DIF > 0", "func": technical.technical_indicator_constant_check_df, "params": {"indicator": "dif", "direction": "more", "threshold": 0, "days": 1}},
+        # {"name": "[(DIF / 收盤價) < 0.03] 或 [DIF 不是四個月內的最高]", "any_of": [
+        #     {"name": "(DIF / 收盤價) < 0.03", "func": technical.technical_indicator_greater_or_less_one_day_check_df, "params": {"indicator_1": "dif", "indicator_2": "收盤", "direction": "less", "threshold": 0.03, "days": 1}},
+        #     {"name": "DIF 不是四個月內的最高", "func": technical.today_price_is_not_max_check_df, "params": {"price_type": "dif", "days": 80}},
+        # ]},
+    ],
+    "chip": [
+        {"name": "成交量 > 2000 張", "func": technical.volume_greater_check_df, "params": {"shares_threshold": 2000, "days": 1}},
+        {"name": "今天成交量 > 昨天成交量", "func": technical.technical_indicator_greater_or_less_two_day_check_df, "params": {"indicator_1": "volume", "indicator_2": "volume", "direction": "more", "threshold": 1, "days": 1}},
+        {"name": "今天成交量 > 5日均量", "func": technical.technical_indicator_greater_or_less_one_day_check_df, "params": {"indicator_1": "volume", "indicator_2": "mean_5_volume", "direction": "more", "threshold": 1, "days": 1}},
+        # {"name": "5日均量 > 20日均量", "func": technical.technical_indicator_greater_or_less_one_day_check_df, "params": {"indicator_1": "mean_5_volume", "indicator_2": "mean_20_volume", "direction": "more", "threshold": 1, "days": 1}},
+        {"name": "5日均量 > 1000 張", "func": technical.technical_indicator_constant_check_df, "params": {"indicator": "mean_5_volume", "direction": "more", "threshold": 1000, "days": 1}},
+        {"name": "20日均量 > 1000 張", "func": technical.technical_indicator_constant_check_df, "params": {"indicator": "mean_20_volume", "direction": "more", "threshold": 1000, "days": 1}},
+        {"name": "今天的5日均量 > 昨天的5日均量", "func": technical.technical_indicator_greater_or_less_two_day_check_df, "params": {"indicator_1": "mean_5_volume", "indicator_2": "mean_5_volume", "direction": "more", "threshold": 1, "days": 1}},
+        # {"name": "單一法人至少買超成交量的 10%", "func": chip.single_institutional_buy_check_df, "params": {"single_volume_threshold": 10}},
+        # {"name": "法人合計至少買超成交量的 1%", "func": chip.total_institutional_buy_check_df, "params": {"total_volume_threshold": 1}},
+        {"name": "外資買超 >= 0 張", "func": chip.foreign_buy_positive_check_df, "params": {"threshold": 0}},
+        # {"name": "投信買超 >= 50 張", "func": chip.investment_buy_positive_check_df, "params": {"threshold": 50}},
+        # {"name": "自定義法人買超篩選", "func": chip.buy_positive_check_df, "params": {}},
+        # {"name": "法人合計買超 >= 0 張", "func": chip.total_institutional_buy_positive_check_df, "params": {"threshold": 0}},
+    ],
+}
+
+
+STRATEGY_2 = {
+    "name": "策略2",
+    "fundamental": [
+        {"name": "營收成長至少其中一項 > 0%", "func": fundamental.revenue_growth_check_df, "params": {"threshold": 0}},
+    ],
+    "technical": [
+        {"name": "收盤價 > 20", "func": technical.technical_indicator_constant_check_df, "params": {"indicator": "收盤", "direction": "more", "threshold": 20, "days": 1}},
+        {"name": "MA1 > MA5", "func": technical.technical_indicator_greater_or_less_one_day_check_df, "params": {"indicator_1": "收盤", "indicator_2": "mean5", "direction": "more", "threshold": 1, "days": 1}},
+        {"name": "MA1 > MA20", "func": technical.technical_indicator_greater_or_less_one_day_check_df, "params": {"indicator_1": "收盤", "indicator_2": "mean20", "direction": "more", "threshold": 1, "days": 1}},
+        {"name": "今天 MA60 > 昨天 MA60", "func": technical.technical_indicator_greater_or_less_two_day_check_df, "params": {"indicator_1": "mean60", "indicator_2": "mean60", "direction": "more", "threshold": 1, "days": 1}},
+        {"name": "K9 > D9", "func": technical.technical_indicator_greater_or_less_one_day_check_df, "params": {"indicator_1": "k9", "indicator_2": "d9", "direction": "more", "threshold": 1, "days": 1}},
+        {"name": "今天 J9 > 昨天 J9", "func": technical.technical_indicator_greater_or_less_two_day_check_df, "params": {"indicator_1": "j9", "indicator_2": "j9", "direction": "more", "threshold": 1, "days": 1}},
+        {"name": "今天 OSC > 昨天 OSC", "func": technical.technical_indicator_greater_or_less_two_day_check_df, "params": {"indicator_1": "osc", "indicator_2": "osc", "direction": "more", "threshold": 1, "days": 1}},
+        {"name": "今天 J9 < 100", "func": technical.technical_indicator_constant_check_df, "params": {"indicator": "j9", "direction": "less", "threshold": 100, "days": 1}},
+    ],
+    "chip": [
+        {"name": "成交量 > 1500 張", "func": technical.volume_greater_check_df, "params": {"shares_threshold": 1500, "days": 1}},
+        {"name": "今天成交量 > 昨天成交量", "func": technical.technical_indicator_greater_or_less_two_day_check_df, "params": {"indicator_1": "volume", "indicator_2": "volume", "direction": "more", "threshold": 1, "days": 1}},
+        {"name": "今天成交量 > 5日均量", "func": technical.technical_indicator_greater_or_less_one_day_check_df, "params": {"indicator_1": "volume", "indicator_2": "mean_5_volume", "direction": "more", "threshold": 1, "days": 1}},
+    ],
+}
+
+
+STRATEGY_3 = {
+    "name": "策略3",
+    "fundamental": [],
+    "technical": [
+        {"name": "收盤價 > 20", "func": technical.technical_indicator_constant_check_df, "params": {"indicator": "收盤", "direction": "more", "threshold": 20, "days": 1}},
+        # 漲幅 1% 以上
+        {"name": "今天收盤 > 1.01 * 昨天收盤", "func": technical.technical_indicator_greater_or_less_two_day_check_df, "params": {"indicator_1": "收盤", "indicator_2": "收盤", "direction": "more", "threshold": 1.01, "days": 1}},
+        {"name": "今天收紅 K", "func": technical.technical_indicator_greater_or_less_one_day_check_df, "params": {"indicator_1": "收盤", "indicator_2": "開盤", "direction": "more", "threshold": 1, "days": 1}},
+        {"name": "MA1 > MA60", "func": technical.technical_indicator_greater_or_less_one_day_check_df, "params": {"indicator_1": "收盤", "indicator_2": "mean60", "direction": "more", "threshold": 1, "days": 1}},
+        {"name": "今天 MA20 > 昨天 MA20", "func": technical.technical_indicator_greater_or_less_two_day_check_df, "params": {"indicator_1": "mean20", "indicator_2": "mean20", "direction": "more", "threshold": 1, "days": 1}},
+        {"name": "今天 MA60 > 昨天 MA60", "func": technical.technical_indicator_greater_or_less_two_day_check_df, "params": {"indicator_1": "mean60", "indicator_2": "mean60", "direction": "more", "threshold": 1, "days": 1}},
+        {"name": "五天內最低價曾經跌到 MA20 以下", "func": technical.technical_indicator_greater_or_less_one_day_check_df, "params": {"indicator_1": "最低", "indicator_2": "mean20", "direction": "more", "threshold": 1, "days": 5}, "negate": True},
+        {"name": "昨天下跌", "func": technical.technical_indicator_greater_or_less_two_day_check_df, "params": {"indicator_1": "收盤", "indicator_2": "收盤", "direction": "more", "threshold": 1, "days": 2}, "negate": True},
+        {"name": "今天 K9 > 昨天 K9", "func": technical.technical_indicator_greater_or_less_two_day_check_df, "params": {"indicator_1": "k9", "indicator_2": "k9", "direction": "more", "threshold": 1, "days": 1}},
+        {"name": "今天 K9 > 20", "func": technical.technical_indicator_constant_check_df, "params": {"indicator": "k9", "direction": "more", "threshold": 20, "days": 1}},
+        {"name": "滿足飆股條件", "func": technical.skyrocket_check_df, "params": {"n_days": 10, "k_change": 0.20, "consecutive_red_no_upper_shadow_days": 0}},
+    ],
+    "chip": [
+        {"name": "成交量 > 200 張", "func": technical.volume_greater_check_df, "params": {"shares_threshold": 200, "days": 1}},
+        {"name": "今天成交量 < 昨天成交量", "func": technical.technical_indicator_greater_or_less_two_day_check_df, "params": {"indicator_1": "volume", "indicator_2": "volume", "direction": "less", "threshold": 1, "days": 1}},
+        {"name": "外資買超 >= 0 張", "func": chip.foreign_buy_positive_check_df, "params": {"threshold": 0}},
+    ],
+}
+
+
+# All the strategies (the ones not evaluated by `views.update_snapshot` are kept up to date too)
+STRATEGIES = [STRATEGY_1, STRATEGY_2, STRATEGY_3]
+
+
+# Column holding the precomputed (not negated) result of a condition
+def get_verdict_column(condition) -> str:
+    params = ", ".join(f"{key}={value}" for key, value in sorted(condition.get("params", {}).items()))
+    return f"verdict:{condition['func'].__name__}({params})"
+
+
+# Evaluate a single condition, `func_map` can replace the row-wise check functions (e.g. with vectorized panel kernels)
+def evaluate_condition(df, condition, func_map=None):
+    if "any_of" in condition:
+        masks = [evaluate_condition(df, sub_condition, func_map) for sub_condition in condition["any_of"]]
+        mask = reduce(lambda x, y: (x | y), masks)
+    elif isinstance(df, pd.DataFrame) and get_verdict_column(condition) in df.columns:
+        # Precomputed while crawling the histories (see `app.strategies.streaming`)
+        mask = df[get_verdict_column(condition)].fillna(False).astype(bool)
+    else:
+        func = condition["func"]
+        if func_map:
+            func = func_map.get(func, func)
+        mask = func(df, **condition.get("params", {}))
+    return ~mask if condition.get("negate") else mask
+
+
+# Iterate over (category, condition) of a strategy
+def iter_conditions(strategy_spec):
+    for category in STRATEGY_CATEGORIES:
+        for condition in strategy_spec.get(category, []):
+            yield category, condition
+
+
+# Build the (fundamental_mask, technical_mask, chip_mask) lists of a strategy
+def build_strategy_masks(df, strategy_spec, func_map=None) -> tuple:
+    return tuple(
+        [evaluate_condition(df, condition, func_map) for condition in strategy_spec.get(category, [])]
+        for category in STRATEGY_CATEGORIES
+    )
+
+
+# Name and source hash of a function (its whole module, so the helpers it calls count too)
+def _describe_function(func) -> dict:
+    func = getattr(func, "func", func)
+    try:
+        source = inspect.getsource(inspect.getmodule(func) or func)
+    except (OSError, TypeError):
+        source = ""
+    return {
+        "func": f"{func.__module__}.{func.__qualname__}",
+        "source": hashlib.sha256(source.encode("utf-8")).hexdigest(),
+    }
+
+
+def _describe_condition(condition) -> dict:
+    description = {"negate": bool(condition.get("negate"))}
+    if "any_of" in condition:
+        description["any_of"] = [_describe_condition(sub_condition) for sub_condition in condition["any_of"]]
+        return description
+    # A change in the check function (or a helper of its module) changes the results too
+    description.update(_describe_function(condition["func"]))
+    description["params"] = {name: repr(value) for name, value in sorted(condition.get("params", {}).items())}
+    return description
+
+
+# Short hash of the strategies: their conditions, parameters and check function sources (condition names are ignored),
+# and the `settings` which change the results after the conditions (functions in them are described by their source)
+def get_strategy_version(strategy_specs, settings=None) -> str:
+    description = [
+        [(category, _describe_condition(condition)) for category, condition in iter_conditions(strategy_spec)]
+        for strategy_spec in strategy_specs
+    ]
+    if settings is not None:
+        description = {"strategies": description, "settings": settings}
+    return hashlib.sha256(json.dumps(description, sort_keys=True, default=_describe_function).encode("utf-8")).hexdigest()[:12]
@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+
+from ..backtest.kernels import PANEL_KERNELS
+from ..backtest.panel import PRICE_FIELDS, Panel, build_panel_from_histories
+from ..utils import convert_history_to_list
+from . import technical
+from .specs import evaluate_condition, get_verdict_column, iter_conditions
+
+# Days of history kept in the list columns of the market data once a chunk is reduced
+DEFAULT_TAIL_DAYS = 10
+
+
+def _iter_leaf_conditions(condition):
+    if "any_of" in condition:
+        for sub_condition in condition["any_of"]:
+            yield from _iter_leaf_conditions(sub_condition)
+    else:
+        yield condition
+
+
+# Conditions which only read the technical indicator histories, so they can be evaluated one chunk of stocks at a time
+def get_history_conditions(strategy_specs) -> dict:
+    conditions = {}
+    for strategy_spec in strategy_specs:
+        for _, condition in iter_conditions(strategy_spec):
+            for leaf_condition in _iter_leaf_conditions(condition):
+                func = leaf_condition["func"]
+                if func.__module__ == technical.__name__ and func in PANEL_KERNELS:
+                    # Verdicts are stored before negation, `evaluate_condition` negates them
+                    conditions[get_verdict_column(leaf_condition)] = {**leaf_condition, "negate": False}
+    return conditions
+
+
+class TechnicalChunkReducer:
+    """
+    `chunk_callback` of `get_technical_indicators`, which reduces the decoded histories of every crawled chunk of stocks to:
+    - one verdict column per history condition of the strategies (evaluated with the panel kernels on the last bar of each stock,
+      like the row-wise checks, so a stock without a bar on the data date is judged on its previous one)
+    - compact float32 (date x stock) frames of the history rows missing from the history store (`get_panel`)
+    - the last `tail_days` entries of the history list columns
+
+    So the full histories only exist as arrays, and for one chunk at a time.
+    """
+
+    def __init__(self, strategy_specs, data_date, tail_days=DEFAULT_TAIL_DAYS):
+        self.conditions = get_history_conditions(strategy_specs)
+        self.data_date = data_date
+        self.tail_days = tail_days
+        # field -> compact frames of the reduced chunks
+        self._history_frames = {}
+        # history column -> stock -> last date already in the history store
+        self._stored_until = {}
+
+    # Only keep the history rows after the ones loaded from the history store (`stored_histories` of `get_technical_indicators`)
+    def set_stored_histories(self, stored_histories):
+        self._stored_until = {}
+        for stock_id, stock_histories in (stored_histories or {}).items():
+            for column, (dates, _) in (stock_histories or {}).items():
+                if len(dates):
+                    self._stored_until.setdefault(column, {})[stock_id] = np.datetime64(dates[-1], "ns")
+
+    def __call__(self, chunk_df, histories) -> pd.DataFrame:
+        panel = build_panel_from_histories(histories)
+        for field, field_df in panel.fields.items():
+            field_df = self._drop_stored_rows(field, field_df)
+            if not field_df.empty:
+                self._history_frames.setdefault(field, []).append(field_df.astype(np.float32))
+        last_rows = self._get_last_rows(panel) if len(panel.dates) else None
+        for verdict_column, condition in self.conditions.items():
+            if len(panel.dates):
+                verdict_df = evaluate_condition(panel, condition, func_map=PANEL_KERNELS).reindex(index=panel.dates, columns=panel.stock_ids)
+                verdict_df = verdict_df.fillna(False)
+                verdicts = pd.Series(verdict_df.to_numpy(dtype=bool)[last_rows, np.arange(len(last_rows))], index=verdict_df.columns)
+                chunk_df[verdict_column] = chunk_df["代號"].map(verdicts).fillna(False).astype(bool)
+            else:
+                chunk_df[verdict_column] = False
+        # Short history lists for the row-wise checks and the logs
+        tails = {column: [] for column in self._get_history_columns(histories)}
+        for stock_id in chunk_df["代號"]:
+            stock_histories = histories.get(stock_id) or {}
+            for column, tail in tails.items():
+                if column not in stock_histories:
+                    tail.append(pd.NA)
+                    continue
+                dates, values = stock_histories[column]
+                value_names = PRICE_FIELDS if column == "daily_k" else None
+                tail.append(convert_history_to_list(dates[-self.tail_days:], values[-self.tail_days:], value_names))
+        for column, tail in tails.items():
+            chunk_df[column] = pd.Series(tail, index=chunk_df.index, dtype=object)
+        return chunk_df
+
+    # Row of the last bar of every stock of the panel (the last row with any value if there is no price)
+    @staticmethod
+    def _get_last_rows(panel) -> np.ndarray:
+        if "收盤" in panel:
+            valid = panel["收盤"].notna().to_numpy()
+        else:
+            valid = np.logical_or.reduce([field_df.notna().to_numpy() for field_df in panel.fields.values()], initial=False)
+            valid = np.broadcast_to(valid, panel.shape)
+        return len(panel.dates) - 1 - np.argmax(valid[::-1], axis=0)
+
+    @staticmethod
+    def _get_history_columns(histories) -> list:
+        return list(dict.fromkeys(column for stock_histories in histories.values() if stock_histories for column in stock_histories))
+
+    def _drop_stored_rows(self, field, field_df) -> pd.DataFrame:
+        stored_until = self._stored_until.get("daily_k" if field in PRICE_FIELDS else field)
+        if not stored_until:
+            return field_df
+        last_dates = np.array([stored_until.get(stock_id, np.datetime64("NaT", "ns")) for stock_id in field_df.columns], dtype="datetime64[ns]")
+        # NaT compares False, so the stocks which are not stored keep every row
+        stored = field_df.index.values[:, None] <= last_dates[None, :]
+        field_df = field_df.mask(stored)
+        return field_df.loc[field_df.notna().any(axis=1), field_df.notna().any(axis=0)]
+
+    # Panel of the history rows of every reduced chunk which are missing from the history store, the frames are released afterwards
+    def get_panel(self) -> Panel:
+        history_frames, self._history_frames = self._history_frames, {}
+        return Panel({field: pd.concat(frames, axis=1) for field, frames in history_frames.items()})
@@ -1,13 +1,15 @@
-import time
 import datetime
 import twstock
-import pandas as pd
 
 from config import logger
-from ta.trend import PSARIndicator
+from app.crawlers.governor import get_governor
+from app.indicators import get_psar
 
 ## 技術面策略
 
+# Number of trading days returned by the histock API, i.e. how far the checks look back by default
+DEFAULT_LOOKBACK_DAYS = 80
+
 ##### 價量指標 #####
 
 
@@ -422,19 +424,21 @@ def _technical_indicator_constant_check_row(row, indicator, direction, threshold
 
 
 # 12. (Public) [twstock] 檢查該股票是否具備飆股特徵 (自定義長短線特徵)
-def skyrocket_check_df(df, n_days=10, k_change=0.20, consecutive_red_no_upper_shadow_days=2):
+def skyrocket_check_df(df, n_days=10, k_change=0.20, consecutive_red_no_upper_shadow_days=2, lookback_days=DEFAULT_LOOKBACK_DAYS):
     return df.apply(
         _skyrocket_check_row,
         n_days=n_days,
         k_change=k_change,
         consecutive_red_no_upper_shadow_days=consecutive_red_no_upper_shadow_days,
+        lookback_days=lookback_days,
         axis=1,
     )
     
     
-def _skyrocket_check_row(row, n_days, k_change, consecutive_red_no_upper_shadow_days):
+def _skyrocket_check_row(row, n_days, k_change, consecutive_red_no_upper_shadow_days, lookback_days):
     try:
-        daily_k = row["daily_k"]
+        # Only the surges in the last `lookback_days` count, however long the history is
+        daily_k = row["daily_k"][-lookback_days:]
         long_term_flag = _check_long_term_surge(daily_k, n_days, k_change)
         short_term_flag = _check_short_term_surge(daily_k, consecutive_red_no_upper_shadow_days)
         return long_term_flag and short_term_flag
@@ -467,17 +471,21 @@ def _check_short_term_surge(daily_k, consecutive_red_no_upper_shadow_days):
 # 13. (Public) [twstock] 檢查該股票 SAR 是否大於收盤價
 def is_sar_above_close(stock_id):
     try:
-        time.sleep(5)
+        now = datetime.datetime.now()
+        six_months_ago = now - datetime.timedelta(days=180)
+        # twstock requests one month at a time (the constructor also fetches the last month)
+        months = (now.year - six_months_ago.year) * 12 + now.month - six_months_ago.month + 1
+        market = twstock.codes[stock_id].market if stock_id in twstock.codes else "上市"
+        get_governor("www.twse.com.tw" if market == "上市" else "www.tpex.org.tw").acquire(tokens=months + 2)
         stock = twstock.Stock(stock_id)
-        six_months_ago = datetime.datetime.now() - datetime.timedelta(days=180)
         historical_data = stock.fetch_from(six_months_ago.year, six_months_ago.month)
-        data = pd.DataFrame({
-            "high": [record.high for record in historical_data],
-            "low": [record.low for record in historical_data],
-            "close": [record.close for record in historical_data],
-        })
-        sar = PSARIndicator(high=data["high"], low=data["low"], close=data["close"], step=0.02, max_step=0.2)
-        sar_list = sar.psar().to_list()
+        sar_list = get_psar(
+            high=[record.high for record in historical_data],
+            low=[record.low for record in historical_data],
+            close=[record.close for record in historical_data],
+            step=0.02,
+            max_step=0.2,
+        ).tolist()
         logger.info(f"{stock_id}: [close_price = {historical_data[-1].close} / SAR_indicator = {round(sar_list[-1], 2)} / data_length = {len(historical_data)}]")
         return sar_list[-1] > historical_data[-1].close
     except:
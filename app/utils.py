@@ -1,11 +1,42 @@
 import datetime
+import numpy as np
 from functools import reduce
 
+# The data sources report dates in Taiwan time (UTC+8, no daylight saving time)
+TAIWAN_UTC_OFFSET_MS = 8 * 60 * 60 * 1000
+
 # Convert timestamp in milliseconds to date
 def convert_milliseconds_to_date(timestamp_ms: int):
     return datetime.datetime.fromtimestamp(timestamp_ms / 1000).date()
 
 
+# Convert an array of timestamps in milliseconds to datetime64[D] dates (in Taiwan time)
+def convert_milliseconds_to_dates(timestamps_ms) -> np.ndarray:
+    timestamps_ms = np.asarray(timestamps_ms, dtype=np.int64) + TAIWAN_UTC_OFFSET_MS
+    return timestamps_ms.astype("datetime64[ms]").astype("datetime64[D]")
+
+
+# Convert (dates, values) arrays to a [[date, value], ...] history list, or [[date, {name: value}], ...] if `value_names` is given
+def convert_history_to_list(dates, values, value_names=None) -> list:
+    dates = dates.astype("datetime64[D]").tolist()
+    values = values.tolist()
+    if value_names:
+        return [[date, dict(zip(value_names, value))] for date, value in zip(dates, values)]
+    return [[date, value] for date, value in zip(dates, values)]
+
+
+# Values of a history list column `days_ago` entries before its last one (NaN if missing), `value_name` picks a value of the "daily_k" dicts
+def get_history_values(histories, days_ago=0, value_name=None) -> np.ndarray:
+    values = []
+    for history in histories:
+        try:
+            value = history[-1 - days_ago][1]
+            values.append(float(value[value_name] if value_name else value))
+        except (TypeError, IndexError, KeyError, ValueError):
+            values.append(np.nan)
+    return np.array(values, dtype=float)
+
+
 # Filter dataframe with multiple conditions in mask_list
 def df_mask_helper(df, mask_list):
     return df[reduce(lambda x, y: (x & y), mask_list)]
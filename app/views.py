@@ -4,65 +4,237 @@ import pandas as pd
 from config import logger
 from flask import current_app
 from functools import partial
-from linebot.models import TextSendMessage
-from .strategies import technical, chip
+from .strategies.specs import STRATEGY_1, STRATEGY_3, STRATEGIES, build_strategy_masks, get_strategy_version
+from .strategies.lookback import plan_history_days
+from .strategies.profiler import profile_strategy_masks, report_strategy_profile
+from .strategies.ranking import SCORE_SETTING, score_stocks, select_top_k
+from .strategies.industry import add_industry_stats
+from .strategies.streaming import TechnicalChunkReducer
+from .alerts import alert_engine, get_market_data_updates, notify_alerts
+from .bot import build_stock_index
+from .delivery import broadcast_message, deliver_to_subscribers, get_follower_ids
+from .jobs import UpdateJob
+from .messages import render_watch_list_message
+from .pipeline import Pipeline, PipelineStopped, Stage
+from .metrics import metrics
+from .store import (
+    save_snapshot, mark_latest_snapshot, load_snapshot, load_snapshot_meta, load_stock_index,
+    update_history, load_history_panel, load_subscribers, add_subscribers,
+)
+from .backtest.panel import PRICE_FIELDS, HISTORY_FIELDS, build_panel_from_market_data, split_panel_to_histories
 from .utils import is_weekday, df_mask_helper
 from .crawlers import get_twse_data, get_tpex_data, get_other_data, get_economic_events
 
+# The strategies of the recommendation message
+# STRATEGY_2 also needs other_funcs=[technical.is_sar_above_close, partial(technical.is_skyrocket, consecutive_red_no_upper_shadow_days=0)]
+WATCH_LIST_STRATEGIES = [STRATEGY_1, STRATEGY_3]
+
+# Version of the steps of `_update_watch_list` after the conditions (industry exclusion, ranking, top K cut),
+# part of the strategy version: bump it when they change, so the archived results of the old steps are not served
+WATCH_LIST_VERSION = 2
+
 
 # Update and broadcast the recommendation list
-def update_and_broadcast(app, target_date=None, need_broadcast=False):
+def update_and_broadcast(app, target_date=None, need_broadcast=False, job=None):
     with app.app_context():
         if not target_date:
             target_date = datetime.date.today()
-        logger.info(f"資料日期 {str(target_date)}")
-        if not is_weekday(target_date):
-            logger.info("假日不進行更新與推播")
-        else:
-            market_data_df = _update_market_data(target_date)
-            if market_data_df.shape[0] == 0:
-                logger.info("休市不進行更新與推播")
-            else:
-                logger.info("開始更新推薦清單")
-                watch_list_df_1 = _update_watch_list(market_data_df, _get_strategy_1)
-                # watch_list_df_2 = _update_watch_list(market_data_df, _get_strategy_2, other_funcs=[technical.is_sar_above_close, partial(technical.is_skyrocket, consecutive_red_no_upper_shadow_days=0)])
-                watch_list_df_3 = _update_watch_list(market_data_df, _get_strategy_3)
-                # combined_watch_list_df = pd.concat([watch_list_df_1, watch_list_df_2]).drop_duplicates(subset=["代號"]).reset_index(drop=True)
-                watch_list_dfs = [watch_list_df_1, watch_list_df_3]
-                logger.info("推薦清單更新完成")
-                logger.info("開始讀取經濟事件")
-                start_date = (target_date + datetime.timedelta(days=1)).strftime("%Y-%m-%d")
-                end_date = (target_date + datetime.timedelta(days=3)).strftime("%Y-%m-%d")
-                economic_events = get_economic_events(start_date, end_date)
-                logger.info("經濟事件讀取完成")
-                logger.info("開始進行好友推播")
-                _broadcast_watch_list(target_date, watch_list_dfs, economic_events, need_broadcast)
-                logger.info("好友推播執行完成")
-
-
-# Update the market data
-def _update_market_data(target_date) -> pd.DataFrame:
-    # Get the TWSE/TPEX data, and merge them
-    twse_df = get_twse_data(target_date)
-    tpex_df = get_tpex_data(target_date)
-    market_data_df = pd.concat([twse_df, tpex_df])
-    # If the market data is empty, return it directly
-    if market_data_df.shape[0] == 0:
+        # Untracked runs still go through the same stage bookkeeping
+        job = job if job else UpdateJob(target_date, need_broadcast)
+        snapshot_meta = update_snapshot(target_date, job)
+        if snapshot_meta:
+            # Another request may have asked for a broadcast while this run was in progress
+            broadcast_snapshot(snapshot_meta, need_broadcast or job.need_broadcast, job)
+
+
+# Run the update job submitted by the job manager
+def run_update_job(app, job):
+    update_and_broadcast(app, job.target_date, job.need_broadcast, job)
+
+
+# Update the recommendation list and persist it to the snapshot store (return the snapshot metadata, or None if there is no update)
+def update_snapshot(target_date, job):
+    logger.info(f"資料日期 {str(target_date)}")
+    if not is_weekday(target_date):
+        logger.info("假日不進行更新與推播")
+        return None
+    strategy_version = get_strategy_version(WATCH_LIST_STRATEGIES, _get_watch_list_settings())
+    # A complete result of the same date and strategies is served from the archive instead of being recomputed
+    if not job.force:
+        with job.track_stage("archive"):
+            snapshot_meta = load_snapshot_meta(target_date, strategy_version)
+            if snapshot_meta and not snapshot_meta.get("degradation"):
+                mark_latest_snapshot(target_date, strategy_version)
+                logger.info(f"使用已保存的推薦結果 (策略版本 {strategy_version})")
+                return snapshot_meta
+    pipeline = _build_update_pipeline(target_date, job, strategy_version)
+    try:
+        results = pipeline.run(job)
+    except PipelineStopped as e:
+        logger.info(str(e))
+        return None
+    return results["snapshot"]
+
+
+# Build the DAG of the update stages: fetch → merge → strategies → snapshot/history (the alerts are checked with the broadcast)
+def _build_update_pipeline(target_date, job, strategy_version) -> Pipeline:
+    timeout_setting = current_app.config["PIPELINE_STAGE_TIMEOUT_SETTING"]
+    # Reduce the technical histories chunk by chunk while crawling
+    history_reducer = None
+    if current_app.config["TECHNICAL_CHUNK_SIZE"] > 0:
+        history_reducer = TechnicalChunkReducer(STRATEGIES, target_date)
+    watch_list_stages = [f"watch_list:{strategy_spec['name']}" for strategy_spec in WATCH_LIST_STRATEGIES]
+
+    def fetch_exchange_data(get_data_func, market_name):
+        df = get_data_func(target_date)
+        if df is None:
+            raise RuntimeError(f"無法取得{market_name}資料表")
+        return df
+
+    def combine_market_data(twse, tpex):
+        market_data_df = pd.concat([twse, tpex])
+        if market_data_df.shape[0] == 0:
+            if pipeline.get_degraded(["twse", "tpex"]):
+                raise RuntimeError("無法取得上市與上櫃資料表")
+            raise PipelineStopped("休市不進行更新與推播")
         return market_data_df
-    # Get the other data
-    other_df = get_other_data(target_date)
-    # Merge the other data with the market data
-    market_data_df = pd.merge(
-        other_df,
-        market_data_df,
-        how="left",
-        on=["代號", "名稱", "股票類型"],
+
+    def fetch_economic_events():
+        logger.info("開始讀取經濟事件")
+        start_date = (target_date + datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+        end_date = (target_date + datetime.timedelta(days=3)).strftime("%Y-%m-%d")
+        economic_events = get_economic_events(start_date, end_date)
+        logger.info("經濟事件讀取完成")
+        return economic_events
+
+    def build_watch_list(strategy_spec, merge):
+        logger.info(f"開始更新推薦清單 [{strategy_spec['name']}]")
+        return _update_watch_list(merge, strategy_spec)
+
+    def save(merge, economic_events, **watch_lists):
+        watch_list_dfs = [watch_lists[name] for name in watch_list_stages]
+        logger.info("推薦清單更新完成")
+        degradation = _get_degradation(pipeline, watch_list_stages)
+        if degradation:
+            job.set_degradation(degradation)
+        message = _render_watch_list_message(target_date, watch_list_dfs, economic_events, degradation)
+        stock_index = build_stock_index(merge, watch_list_dfs)
+        return save_snapshot(target_date, merge, watch_list_dfs, economic_events, message, degradation, stock_index, strategy_version)
+
+    def save_history(merge):
+        # Keep the daily histories for backtesting
+        history_panel = history_reducer.get_panel() if history_reducer else None
+        update_history(build_panel_from_market_data(merge, target_date, history_panel))
+
+    stages = [
+        Stage("twse", partial(fetch_exchange_data, get_twse_data, "上市"), timeout=timeout_setting.get("twse"), fallback=pd.DataFrame),
+        Stage("tpex", partial(fetch_exchange_data, get_tpex_data, "上櫃"), timeout=timeout_setting.get("tpex"), fallback=pd.DataFrame),
+        Stage("economic_events", fetch_economic_events, timeout=timeout_setting.get("economic_events"), fallback=list),
+        Stage("market", combine_market_data, deps=["twse", "tpex"]),
+        Stage("other", partial(_get_other_data, target_date, job, history_reducer), deps=["market"], timeout=timeout_setting.get("other")),
+        Stage("merge", partial(_merge_market_data, target_date), deps=["market", "other"]),
+        *[
+            Stage(stage_name, partial(build_watch_list, strategy_spec), deps=["merge"], timeout=timeout_setting.get("watch_list"), fallback=pd.DataFrame)
+            for stage_name, strategy_spec in zip(watch_list_stages, WATCH_LIST_STRATEGIES)
+        ],
+        Stage("snapshot", save, deps=["merge", "economic_events", *watch_list_stages]),
+        Stage("history", save_history, deps=["merge"], timeout=timeout_setting.get("history"), fallback=lambda: None),
+    ]
+    pipeline = Pipeline(stages, max_workers=current_app.config["PIPELINE_MAX_WORKERS"])
+    return pipeline
+
+
+# Degraded stages, and the strategies computed from their fallback results (None if nothing is degraded)
+def _get_degradation(pipeline, watch_list_stages):
+    degraded = pipeline.get_degraded()
+    if not degraded:
+        return None
+    # Strategies are labeled by their position in the message
+    affected_strategies = [
+        f"策略{i+1}"
+        for i, stage_name in enumerate(watch_list_stages)
+        if pipeline.get_degraded([stage_name])
+    ]
+    logger.warning(f"部分資料未能取得 {degraded}，受影響的策略 {affected_strategies}")
+    return {"stages": degraded, "strategies": affected_strategies}
+
+
+# Broadcast the recommendation message of a snapshot, and check the alerts on its market data
+def broadcast_snapshot(snapshot_meta, need_broadcast, job):
+    logger.info("開始進行好友推播")
+    with job.track_stage("broadcast"):
+        _deliver_snapshot(snapshot_meta, need_broadcast)
+    logger.info("好友推播執行完成")
+    # Dry runs (no broadcast) do not push anything, so they leave the alerts to the next broadcasting run.
+    # The alerts are checked here rather than in the pipeline, since a broadcast request may join the run after the pipeline started.
+    if not need_broadcast:
+        return
+    try:
+        with job.track_stage("alerts"):
+            _check_alerts(snapshot_meta)
+    except Exception:
+        logger.exception("到價提醒檢查失敗")
+
+
+# Check the alerts on the market data of a snapshot, and push the triggered ones
+def _check_alerts(snapshot_meta):
+    # Re-running a past date does not fire the alerts on old prices
+    latest_meta = load_snapshot_meta()
+    if latest_meta and str(latest_meta["target_date"]) > str(snapshot_meta["target_date"]):
+        return
+    snapshot = load_snapshot(snapshot_meta["target_date"], snapshot_meta.get("strategy_version"))
+    if not snapshot:
+        return
+    market_data_df, _, _ = snapshot
+    alert_engine.refresh()
+    updates = get_market_data_updates(market_data_df, alert_engine.index.stock_ids, alert_engine.index.fields)
+    triggered = alert_engine.check(updates)
+    logger.info(f"到價提醒觸發 {len(triggered)} 筆")
+    if triggered:
+        notify_alerts(current_app.config["LINE_BOT_API"], triggered)
+
+
+# Get the other data, with as much technical history as the strategies need
+def _get_other_data(target_date, job, history_reducer, market) -> pd.DataFrame:
+    history_days = plan_history_days(STRATEGIES, target_date, current_app.config["MAX_TECHNICAL_HISTORY_DAYS"])
+    logger.info(f"技術指標歷史資料天數 {history_days}")
+    stored_histories = None
+    if current_app.config["TECHNICAL_DELTA_FETCH"]:
+        stored_histories = _load_stored_histories(target_date, history_days)
+        if history_reducer is not None:
+            history_reducer.set_stored_histories(stored_histories)
+    other_df = get_other_data(
+        target_date,
+        progress_callback=job.set_progress,
+        chunk_callback=history_reducer,
+        history_days=history_days,
+        stored_histories=stored_histories,
+        coverage_callback=job.set_coverage,
     )
+    if other_df is None:
+        raise RuntimeError("無法取得其他資料表")
+    return other_df
+
+
+# Merge the other data with the market data
+def _merge_market_data(target_date, market, other) -> pd.DataFrame:
+    with metrics.timer("merge_seconds", source="market"):
+        market_data_df = pd.merge(
+            other,
+            market,
+            how="left",
+            on=["代號", "名稱", "股票類型"],
+        )
     # Drop the duplicated rows
     market_data_df = market_data_df[~market_data_df.index.duplicated(keep="first")]
     # Sort the index
     market_data_df = market_data_df.sort_index()
+    # Join the stats of each industry to its stocks
+    market_data_df = add_industry_stats(market_data_df)
     # Print TSMC data to check the correctness
+    if "2330" not in market_data_df.index:
+        logger.warning(f"{target_date} 無 [2330 台積電] 交易資訊")
+        return market_data_df
     logger.info(f"核對 [2330 台積電] {target_date} 交易資訊")
     tsmc = market_data_df.loc["2330"]
     for column, value in tsmc.items():
@@ -73,519 +245,98 @@ def _update_market_data(target_date) -> pd.DataFrame:
     return market_data_df
 
 
+# Load the stored technical histories of the last `history_days` trading days before the target date
+def _load_stored_histories(target_date, history_days) -> dict:
+    # Calendar days covering the trading days, with some room for holidays
+    start_date = target_date - datetime.timedelta(days=history_days * 7 // 5 + 14)
+    history_panel = load_history_panel(PRICE_FIELDS + HISTORY_FIELDS, start_date=start_date, end_date=target_date)
+    # The histock values have 2 decimal places, which the float32 store does not keep exactly
+    stored_histories = split_panel_to_histories(history_panel, decimals=2)
+    logger.info(f"已讀取 {len(stored_histories)} 檔股票的歷史技術指標")
+    return stored_histories
+
+
+# Settings of the watch lists besides the strategies, which change their content
+def _get_watch_list_settings() -> dict:
+    return {
+        "version": WATCH_LIST_VERSION,
+        "top_k": current_app.config["WATCH_LIST_TOP_K"],
+        # The factor functions are described by the source of `ranking`, which also scores and selects the stocks
+        "score": SCORE_SETTING,
+    }
+
+
 # Update the watch list
-def _update_watch_list(market_data_df, strategy_func, other_funcs=None) -> pd.DataFrame:
+def _update_watch_list(market_data_df, strategy_spec, other_funcs=None, profile=None, top_k=None) -> pd.DataFrame:
     # Print the market data size
     logger.info(f"股市資料表大小 {market_data_df.shape}")
+    profile = current_app.config["PROFILE_STRATEGIES"] if profile is None else profile
+    top_k = current_app.config["WATCH_LIST_TOP_K"] if top_k is None else top_k
     # Get the strategy
-    fundamental_mask, technical_mask, chip_mask = strategy_func(market_data_df)
+    with metrics.timer("strategy_mask_seconds", strategy=strategy_spec["name"]):
+        if profile:
+            (fundamental_mask, technical_mask, chip_mask), condition_profile = profile_strategy_masks(market_data_df, strategy_spec)
+        else:
+            fundamental_mask, technical_mask, chip_mask = build_strategy_masks(market_data_df, strategy_spec)
+    if profile:
+        report_strategy_profile(strategy_spec["name"], market_data_df.shape[0], condition_profile)
     # Combine all the filters
     watch_list_df = df_mask_helper(market_data_df, fundamental_mask + technical_mask + chip_mask)
-    watch_list_df = watch_list_df.sort_values(by=["產業別"], ascending=False)
     # Exclude biotech/medical industry
     watch_list_df = watch_list_df[watch_list_df["產業別"] != "生技醫療業"]
     # Apply other custom filters
     if other_funcs:
         for func in other_funcs:
             watch_list_df = watch_list_df[watch_list_df.index.to_series().apply(func)]
-    return watch_list_df
-
-
-# Get the strategy 1
-def _get_strategy_1(market_data_df) -> tuple:
-    # Fundamental strategy filters
-    fundamental_mask = [
-        # 營收成長至少其中一項 > 0%
-        (market_data_df["(月)營收月增率(%)"] > 0) |\
-        (market_data_df["(月)營收年增率(%)"] > 0) |\
-        (market_data_df["(月)累積營收年增率(%)"] > 0),
-    ]
+    # Rank the stocks among the whole market, and keep the best `top_k` (all of them if `top_k` is 0)
+    scores = score_stocks(market_data_df).reindex(watch_list_df.index)
+    watch_list_df = watch_list_df.assign(分數=scores.round(4))
+    if top_k > 0 and len(watch_list_df) > top_k:
+        logger.info(f"[{strategy_spec['name']}] 符合條件 {len(watch_list_df)} 檔，取分數前 {top_k} 檔")
+    positions = select_top_k(scores.to_numpy(), top_k if top_k > 0 else len(watch_list_df))
+    return watch_list_df.iloc[positions]
 
-    # Technical strategy filters
-    technical_mask = [
-        # 收盤價 > 20
-        technical.technical_indicator_constant_check_df(
-            market_data_df,
-            indicator="收盤",
-            direction="more",
-            threshold=20,
-            days=1,
-        ),
-        # MA1 > MA5
-        technical.technical_indicator_greater_or_less_one_day_check_df(
-            market_data_df,
-            indicator_1="收盤",
-            indicator_2="mean5",
-            direction="more",
-            threshold=1,
-            days=1,
-        ),
-        # MA5 > MA20
-        technical.technical_indicator_greater_or_less_one_day_check_df(
-            market_data_df,
-            indicator_1="mean5",
-            indicator_2="mean20",
-            direction="more",
-            threshold=1,
-            days=1,
-        ),
-        # MA20 > MA60
-        technical.technical_indicator_greater_or_less_one_day_check_df(
-            market_data_df,
-            indicator_1="mean20",
-            indicator_2="mean60",
-            direction="more",
-            threshold=1,
-            days=1,
-        ),
-        # 收盤價 > 1.01 * 開盤價 (今天收紅 K & 實體 K 棒漲幅大於 1%)
-        technical.technical_indicator_greater_or_less_one_day_check_df(
-            market_data_df,
-            indicator_1="收盤",
-            indicator_2="開盤",
-            direction="more",
-            threshold=1.01,
-            days=1,
-        ),
-        # # K 棒底底高
-        # (technical.technical_indicator_greater_or_less_two_day_check_df(market_data_df, indicator_1="開盤", indicator_2="開盤", direction="more", threshold=1, days=1) |\
-        # technical.technical_indicator_greater_or_less_two_day_check_df(market_data_df, indicator_1="開盤", indicator_2="收盤", direction="more", threshold=1, days=1)),
-        # # 今天開盤價 > 昨天收盤價
-        # technical.technical_indicator_greater_or_less_two_day_check_df(market_data_df, indicator_1="開盤", indicator_2="收盤", direction="more", threshold=1, days=1),
-        # 今天收盤 > 昨天最高
-        technical.technical_indicator_greater_or_less_two_day_check_df(
-            market_data_df,
-            indicator_1="收盤",
-            indicator_2="最高",
-            direction="more",
-            threshold=1,
-            days=1,
-        ),
-        # 今天 K9 > 昨天 K9
-        technical.technical_indicator_greater_or_less_two_day_check_df(
-            market_data_df,
-            indicator_1="k9",
-            indicator_2="k9",
-            direction="more",
-            threshold=1,
-            days=1,
-        ),
-        # 今天 D9 < 90
-        technical.technical_indicator_constant_check_df(
-            market_data_df, 
-            indicator="d9", 
-            direction="less", 
-            threshold=90, 
-            days=1,
-        ),
-        # # 今天 OSC > 昨天 OSC
-        # technical.technical_indicator_greater_or_less_two_day_check_df(market_data_df, indicator_1="osc", indicator_2="osc", direction="more", threshold=1, days=1),
-        # |D9 - K9| < 22
-        technical.technical_indicator_difference_one_day_check_df(
-            market_data_df,
-            indicator_1="k9",
-            indicator_2="d9",
-            difference_threshold=22,
-            days=1,
-        ),
-        # # K9 between 49 ~ 87
-        # technical.technical_indicator_constant_check_df(market_data_df, indicator="k9", direction="more", threshold=49, days=1),
-        # technical.technical_indicator_constant_check_df(market_data_df, indicator="k9", direction="less", threshold=87, days=1),
-        # J9 < 100
-        technical.technical_indicator_constant_check_df(
-            market_data_df, indicator="j9", direction="less", threshold=100, days=1
-        ),
-        # # (今天 k9-d9) >= (昨天 k9-d9)
-        # technical.technical_indicator_difference_greater_two_day_check_df(market_data_df, indicator_1="k9", indicator_2="d9", days=1),
-        # # MA5 趨勢向上
-        # technical.technical_indicator_greater_or_less_two_day_check_df(market_data_df, indicator_1="mean5", indicator_2="mean5", direction="more", threshold=1, days=1),
-        # 今天收盤 > 1.02 * 昨天收盤 (漲幅 2% 以上)
-        technical.technical_indicator_greater_or_less_two_day_check_df(
-            market_data_df,
-            indicator_1="收盤",
-            indicator_2="收盤",
-            direction="more",
-            threshold=1.02,
-            days=1,
-        ),
-        # 不能連續兩天漲幅都超過 5%
-        ~technical.technical_indicator_greater_or_less_two_day_check_df(
-            market_data_df,
-            indicator_1="收盤",
-            indicator_2="收盤",
-            direction="more",
-            threshold=1.05,
-            days=2,
-        ),
-        # # 今天收盤 < 1.1 * Mean5 or Mean10 or Mean20 (均線乖離不能過大)
-        # technical.technical_indicator_greater_or_less_one_day_check_df(market_data_df, indicator_1="收盤", indicator_2="mean5", direction="less", threshold=1.1, days=1) |\
-        # technical.technical_indicator_greater_or_less_one_day_check_df(market_data_df, indicator_1="收盤", indicator_2="mean10", direction="less", threshold=1.1, days=1) |\
-        # technical.technical_indicator_greater_or_less_one_day_check_df(market_data_df, indicator_1="收盤", indicator_2="mean20", direction="less", threshold=1.1, days=1),
-        # # 今天最高價不是四個月內最高 (只抓得到四個月的資料)
-        # technical.today_price_is_not_max_check_df(market_data_df, price_type="最高", days=80),
-        # 上影線長度不能超過昨天收盤價的 3% (0.03) / 0% (0.000001) 以上
-        technical.technical_indicator_difference_two_day_check_df(
-            market_data_df,
-            indicator_1="最高",
-            indicator_2="收盤",
-            direction="less",
-            threshold=0.03,
-            indicator_3="收盤",
-            days=1,
-        ),
-        # 滿足飆股條件
-        technical.skyrocket_check_df(
-            market_data_df,
-            n_days=10,
-            k_change=0.20,
-            consecutive_red_no_upper_shadow_days=2,
-        ),
-        # # OSC > 0 (出現強勁漲幅的機會較高)
-        # technical.technical_indicator_constant_check_df(market_data_df, indicator="osc", direction="more", threshold=0, days=1),
-        # # DIF > 0
-        # technical.technical_indicator_constant_check_df(market_data_df, indicator="dif", direction="more", threshold=0, days=1),
-        # # [(DIF / 收盤價) < 0.03] 或 [DIF 不是四個月內的最高]
-        # technical.technical_indicator_greater_or_less_one_day_check_df(
-        #     market_data_df,
-        #     indicator_1="dif",
-        #     indicator_2="收盤",
-        #     direction="less",
-        #     threshold=0.03,
-        #     days=1,
-        # )
-        # | technical.today_price_is_not_max_check_df(
-        #     market_data_df, price_type="dif", days=80
-        # ),
-    ]
 
-    # Chip strategy filters
-    chip_mask = [
-        # 成交量 > 2000 張
-        technical.volume_greater_check_df(
-            market_data_df,
-            shares_threshold=2000,
-            days=1,
-        ),
-        # 今天成交量 > 昨天成交量
-        technical.technical_indicator_greater_or_less_two_day_check_df(
-            market_data_df,
-            indicator_1="volume",
-            indicator_2="volume",
-            direction="more",
-            threshold=1,
-            days=1,
-        ),
-        # 今天成交量 > 5日均量
-        technical.technical_indicator_greater_or_less_one_day_check_df(
-            market_data_df,
-            indicator_1="volume",
-            indicator_2="mean_5_volume",
-            direction="more",
-            threshold=1,
-            days=1,
-        ),
-        # # 5日均量 > 20日均量
-        # technical.technical_indicator_greater_or_less_one_day_check_df(market_data_df, indicator_1="mean_5_volume", indicator_2="mean_20_volume", direction="more", threshold=1, days=1),
-        # 5日均量 > 1000 張
-        technical.technical_indicator_constant_check_df(
-            market_data_df,
-            indicator="mean_5_volume",
-            direction="more",
-            threshold=1000,
-            days=1,
-        ),
-        # 20日均量 > 1000 張
-        technical.technical_indicator_constant_check_df(
-            market_data_df,
-            indicator="mean_20_volume",
-            direction="more",
-            threshold=1000,
-            days=1,
-        ),
-        # 「今天的5日均量」要大於「昨天的5日均量」
-        technical.technical_indicator_greater_or_less_two_day_check_df(
-            market_data_df,
-            indicator_1="mean_5_volume",
-            indicator_2="mean_5_volume",
-            direction="more",
-            threshold=1,
-            days=1,
-        ),
-        # # 單一法人至少買超成交量的 10%
-        # chip.single_institutional_buy_check_df(market_data_df, single_volume_threshold=10),
-        # # 法人合計至少買超成交量的 1%
-        # chip.total_institutional_buy_check_df(market_data_df, total_volume_threshold=1),
-        # 外資買超 >= 0 張
-        chip.foreign_buy_positive_check_df(market_data_df, threshold=0),
-        # # 投信買超 >= 50 張
-        # chip.investment_buy_positive_check_df(market_data_df, threshold=50),
-        # # 自定義法人買超篩選
-        # chip.buy_positive_check_df(market_data_df),
-        # # 法人合計買超 >= 0 張
-        # chip.total_institutional_buy_positive_check_df(market_data_df, threshold=0),
-    ]
-    return fundamental_mask, technical_mask, chip_mask
-
-
-# Get the strategy 2
-def _get_strategy_2(market_data_df) -> tuple:
-    fundamental_mask = [
-        # 營收成長至少其中一項 > 0%
-        (market_data_df["(月)營收月增率(%)"] > 0) |\
-        (market_data_df["(月)營收年增率(%)"] > 0) |\
-        (market_data_df["(月)累積營收年增率(%)"] > 0),
-    ]
-    technical_mask = [
-        # 收盤價 > 20
-        technical.technical_indicator_constant_check_df(
-            market_data_df,
-            indicator="收盤",
-            direction="more",
-            threshold=20,
-            days=1,
-        ),
-        # MA1 > MA5
-        technical.technical_indicator_greater_or_less_one_day_check_df(
-            market_data_df,
-            indicator_1="收盤",
-            indicator_2="mean5",
-            direction="more",
-            threshold=1,
-            days=1,
-        ),
-        # MA1 > MA20
-        technical.technical_indicator_greater_or_less_one_day_check_df(
-            market_data_df,
-            indicator_1="收盤",
-            indicator_2="mean20",
-            direction="more",
-            threshold=1,
-            days=1,
-        ),
-        # 今天 MA60 > 昨天 MA60
-        technical.technical_indicator_greater_or_less_two_day_check_df(
-            market_data_df,
-            indicator_1="mean60",
-            indicator_2="mean60",
-            direction="more",
-            threshold=1,
-            days=1,
-        ),
-        # K9 > D9
-        technical.technical_indicator_greater_or_less_one_day_check_df(
-            market_data_df,
-            indicator_1="k9",
-            indicator_2="d9",
-            direction="more",
-            threshold=1,
-            days=1,
-        ),
-        # 今天 J9 > 昨天 J9
-        technical.technical_indicator_greater_or_less_two_day_check_df(
-            market_data_df,
-            indicator_1="j9",
-            indicator_2="j9",
-            direction="more",
-            threshold=1,
-            days=1,
-        ),
-        # 今天 OSC > 昨天 OSC
-        technical.technical_indicator_greater_or_less_two_day_check_df(
-            market_data_df,
-            indicator_1="osc",
-            indicator_2="osc",
-            direction="more",
-            threshold=1,
-            days=1,
-        ),
-        # 今天 J9 < 100
-        technical.technical_indicator_constant_check_df(
-            market_data_df, indicator="j9", direction="less", threshold=100, days=1
-        ),
-    ]
-    chip_mask = [
-        # 成交量 > 1500 張
-        technical.volume_greater_check_df(
-            market_data_df,
-            shares_threshold=1500,
-            days=1,
-        ),
-        # 今天成交量 > 昨天成交量
-        technical.technical_indicator_greater_or_less_two_day_check_df(
-            market_data_df,
-            indicator_1="volume",
-            indicator_2="volume",
-            direction="more",
-            threshold=1,
-            days=1,
-        ),
-        # 今天成交量 > 5日均量
-        technical.technical_indicator_greater_or_less_one_day_check_df(
-            market_data_df,
-            indicator_1="volume",
-            indicator_2="mean_5_volume",
-            direction="more",
-            threshold=1,
-            days=1,
-        ),
-    ]
-    return fundamental_mask, technical_mask, chip_mask
-
-
-# Get the strategy 3
-def _get_strategy_3(market_data_df) -> tuple:
-    # Fundamental strategy filters
-    fundamental_mask = []
-    # Technical strategy filters
-    technical_mask = [
-        # 收盤價 > 20
-        technical.technical_indicator_constant_check_df(
-            market_data_df,
-            indicator="收盤",
-            direction="more",
-            threshold=20,
-            days=1,
-        ),
-        # 今天收盤 > 1.01 * 昨天收盤 (漲幅 1% 以上)
-        technical.technical_indicator_greater_or_less_two_day_check_df(
-            market_data_df,
-            indicator_1="收盤",
-            indicator_2="收盤",
-            direction="more",
-            threshold=1.01,
-            days=1,
-        ),
-        # 今天收紅 K
-        technical.technical_indicator_greater_or_less_one_day_check_df(
-            market_data_df,
-            indicator_1="收盤",
-            indicator_2="開盤",
-            direction="more",
-            threshold=1,
-            days=1,
-        ),
-        # MA1 > MA60
-        technical.technical_indicator_greater_or_less_one_day_check_df(
-            market_data_df,
-            indicator_1="收盤",
-            indicator_2="mean60",
-            direction="more",
-            threshold=1,
-            days=1,
-        ),
-        # 今天 MA20 > 昨天 MA20
-        technical.technical_indicator_greater_or_less_two_day_check_df(
-            market_data_df,
-            indicator_1="mean20",
-            indicator_2="mean20",
-            direction="more",
-            threshold=1,
-            days=1,
-        ),
-        # 今天 MA60 > 昨天 MA60
-        technical.technical_indicator_greater_or_less_two_day_check_df(
-            market_data_df,
-            indicator_1="mean60",
-            indicator_2="mean60",
-            direction="more",
-            threshold=1,
-            days=1,
-        ),
-        # 五天內最低價曾經跌到 MA20 以下
-        ~technical.technical_indicator_greater_or_less_one_day_check_df(
-            market_data_df,
-            indicator_1="最低",
-            indicator_2="mean20",
-            direction="more",
-            threshold=1,
-            days=5,
-        ),
-        # 昨天下跌
-        ~technical.technical_indicator_greater_or_less_two_day_check_df(
-            market_data_df,
-            indicator_1="收盤",
-            indicator_2="收盤",
-            direction="more",
-            threshold=1,
-            days=2,
-        ),
-        # 今天 K9 > 昨天 K9
-        technical.technical_indicator_greater_or_less_two_day_check_df(
-            market_data_df,
-            indicator_1="k9",
-            indicator_2="k9",
-            direction="more",
-            threshold=1,
-            days=1,
-        ),
-        # 今天 K9 > 20
-        technical.technical_indicator_constant_check_df(
-            market_data_df,
-            indicator="k9",
-            direction="more",
-            threshold=20,
-            days=1,
-        ),
-        # 滿足飆股條件
-        technical.skyrocket_check_df(
-            market_data_df,
-            n_days=10,
-            k_change=0.20,
-            consecutive_red_no_upper_shadow_days=0,
-        ),
-    ]
-    # Chip strategy filters
-    chip_mask = [
-        # 成交量 > 200 張
-        technical.volume_greater_check_df(
-            market_data_df,
-            shares_threshold=200,
-            days=1,
-        ),
-        # 今天成交量 < 昨天成交量
-        technical.technical_indicator_greater_or_less_two_day_check_df(
-            market_data_df,
-            indicator_1="volume",
-            indicator_2="volume",
-            direction="less",
-            threshold=1,
-            days=1,
-        ),
-        # 外資買超 >= 0 張
-        chip.foreign_buy_positive_check_df(market_data_df, threshold=0),
-    ]
-    return fundamental_mask, technical_mask, chip_mask
-
-
-# Broadcast the watch list
-def _broadcast_watch_list(target_date, watch_list_dfs, economic_events, need_broadcast):
-    # Final recommendation text message
-    final_recommendation_text = ""
-    # Append the recommendation stocks
+# Render the watch list message
+def _render_watch_list_message(target_date, watch_list_dfs, economic_events, degradation=None) -> str:
+    watch_lists = []
     for i, watch_list_df in enumerate(watch_list_dfs):
         if len(watch_list_df) == 0:
-            final_recommendation_text += f"🔎 [策略{i+1}]  無推薦股票\n"
             logger.info(f"[策略{i+1}] 無推薦股票")
         else:
-            final_recommendation_text += f"🔎 [策略{i+1}]  股票有 {len(watch_list_df)} 檔\n" + "\n###########\n\n"
             logger.info(f"[策略{i+1}] 股票有 {len(watch_list_df)} 檔")
-            for stock_id, v in watch_list_df.iterrows():
-                final_recommendation_text += f"{stock_id} {v['名稱']}  {v['產業別']}\n"
-                logger.info(f"{stock_id} {v['名稱']}  {v['產業別']}")
-        final_recommendation_text += "\n###########\n\n"
-    # Append the economic events
+        stocks = []
+        for stock_id, v in watch_list_df.iterrows():
+            stocks.append((stock_id, v["名稱"], v["產業別"]))
+            logger.info(f"{stock_id} {v['名稱']}  {v['產業別']}")
+        watch_lists.append((f"策略{i+1}", stocks))
     if len(economic_events) != 0:
-        final_recommendation_text += "📆 預計經濟事件\n" + "\n###########\n\n"
         logger.info("預計經濟事件")
         for event in economic_events:
-            final_recommendation_text += f"{event['date']} - {event['country']} - {event['title']}\n"
             logger.info(f"{event['date']} - {event['country']} - {event['title']}")
-        final_recommendation_text += "\n###########\n\n"
-    # Append the source information
-    final_recommendation_text += f"資料來源: 台股 {str(target_date)}"
-    # Append the version information
-    final_recommendation_text += f"\nJohnKuo © {current_app.config['YEAR']} ({current_app.config['VERSION']})"
-    # Broadcast the final recommendation text message if needed
-    if need_broadcast:
-        line_bot_api = current_app.config["LINE_BOT_API"]
-        line_bot_api.broadcast(TextSendMessage(text=final_recommendation_text))
+    degraded_strategies = degradation["strategies"] if degradation else None
+    return render_watch_list_message(target_date, watch_lists, economic_events, degraded_strategies)
+
+
+# Deliver the recommendation message of a snapshot: per subscription if every friend is known, otherwise broadcast
+def _deliver_snapshot(snapshot_meta, need_broadcast):
+    if not need_broadcast:
+        return
+    line_bot_api = current_app.config["LINE_BOT_API"]
+    stock_index = load_stock_index(snapshot_meta["target_date"], snapshot_meta.get("strategy_version"))
+    # Friends who followed before the subscriber store existed and never sent a message are only in the follower list
+    follower_ids = get_follower_ids(line_bot_api) if stock_index is not None else None
+    if follower_ids is None:
+        # Without the follower list (or a snapshot saved before the stock index existed), only a broadcast reaches every friend
+        if load_subscribers():
+            logger.warning("無法取得好友清單，以廣播推播 (不套用個人訂閱設定)")
+        broadcast_message(line_bot_api, snapshot_meta["message"])
+        return
+    added = add_subscribers(follower_ids)
+    if added:
+        logger.info(f"新增 {added} 位好友為訂閱者")
+    stats = deliver_to_subscribers(
+        line_bot_api, snapshot_meta, stock_index, load_subscribers(),
+        workers=current_app.config["DELIVERY_WORKERS"],
+    )
+    logger.info(f"推播 {stats['subscriptions']} 種訂閱內容給 {stats['recipients']} 位訂閱者 (共 {stats['requests']} 次請求，失敗 {stats['failed_recipients']} 位)")
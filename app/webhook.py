@@ -0,0 +1,89 @@
+import time
+import queue
+import threading
+
+from collections import OrderedDict
+from config import logger
+from .metrics import metrics
+
+# Webhook event ids remembered to drop the redeliveries of LINE
+MAX_SEEN_EVENT_IDS = 10000
+
+
+class WebhookDispatcher:
+    """
+    Asynchronous ingestion of the LINE webhook events.
+
+    `submit` verifies the signature and enqueues the events, so `/callback` returns at once;
+    `workers` threads then pass every event to `handle_func(event)`. Events already seen
+    (same webhook event id) are dropped, so a redelivery is handled only once.
+    """
+
+    def __init__(self, parser_getter, handle_func, workers=2, max_queue_size=100):
+        # The parser is read lazily, so the LINE Bot SDK is only imported on the first webhook
+        self._parser_getter = parser_getter
+        self._handle_func = handle_func
+        self._workers = workers
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._lock = threading.Lock()
+        self._seen_event_ids = OrderedDict()
+        self._threads = []
+
+    def _start(self):
+        with self._lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            for i in range(len(self._threads), self._workers):
+                thread = threading.Thread(target=self._work, name=f"webhook-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    # Verify the signature and enqueue the events: return False if some events could not be enqueued (the queue is full)
+    def submit(self, body, signature) -> bool:
+        # Raise InvalidSignatureError if the signature is invalid
+        events = self._parser_getter().parse(body, signature)
+        self._start()
+        all_enqueued = True
+        for event in events:
+            event_id = getattr(event, "webhook_event_id", None)
+            if event_id and not self._mark_seen(event_id):
+                metrics.inc("webhook_events_total", status="duplicate")
+                continue
+            try:
+                self._queue.put_nowait((event, time.perf_counter()))
+            except queue.Full:
+                # Forget the event, so that the redelivery is handled
+                self._forget(event_id)
+                metrics.inc("webhook_events_total", status="dropped")
+                all_enqueued = False
+        metrics.set("webhook_queue_depth", self._queue.qsize())
+        return all_enqueued
+
+    def _mark_seen(self, event_id) -> bool:
+        with self._lock:
+            if event_id in self._seen_event_ids:
+                return False
+            self._seen_event_ids[event_id] = True
+            while len(self._seen_event_ids) > MAX_SEEN_EVENT_IDS:
+                self._seen_event_ids.popitem(last=False)
+            return True
+
+    def _forget(self, event_id):
+        if event_id:
+            with self._lock:
+                self._seen_event_ids.pop(event_id, None)
+
+    def _work(self):
+        while True:
+            event, enqueued_at = self._queue.get()
+            metrics.set("webhook_queue_depth", self._queue.qsize())
+            metrics.observe("webhook_queue_seconds", time.perf_counter() - enqueued_at)
+            start_time = time.perf_counter()
+            try:
+                self._handle_func(event)
+                metrics.inc("webhook_events_total", status="handled")
+            except Exception:
+                logger.exception(f"Failed to handle webhook event {getattr(event, 'webhook_event_id', None)}")
+                metrics.inc("webhook_events_total", status="failed")
+            finally:
+                metrics.observe("webhook_handle_seconds", time.perf_counter() - start_time, type=getattr(event, "type", "unknown"))
+                self._queue.task_done()
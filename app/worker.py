@@ -0,0 +1,161 @@
+import queue
+import threading
+import multiprocessing
+
+from config import config, logger
+from .jobs import UpdateJob
+from .metrics import metrics
+
+# How often the listener checks that the worker process is still alive (in seconds)
+WORKER_HEARTBEAT_INTERVAL = 1
+
+
+class _WorkerJob(UpdateJob):
+    """Job running inside the worker process, which forwards its state changes to the web process."""
+
+    def __init__(self, job_id, target_date, need_broadcast, force, event_queue):
+        super().__init__(target_date, need_broadcast, force)
+        self.job_id = job_id
+        self._event_queue = event_queue
+
+    def set_stage(self, name):
+        super().set_stage(name)
+        self._event_queue.put((self.job_id, "stage", (name,)))
+
+    def record_stage_time(self, name, seconds):
+        super().record_stage_time(name, seconds)
+        self._event_queue.put((self.job_id, "stage_time", (name, seconds)))
+
+    def set_progress(self, processed, total):
+        super().set_progress(processed, total)
+        self._event_queue.put((self.job_id, "progress", (processed, total)))
+
+    def set_coverage(self, coverage):
+        super().set_coverage(coverage)
+        self._event_queue.put((self.job_id, "coverage", (coverage,)))
+
+    def set_degradation(self, degradation):
+        super().set_degradation(degradation)
+        self._event_queue.put((self.job_id, "degradation", (degradation,)))
+
+
+# Entry point of the worker process: run the pipeline for every queued job
+def _worker_main(job_queue, event_queue):
+    from flask import Flask
+    from .views import update_snapshot
+
+    app = Flask(__name__)
+    app.config.from_object(config)
+    metrics.process_name = "worker"
+    logger.info("更新工作程序已啟動")
+    while True:
+        job_id, target_date, need_broadcast, force = job_queue.get()
+        job = _WorkerJob(job_id, target_date, need_broadcast, force, event_queue)
+        try:
+            with app.app_context():
+                snapshot_meta = update_snapshot(target_date, job)
+            # Only the snapshot date is sent back, the result itself is read from the snapshot store
+            event_queue.put((job_id, "finish", (snapshot_meta["target_date"] if snapshot_meta else None, None)))
+        except Exception as e:
+            logger.exception(f"更新任務 {job_id} 執行失敗")
+            event_queue.put((job_id, "finish", (None, str(e))))
+        finally:
+            metrics.update_process_metrics()
+            event_queue.put((job_id, "metrics", (metrics.collect(),)))
+
+
+class PipelineWorker:
+    """
+    Runs the update pipeline in a dedicated process, so that the pandas-heavy work
+    does not compete with the Flask request workers for the GIL.
+
+    `run` has the same signature as `views.run_update_job` and blocks until the
+    worker process finishes the job, so it can be used as the `run_func` of
+    `UpdateJobManager`. The broadcast and the alert checks are run in the web process,
+    using the message and the market data stored in the snapshot.
+    """
+
+    def __init__(self):
+        self._context = multiprocessing.get_context("spawn")
+        self._job_queue = self._context.Queue()
+        self._event_queue = self._context.Queue()
+        self._process = None
+        self._listener = None
+        self._lock = threading.Lock()
+        self._pending_jobs = {}
+
+    def start(self):
+        with self._lock:
+            if self._process is None or not self._process.is_alive():
+                self._process = self._context.Process(
+                    target=_worker_main,
+                    args=(self._job_queue, self._event_queue),
+                    name="pipeline-worker",
+                    daemon=True,
+                )
+                self._process.start()
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen, name="pipeline-worker-listener", daemon=True)
+                self._listener.start()
+
+    def run(self, app, job):
+        from .views import broadcast_snapshot
+        from .store import load_snapshot_meta
+
+        self.start()
+        done = threading.Event()
+        result = {}
+        with self._lock:
+            self._pending_jobs[job.job_id] = (job, done, result)
+        self._job_queue.put((job.job_id, job.target_date, job.need_broadcast, job.force))
+        done.wait()
+        if result["error"]:
+            raise RuntimeError(result["error"])
+        if result["snapshot_date"]:
+            snapshot_meta = load_snapshot_meta(result["snapshot_date"])
+            with app.app_context():
+                broadcast_snapshot(snapshot_meta, job.need_broadcast, job)
+
+    # Apply the events sent by the worker process to the jobs of the web process
+    def _listen(self):
+        while True:
+            try:
+                job_id, event, args = self._event_queue.get(timeout=WORKER_HEARTBEAT_INTERVAL)
+            except queue.Empty:
+                if not self._process.is_alive():
+                    self._fail_pending_jobs("更新工作程序異常結束")
+                continue
+            if event == "metrics":
+                # The worker sends its cumulative metrics, which replace the previous ones
+                metrics.merge_remote("worker", *args)
+                continue
+            with self._lock:
+                pending = self._pending_jobs.get(job_id)
+            if not pending:
+                continue
+            job, done, result = pending
+            if event == "stage":
+                job.set_stage(*args)
+            elif event == "stage_time":
+                job.record_stage_time(*args)
+            elif event == "progress":
+                job.set_progress(*args)
+            elif event == "coverage":
+                job.set_coverage(*args)
+            elif event == "degradation":
+                job.set_degradation(*args)
+            elif event == "finish":
+                result["snapshot_date"], result["error"] = args
+                with self._lock:
+                    self._pending_jobs.pop(job_id, None)
+                done.set()
+
+    def _fail_pending_jobs(self, error):
+        with self._lock:
+            pending_jobs = list(self._pending_jobs.values())
+            self._pending_jobs.clear()
+        for _, done, result in pending_jobs:
+            result["snapshot_date"], result["error"] = None, error
+            done.set()
+        if pending_jobs:
+            logger.error(error)
@@ -0,0 +1,69 @@
+"""
+Cold start benchmark of the web service.
+
+Creates the app in a fresh interpreter, calls the routes that must answer before the
+analytics stack is loaded, and fails if any heavy module was imported or if the
+start-up time exceeds the budget.
+
+Usage: python -m benchmarks.import_time [--budget SECONDS] [--repeat N]
+"""
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+# Modules which must not be loaded by `create_app` and the light routes
+HEAVY_MODULES = ["pandas", "numpy", "ta", "twstock", "bs4", "fake_useragent", "linebot", "app.views"]
+
+# Routes which must answer without loading the heavy modules
+LIGHT_ROUTES = ["/", "/wakeup"]
+
+_CHILD_SCRIPT = """
+import sys, json, time
+start_time = time.perf_counter()
+from app import create_app
+app = create_app()
+import_seconds = time.perf_counter() - start_time
+client = app.test_client()
+status_codes = {route: client.get(route).status_code for route in ROUTES}
+print(json.dumps({
+    "import_seconds": import_seconds,
+    "status_codes": status_codes,
+    "loaded_modules": [name for name in HEAVY_MODULES if name in sys.modules],
+}))
+"""
+
+
+def measure_once() -> dict:
+    script = f"ROUTES = {LIGHT_ROUTES!r}\nHEAVY_MODULES = {HEAVY_MODULES!r}\n" + _CHILD_SCRIPT
+    output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", type=float, default=1.0, help="Maximum median start-up time in seconds")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    results = [measure_once() for _ in range(args.repeat)]
+    median_seconds = statistics.median(result["import_seconds"] for result in results)
+    print(f"create_app median: {median_seconds:.3f}s over {args.repeat} runs (budget {args.budget:.3f}s)")
+
+    failures = []
+    loaded_modules = sorted({name for result in results for name in result["loaded_modules"]})
+    if loaded_modules:
+        failures.append(f"heavy modules loaded at start-up: {', '.join(loaded_modules)}")
+    for route, status_code in results[0]["status_codes"].items():
+        if status_code != 200:
+            failures.append(f"{route} returned {status_code}")
+    if median_seconds > args.budget:
+        failures.append(f"start-up time {median_seconds:.3f}s exceeds the budget")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
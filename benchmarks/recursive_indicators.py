@@ -0,0 +1,94 @@
+"""
+Recursive indicator benchmark.
+
+Computes KD, MACD and PSAR of random-walk prices for every stock at once with each
+available backend (NumPy, and Numba when it is installed), checks that the backends
+return the same values, and reports the speedup of the compiled loops.
+
+Usage: python -m benchmarks.recursive_indicators [--stocks 2000 20000] [--days 1000] [--repeat N]
+"""
+import sys
+import time
+import argparse
+import numpy as np
+
+from app.indicators import get_kd, get_macd, get_psar, numba
+
+INDICATORS = {
+    "kd": lambda prices, backend: get_kd(prices["high"], prices["low"], prices["close"], backend=backend),
+    "macd": lambda prices, backend: get_macd(prices["close"], backend=backend),
+    "psar": lambda prices, backend: get_psar(prices["high"], prices["low"], prices["close"], backend=backend),
+}
+
+
+def make_prices(days, stocks, seed=0) -> dict:
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, (days, stocks)), axis=0))
+    high = close * (1 + rng.uniform(0, 0.02, (days, stocks)))
+    low = close * (1 - rng.uniform(0, 0.02, (days, stocks)))
+    # Stocks listed later in the period
+    listed_days = rng.integers(0, days // 2, stocks)
+    missing = np.arange(days)[:, None] < np.where(rng.random(stocks) < 0.1, listed_days, 0)
+    for values in (close, high, low):
+        values[missing] = np.nan
+    return {"high": high, "low": low, "close": close}
+
+
+def measure(func, prices, backend, repeat) -> tuple:
+    seconds = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = func(prices, backend)
+        seconds.append(time.perf_counter() - start_time)
+    return min(seconds), result
+
+
+def _max_difference(result_1, result_2) -> float:
+    results_1 = result_1 if isinstance(result_1, tuple) else (result_1,)
+    results_2 = result_2 if isinstance(result_2, tuple) else (result_2,)
+    difference = 0.0
+    for values_1, values_2 in zip(results_1, results_2):
+        if not np.array_equal(np.isnan(values_1), np.isnan(values_2)):
+            return float("inf")
+        difference = max(difference, float(np.nanmax(np.abs(values_1 - values_2), initial=0)))
+    return difference
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stocks", type=int, nargs="+", default=[2000, 20000])
+    parser.add_argument("--days", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=1e-9, help="Maximum difference between the backends")
+    args = parser.parse_args()
+
+    if numba is None:
+        print("Numba is not installed, only the NumPy backend is measured")
+    else:
+        # Compile the loops once (cached on disk afterwards)
+        start_time = time.perf_counter()
+        small_prices = make_prices(30, 3)
+        for func in INDICATORS.values():
+            func(small_prices, "numba")
+        print(f"numba compile: {time.perf_counter() - start_time:.3f}s")
+
+    failures = []
+    for stocks in args.stocks:
+        prices = make_prices(args.days, stocks)
+        for name, func in INDICATORS.items():
+            numpy_seconds, numpy_result = measure(func, prices, "numpy", args.repeat)
+            line = f"{name:5} {stocks:6} stocks x {args.days} days: numpy {numpy_seconds:.3f}s"
+            if numba is not None:
+                numba_seconds, numba_result = measure(func, prices, "numba", args.repeat)
+                line += f" / numba {numba_seconds:.3f}s ({numpy_seconds / numba_seconds:.1f}x)"
+                difference = _max_difference(numpy_result, numba_result)
+                if difference > args.tolerance:
+                    failures.append(f"{name} with {stocks} stocks differs between the backends by {difference:g}")
+            print(line)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
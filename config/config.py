@@ -1,11 +1,37 @@
 import os
+import importlib
+import threading
 
 from models.data_type import DataType
-from linebot import LineBotApi, WebhookHandler
 
 # TODO: We need more complicated configuration settings
 # TODO: add typing and comment language unification
 
+class LazyObject:
+    """
+    Proxy which imports its module and creates the wrapped object on first attribute access,
+    so that loading the config does not pay for importing the LINE Bot SDK.
+    """
+
+    def __init__(self, module_name, class_name, *args):
+        self._module_name = module_name
+        self._class_name = class_name
+        self._args = args
+        self._object = None
+        self._lock = threading.Lock()
+
+    def _get_object(self):
+        if self._object is None:
+            with self._lock:
+                if self._object is None:
+                    object_class = getattr(importlib.import_module(self._module_name), self._class_name)
+                    self._object = object_class(*self._args)
+        return self._object
+
+    def __getattr__(self, name):
+        return getattr(self._get_object(), name)
+
+
 class BasicConfig:
     """Base config class for shared configuration."""
     
@@ -15,13 +41,77 @@ class BasicConfig:
     # Version number
     VERSION = "v5.5"
 
-    # Line Bot settings
-    LINE_BOT_API = LineBotApi(os.getenv("CHANNEL_ACCESS_TOKEN", "default_channel_access_token"))
-    WEBHOOK_HANDLER = WebhookHandler(os.getenv("CHANNEL_SECRET", "default_channel_secret"))
+    # Line Bot settings (created on first use)
+    LINE_BOT_API = LazyObject("app.line_api", "PooledLineBotApi", os.getenv("CHANNEL_ACCESS_TOKEN", "default_channel_access_token"))
+    WEBHOOK_HANDLER = LazyObject("linebot", "WebhookHandler", os.getenv("CHANNEL_SECRET", "default_channel_secret"))
 
     # API Access Token
     API_ACCESS_TOKEN = os.getenv("API_ACCESS_TOKEN", "default_api_access_token")
 
+    # Update job settings (runs executing at the same time / runs queued or executing)
+    MAX_RUNNING_UPDATE_JOBS = int(os.getenv("MAX_RUNNING_UPDATE_JOBS", 1))
+    MAX_PENDING_UPDATE_JOBS = int(os.getenv("MAX_PENDING_UPDATE_JOBS", 3))
+
+    # Webhook event handling (worker threads / events queued before /callback asks LINE to redeliver)
+    WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 2))
+    WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 100))
+
+    # Concurrent multicast requests when delivering the recommendations to the subscribers
+    DELIVERY_WORKERS = int(os.getenv("DELIVERY_WORKERS", 4))
+
+    # Run the update pipeline in a dedicated worker process ("process") or in a thread of the web process ("thread")
+    PIPELINE_WORKER_MODE = os.getenv("PIPELINE_WORKER_MODE", "process")
+
+    # Crawl the technical indicators in chunks of N stocks, and reduce each chunk before the next one (0 keeps every full history)
+    TECHNICAL_CHUNK_SIZE = int(os.getenv("TECHNICAL_CHUNK_SIZE", 100))
+
+    # Upper bound of the trading days of technical indicator history requested per stock (planned from the strategies)
+    MAX_TECHNICAL_HISTORY_DAYS = int(os.getenv("MAX_TECHNICAL_HISTORY_DAYS", 240))
+
+    # Only fetch the missing days of the technical indicators which are already in the history store (at most N trading days behind)
+    TECHNICAL_DELTA_FETCH = os.getenv("TECHNICAL_DELTA_FETCH", "true").lower() == "true"
+    MAX_DELTA_FETCH_DAYS = int(os.getenv("MAX_DELTA_FETCH_DAYS", 10))
+
+    # Retry the stocks whose technical data failed: rounds (with a doubling backoff), seconds between requests, and total requests
+    TECHNICAL_RETRY_ROUNDS = int(os.getenv("TECHNICAL_RETRY_ROUNDS", 3))
+    TECHNICAL_RETRY_BACKOFF_SECONDS = float(os.getenv("TECHNICAL_RETRY_BACKOFF_SECONDS", 10))
+    TECHNICAL_RETRY_INTERVAL_SECONDS = float(os.getenv("TECHNICAL_RETRY_INTERVAL_SECONDS", 1))
+    TECHNICAL_RETRY_BUDGET = int(os.getenv("TECHNICAL_RETRY_BUDGET", 300))
+
+    # Stocks kept per watch list, the best ranked first (0 keeps every stock passing the filters)
+    WATCH_LIST_TOP_K = int(os.getenv("WATCH_LIST_TOP_K", 15))
+
+    # Request rate governor per host: starting (until a rate is learned), minimum and maximum requests per second
+    RATE_GOVERNOR_SETTING = {
+        "default": {"rate": 1.0, "min_rate": 0.1, "max_rate": 5.0},
+        "histock.tw": {"rate": 3.0, "min_rate": 0.2, "max_rate": 10.0},
+        # TWSE bans clients sending more than ~3 requests per 5 seconds
+        "www.twse.com.tw": {"rate": 0.5, "min_rate": 0.1, "max_rate": 0.6},
+        "www.tpex.org.tw": {"rate": 0.5, "min_rate": 0.1, "max_rate": 1.0},
+        # Realtime quotes (`app.intraday`), same limit as the TWSE website
+        "mis.twse.com.tw": {"rate": 0.5, "min_rate": 0.1, "max_rate": 0.6},
+    }
+
+    # Deadline of the update pipeline stages (in seconds, stages not listed have no deadline), and how many stages run at the same time
+    PIPELINE_STAGE_TIMEOUT_SETTING = {
+        "twse": 600,
+        "tpex": 600,
+        "economic_events": 120,
+        "other": 4 * 60 * 60,
+        "watch_list": 600,
+        "history": 600,
+    }
+    PIPELINE_MAX_WORKERS = int(os.getenv("PIPELINE_MAX_WORKERS", 4))
+
+    # Profile the cost and selectivity of every strategy condition on each run
+    PROFILE_STRATEGIES = os.getenv("PROFILE_STRATEGIES", "false").lower() == "true"
+
+    # Compile the recursive indicators (KD, EMA/MACD, PSAR) with Numba when it is installed
+    INDICATOR_JIT = os.getenv("INDICATOR_JIT", "true").lower() == "true"
+
+    # Local directory for persisted data (snapshots, etc.)
+    DATA_DIR = os.getenv("DATA_DIR", "data")
+
     # Data Settings
     COLUMN_RENAME_SETTING = {
         # TPEX Settings